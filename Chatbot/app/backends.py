@@ -0,0 +1,173 @@
+# app/backends.py
+
+import os
+import argparse
+import warnings
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+# Inference backend of the chat model, chosen by configuration
+BACKEND_ENV = 'CHAT_BACKEND'
+DEFAULT_BACKEND = 'fp32'
+BACKENDS = ('fp32', 'int8', 'bf16', 'compile')
+
+# Fixed prompt set of the parity check
+PARITY_PROMPTS = (
+    "User: What food is good for a puppy?\nAssistant:",
+    "User: Can you recommend a toy for my cat?\nAssistant:",
+    "User: My dog chews everything. What should I buy?\nAssistant:",
+    "User: Do you have a filter for a 20 gallon fish tank?\nAssistant:",
+    "User: hi\nAssistant: Hello! How can I help you today?\nUser: I need a leash for a large dog\nAssistant:",
+)
+
+
+def bf16_supported(device='cpu'):
+    """Whether the device runs bfloat16 matmuls natively."""
+    if str(device).startswith('cuda'):
+        return torch.cuda.is_available() and torch.cuda.is_bf16_supported()
+    return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+
+
+def _conv1d_to_linear(model):
+    """Replace GPT-2's Conv1D projections by equivalent nn.Linear layers, which quantize_dynamic handles."""
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                n_in, n_out = child.weight.shape
+                linear = nn.Linear(n_in, n_out, device=child.weight.device, dtype=child.weight.dtype)
+                linear.weight = nn.Parameter(child.weight.detach().t().contiguous(), requires_grad=False)
+                linear.bias = nn.Parameter(child.bias.detach(), requires_grad=False)
+                setattr(module, name, linear)
+    return model
+
+
+def prepare_backend(model, backend=None, device='cpu'):
+    """
+    Set up a loaded chat model for inference with the given backend.
+
+    - 'fp32': the eager float32 model, unchanged.
+    - 'int8': linear layers (attention / MLP projections and the output
+      projection) dynamically quantized to int8; CPU only.
+    - 'bf16': weights and activations in bfloat16, where the device supports
+      it (falls back to 'fp32' otherwise).
+    - 'compile': the forward pass compiled with torch.compile.
+
+    A LoRA adapter model is merged first. The model may be modified in place.
+
+    Parameters:
+    - model (PreTrainedModel or PeftModel): Chat model in eval mode.
+    - backend (str, optional): One of BACKENDS; defaults to CHAT_BACKEND, then 'fp32'.
+    - device (str): Device the model runs on.
+
+    Returns:
+    - model: The model to serve.
+    - backend (str): The backend actually used.
+    """
+    backend = backend or os.environ.get(BACKEND_ENV) or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown chat backend '{backend}'. Choose from {BACKENDS}.")
+    if backend == 'fp32':
+        return model, backend
+    if hasattr(model, 'merge_and_unload'):
+        model = model.merge_and_unload()
+
+    if backend == 'int8':
+        if str(device) != 'cpu':
+            raise ValueError("The int8 backend runs on CPU only.")
+        # The output projection is tied to the embeddings; quantizing it leaves the embeddings in fp32
+        model.lm_head.weight = nn.Parameter(model.lm_head.weight.detach().clone(), requires_grad=False)
+        model.config.tie_word_embeddings = False
+        model = torch.quantization.quantize_dynamic(_conv1d_to_linear(model), {nn.Linear}, dtype=torch.qint8)
+    elif backend == 'bf16':
+        if not bf16_supported(device):
+            warnings.warn("bfloat16 is not supported on this device; using fp32.", RuntimeWarning)
+            return model, 'fp32'
+        model = model.to(torch.bfloat16)
+    elif backend == 'compile':
+        # Compiling forward keeps the model's own type, so generate() and config still work
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model.eval(), backend
+
+
+def compare_backends(backends=BACKENDS, prompts=PARITY_PROMPTS, max_new_tokens=40, load=None):
+    """
+    Parity and speed of each backend against fp32 on a fixed prompt set.
+
+    fp32 always runs first as the reference. Each backend loads its own copy of
+    the model and decodes every prompt greedily after one warm-up reply (which
+    also triggers compilation).
+
+    Parameters:
+    - backends (tuple): Backends to compare with fp32.
+    - prompts (tuple of str): Prompts to decode.
+    - max_new_tokens (int): Reply length.
+    - load (callable, optional): load(backend) -> (tokenizer, model); defaults to
+      the chat model loader (see chat_models.py).
+
+    Returns:
+    - results (dict): Per backend, 'max_logit_diff' and 'top1_agreement' of the
+      next-token logits of the prompts, 'identical_replies' (fraction of greedy
+      replies equal to fp32's), 'mean_common_prefix' (matching leading tokens),
+      and 'tokens_per_s'.
+    """
+    from generation import GenerationEngine
+
+    if load is None:
+        from chat_models import get_chat_model_loader
+        load = lambda backend: get_chat_model_loader(backend)()
+    reference, results = None, {}
+    for backend in ('fp32',) + tuple(name for name in backends if name != 'fp32'):
+        tokenizer, model = load(backend)
+        engine = GenerationEngine(tokenizer, model, profile='greedy', max_new_tokens=max_new_tokens, max_time=0)
+        logits = []
+        with torch.no_grad():
+            for prompt in prompts:
+                ids = torch.tensor([tokenizer.encode(prompt)], device=engine.device)
+                logits.append(engine.model(ids).logits[0, -1].float().cpu())
+        engine.generate(prompts[0])
+        replies, new_tokens, seconds = [], 0, 0.0
+        for prompt in prompts:
+            replies.append(list(engine.tokens(prompt)))
+            new_tokens += engine.last_stats['new_tokens']
+            seconds += engine.last_stats['seconds']
+        if reference is None:
+            reference = (logits, replies)
+        ref_logits, ref_replies = reference
+        prefixes = []
+        for reply, ref_reply in zip(replies, ref_replies):
+            n = 0
+            while n < min(len(reply), len(ref_reply)) and reply[n] == ref_reply[n]:
+                n += 1
+            prefixes.append(n)
+        results[backend] = {
+            'max_logit_diff': max(float((a - b).abs().max()) for a, b in zip(logits, ref_logits)),
+            'top1_agreement': sum(int(a.argmax() == b.argmax()) for a, b in zip(logits, ref_logits)) / len(prompts),
+            'identical_replies': sum(reply == ref for reply, ref in zip(replies, ref_replies)) / len(prompts),
+            'mean_common_prefix': sum(prefixes) / len(prompts),
+            'tokens_per_s': new_tokens / seconds if seconds > 0 else 0.0,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chat model backends with fp32 on a fixed prompt set.")
+    parser.add_argument('backends', nargs='*', help=f"Backends to compare, from {', '.join(BACKENDS)} (default: all)")
+    parser.add_argument('--max-new-tokens', type=int, default=40)
+    args = parser.parse_args()
+    unknown = [backend for backend in args.backends if backend not in BACKENDS]
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(unknown)}")
+
+    results = compare_backends(tuple(args.backends or BACKENDS), max_new_tokens=args.max_new_tokens)
+    fp32_rate = results['fp32']['tokens_per_s']
+    print(f"{'backend':<9} {'max |dlogit|':>12} {'top-1':>6} {'same reply':>10} {'prefix':>7} {'tokens/s':>9} {'speedup':>8}")
+    for backend, result in results.items():
+        speedup = f"{result['tokens_per_s'] / fp32_rate:.2f}x" if fp32_rate else '-'
+        print(f"{backend:<9} {result['max_logit_diff']:>12.4f} {result['top1_agreement']:>6.0%} "
+              f"{result['identical_replies']:>10.0%} {result['mean_common_prefix']:>7.1f} "
+              f"{result['tokens_per_s']:>9.1f} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    main()
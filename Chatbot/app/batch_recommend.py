@@ -0,0 +1,101 @@
+# app/batch_recommend.py
+
+import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Add current directory to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from recommendations import load_recommendation_system, recommend_many
+
+# Recommendation artifacts of a worker process, loaded once by _init_worker()
+_artifacts = None
+
+
+def _init_worker(shared=None):
+    global _artifacts
+    _artifacts = load_recommendation_system(shared=shared)
+
+
+def _recommend_chunk(args):
+    """Recommend for one chunk of user IDs inside a worker process."""
+    user_ids, top_k = args
+    (scorer, user_factors, item_factors, user_id_map, item_id_map, index,
+     loaded_recommendations, _, _, _, catalog, exclusions, _) = _artifacts
+    return recommend_many(user_ids, user_factors, item_factors, user_id_map, item_id_map, index,
+                          loaded_recommendations, top_k=top_k, catalog=catalog, exclusions=exclusions,
+                          scorer=scorer)
+
+
+def read_user_ids(path):
+    """Read one user ID per line, skipping blank lines."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def write_results(path, user_ids, results, top_k):
+    """
+    Write ranked ASINs to a columnar .npz file.
+
+    Columns:
+    - user_ids: (n_users,) byte strings.
+    - asins: (n_users, top_k) byte strings, ranked best first and padded with b''.
+    - counts: (n_users,) number of valid ASINs per user.
+    """
+    counts = np.array([len(asins) for asins in results], dtype=np.int32)
+    width = max((len(asin) for asins in results for asin in asins), default=1)
+    asins = np.zeros((len(results), top_k), dtype=f'S{width}')
+    for row, ranked in enumerate(results):
+        asins[row, :len(ranked)] = [asin.encode('utf-8') for asin in ranked]
+    np.savez(path, user_ids=np.array([u.encode('utf-8') for u in user_ids], dtype=np.bytes_),
+             asins=asins, counts=counts)
+
+
+def run_batch(user_ids, top_k=10, chunk_size=10000, workers=1):
+    """
+    Recommend for a list of users, chunked and optionally spread over a process pool.
+
+    Parameters:
+    - user_ids (list): The IDs of the users.
+    - top_k (int): Number of recommendations per user.
+    - chunk_size (int): Number of users per task.
+    - workers (int): Number of worker processes; 1 runs in-process.
+
+    Returns:
+    - results (list of list): Recommended ASINs per user, in input order.
+    """
+    chunks = [(user_ids[start:start + chunk_size], top_k) for start in range(0, len(user_ids), chunk_size)]
+    results = []
+    if workers <= 1:
+        _init_worker()
+        for chunk in chunks:
+            results.extend(_recommend_chunk(chunk))
+    else:
+        # Workers attach to one shared copy of the artifacts instead of loading their own
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(True,)) as executor:
+            # map() keeps chunk order, so results stay aligned with user_ids
+            for chunk_results in executor.map(_recommend_chunk, chunks):
+                results.extend(chunk_results)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-export ranked ASINs for a file of user IDs.")
+    parser.add_argument('user_ids_file', help="Text file with one user ID per line")
+    parser.add_argument('output', help="Output .npz file")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    user_ids = read_user_ids(args.user_ids_file)
+    results = run_batch(user_ids, args.top_k, args.chunk_size, args.workers)
+    write_results(args.output, user_ids, results, args.top_k)
+    print(f"Wrote recommendations for {len(user_ids)} users to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
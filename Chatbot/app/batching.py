@@ -0,0 +1,250 @@
+# app/batching.py
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import torch
+import torch.nn.functional as F
+
+from generation import NgramBlocker, StopStrings, PROFILES, select_token, legacy_past
+
+
+class _Sequence:
+    """One in-flight request of the batch."""
+
+    def __init__(self, input_ids, params, profile, max_new_tokens, deadline, stop_strings, future,
+                 no_repeat_ngram_size):
+        self.input_ids = input_ids
+        self.params = params
+        self.profile = profile
+        self.max_new_tokens = max_new_tokens
+        self.deadline = deadline
+        self.stop_strings = stop_strings
+        self.future = future
+        self.blocker = NgramBlocker(no_repeat_ngram_size, input_ids)
+        self.generated = []
+        self.reason = None
+        self.start = time.perf_counter()
+        # Position ID of the next token to feed; padding never shifts it
+        self.position = len(input_ids)
+
+
+def _pad_left(past, mask, n):
+    """Prepend `n` masked-out positions to a batch cache and its attention mask."""
+    if n <= 0:
+        return past, mask
+    past = tuple(tuple(F.pad(tensor, (0, 0, n, 0)) for tensor in layer) for layer in past)
+    return past, F.pad(mask, (n, 0))
+
+
+def _merge(past_a, mask_a, past_b, mask_b):
+    """Stack two batch caches, left-padding the shorter one."""
+    length_a, length_b = mask_a.shape[1], mask_b.shape[1]
+    past_a, mask_a = _pad_left(past_a, mask_a, length_b - length_a)
+    past_b, mask_b = _pad_left(past_b, mask_b, length_a - length_b)
+    past = tuple(tuple(torch.cat((a, b)) for a, b in zip(layer_a, layer_b)) for layer_a, layer_b in zip(past_a, past_b))
+    return past, torch.cat((mask_a, mask_b))
+
+
+def _select_rows(past, mask, rows):
+    """Keep the given batch rows, then drop leading positions that are padding in every row."""
+    index = torch.tensor(rows, device=mask.device)
+    mask = mask.index_select(0, index)
+    past = tuple(tuple(tensor.index_select(0, index) for tensor in layer) for layer in past)
+    used = torch.nonzero(mask.any(dim=0))
+    start = int(used[0]) if len(used) else mask.shape[1]
+    if start:
+        mask = mask[:, start:]
+        past = tuple(tuple(tensor[:, :, start:] for tensor in layer) for layer in past)
+    return past, mask
+
+
+class BatchScheduler:
+    """
+    Continuous batching of chat generation requests on one GenerationEngine.
+
+    Requests wait up to `max_wait` seconds to be admitted together. Their
+    prompts are left-padded into one prefill pass, then every in-flight
+    sequence advances by one token per batched forward pass over a shared,
+    left-padded KV cache (per-row position IDs keep padding from shifting
+    positions). Finished sequences leave the batch after each step, and queued
+    requests join it without waiting for the others to finish. Each reply is
+    routed back through the Future returned by submit().
+
+    Greedy and sampling profiles are batched; beam requests run as sampling and
+    prompt-lookup requests as plain greedy (same output, with the profile's no_repeat_ngram_size).
+    Conversation KV caches (ChatSession) are not used here.
+    """
+
+    def __init__(self, engine, max_batch_size=8, max_wait=0.005):
+        """
+        Parameters:
+        - engine (GenerationEngine): Model, tokenizer and defaults to serve with.
+        - max_batch_size (int): Maximum number of sequences decoded together.
+        - max_wait (float): Seconds an idle scheduler waits for more requests to batch.
+        """
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, profile=None, max_new_tokens=None, max_time=None, stop_strings=()):
+        """
+        Queue a prompt; same parameters as GenerationEngine.generate() without `session`.
+
+        Returns:
+        - future (Future): Resolves to (text, stats) like GenerationEngine.generate().
+        """
+        engine = self.engine
+        max_new_tokens = max_new_tokens or engine.max_new_tokens
+        max_time = max_time if max_time is not None else engine.max_time
+        _, token_segments = engine.encode(prompt, max_new_tokens)
+        input_ids = [token for tokens in token_segments for token in tokens]
+        max_new_tokens = min(max_new_tokens, engine.context_length - len(input_ids))
+        profile = profile or engine.profile
+        no_repeat_ngram_size = PROFILES[profile].get('no_repeat_ngram_size', engine.no_repeat_ngram_size)
+        if PROFILES[profile].get('num_beams', 1) > 1:
+            profile = 'sampling'
+        elif PROFILES[profile].get('prompt_lookup'):
+            profile = 'greedy'
+        deadline = time.perf_counter() + max_time if max_time is not None else None
+
+        future = Future()
+        self._queue.put(_Sequence(input_ids, PROFILES[profile], profile, max_new_tokens, deadline,
+                                  StopStrings(engine.tokenizer, stop_strings), future, no_repeat_ngram_size))
+        return future
+
+    def generate(self, prompt, profile=None, max_new_tokens=None, max_time=None, stop_strings=()):
+        """Blocking submit(): returns (text, stats)."""
+        return self.submit(prompt, profile, max_new_tokens, max_time, stop_strings).result()
+
+    def close(self):
+        """Stop the scheduler thread once the in-flight requests are done."""
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _admit(self, n_active):
+        """Take queued requests; when idle, wait for the first one and then up to `max_wait` for more."""
+        admitted = []
+        if n_active == 0:
+            first = self._queue.get()
+            if first is None:
+                return admitted
+            admitted.append(first)
+            deadline = time.perf_counter() + self.max_wait
+            while n_active + len(admitted) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    sequence = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if sequence is None:
+                    break
+                admitted.append(sequence)
+        while n_active + len(admitted) < self.max_batch_size:
+            try:
+                sequence = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if sequence is not None:
+                admitted.append(sequence)
+        return admitted
+
+    def _prefill(self, sequences):
+        """Run the left-padded prompts of new sequences in one pass; returns their cache, mask and last logits."""
+        device = self.engine.device
+        length = max(len(sequence.input_ids) for sequence in sequences)
+        pad = self.engine.eos_token_id
+        ids, mask, positions = [], [], []
+        for sequence in sequences:
+            n_pad = length - len(sequence.input_ids)
+            ids.append([pad] * n_pad + sequence.input_ids)
+            mask.append([0] * n_pad + [1] * len(sequence.input_ids))
+            positions.append([0] * n_pad + list(range(len(sequence.input_ids))))
+        mask = torch.tensor(mask, device=device)
+        outputs = self.engine.model(input_ids=torch.tensor(ids, device=device), attention_mask=mask,
+                                    position_ids=torch.tensor(positions, device=device), use_cache=True)
+        return legacy_past(outputs.past_key_values), mask, outputs.logits[:, -1]
+
+    def _advance(self, sequence, logits):
+        """Pick a sequence's next token; returns False once the sequence has finished."""
+        token = select_token(logits, sequence.blocker.banned(), **sequence.params)
+        if token == self.engine.eos_token_id:
+            sequence.reason = 'eos'
+            return False
+        sequence.blocker.extend([token])
+        sequence.generated.append(token)
+        if sequence.stop_strings.completed_by_last(sequence.generated):
+            sequence.reason = 'stop_string'
+        elif len(sequence.generated) >= sequence.max_new_tokens:
+            sequence.reason = 'max_tokens'
+        elif sequence.deadline is not None and time.perf_counter() >= sequence.deadline:
+            sequence.reason = 'time'
+        return sequence.reason is None
+
+    def _finish(self, sequence):
+        engine = self.engine
+        stats = engine.record(sequence.profile, len(sequence.input_ids), 0, len(sequence.generated),
+                              time.perf_counter() - sequence.start, sequence.reason)
+        text = engine.tokenizer.decode(sequence.generated, skip_special_tokens=True)
+        sequence.future.set_result((text, stats))
+
+    def _run(self):
+        active, past, mask = [], None, None
+        device = self.engine.device
+        while not (self._stopped and not active and self._queue.empty()):
+            admitted = []
+            try:
+                with torch.no_grad():
+                    admitted = self._admit(len(active))
+                    if admitted:
+                        new_past, new_mask, logits = self._prefill(admitted)
+                        keep = [row for row, sequence in enumerate(admitted) if self._advance(sequence, logits[row])]
+                        for row, sequence in enumerate(admitted):
+                            if row not in keep:
+                                self._finish(sequence)
+                        if keep:
+                            new_past, new_mask = _select_rows(new_past, new_mask, keep)
+                            admitted = [admitted[row] for row in keep]
+                            if active:
+                                past, mask = _merge(past, mask, new_past, new_mask)
+                            else:
+                                past, mask = new_past, new_mask
+                            active.extend(admitted)
+                    if not active:
+                        continue
+
+                    # One token for every in-flight sequence
+                    ids = torch.tensor([[sequence.generated[-1]] for sequence in active], device=device)
+                    positions = torch.tensor([[sequence.position] for sequence in active], device=device)
+                    mask = F.pad(mask, (0, 1), value=1)
+                    outputs = self.engine.model(input_ids=ids, attention_mask=mask, position_ids=positions,
+                                                past_key_values=past, use_cache=True)
+                    past = legacy_past(outputs.past_key_values)
+                    keep = []
+                    for row, sequence in enumerate(active):
+                        sequence.position += 1
+                        if self._advance(sequence, outputs.logits[row, -1]):
+                            keep.append(row)
+                        else:
+                            self._finish(sequence)
+                    if len(keep) < len(active):
+                        active = [active[row] for row in keep]
+                        if active:
+                            past, mask = _select_rows(past, mask, keep)
+                        else:
+                            past, mask = None, None
+            except Exception as error:
+                # Fail the requests in flight, including those admitted in this step,
+                # instead of leaving their callers waiting
+                for sequence in active + [sequence for sequence in admitted if sequence not in active]:
+                    if not sequence.future.done():
+                        sequence.future.set_exception(error)
+                active, past, mask = [], None, None
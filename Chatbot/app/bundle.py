@@ -0,0 +1,336 @@
+# app/bundle.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from functools import cached_property
+import numpy as np
+import pandas as pd
+import faiss
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from content_search import ContentSearchEngine
+from detail_store import DetailStore, build_detail_store
+from faiss_index import load_item_index
+from interaction_store import InteractionStore
+from quantized_factors import QuantizedFactors, quantized_paths
+from rec_store import RecommendationStore, write_recommendation_store
+from shared_artifacts import save_id_map, load_id_map
+from svdpp import SVDppScorer, EXPORT_FILES as SVDPP_FILES
+
+# The app can be pointed at any bundle through the environment
+BUNDLE_ENV = 'RECSYS_BUNDLE'
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+
+def vectorizer_to_arrays(vectorizer):
+    """
+    Split a fitted TfidfVectorizer into JSON parameters and plain arrays.
+
+    Returns:
+    - params (dict): Constructor parameters.
+    - terms (np.ndarray): UTF-8 term of each TF-IDF column.
+    - idf (np.ndarray): IDF weight of each column.
+    """
+    params = vectorizer.get_params()
+    for name in ('analyzer', 'preprocessor', 'tokenizer'):
+        if callable(params[name]):
+            raise ValueError(f"Cannot store a vectorizer with a custom {name} as arrays.")
+    params['dtype'] = np.dtype(params['dtype']).name
+    params['ngram_range'] = list(params['ngram_range'])
+    if isinstance(params['stop_words'], (set, frozenset)):
+        params['stop_words'] = sorted(params['stop_words'])
+    params['vocabulary'] = None
+
+    terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms[column] = term
+    terms = np.array([term.encode('utf-8') for term in terms], dtype=np.bytes_)
+    return params, terms, np.asarray(vectorizer.idf_, dtype=np.float64)
+
+
+def vectorizer_from_arrays(params, terms, idf, vocabulary=None):
+    """
+    Rebuild a fitted TfidfVectorizer from vectorizer_to_arrays() output, without unpickling.
+
+    `vocabulary` (e.g. a memory-mapped SharedIdMap of term -> column) replaces
+    the dict otherwise built from `terms`.
+    """
+    params = dict(params, dtype=np.dtype(params['dtype']).type, ngram_range=tuple(params['ngram_range']))
+    vectorizer = TfidfVectorizer(**params)
+    if vocabulary is None:
+        vocabulary = {term.decode('utf-8'): column for column, term in enumerate(terms)}
+    vectorizer.vocabulary_ = vocabulary
+    vectorizer.idf_ = np.asarray(idf)
+    return vectorizer
+
+
+def _file_entry(path):
+    """Checksum, size and (for .npy files) shape and dtype of one bundle file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    entry = {'sha256': digest.hexdigest(), 'bytes': os.path.getsize(path)}
+    if path.endswith('.npy'):
+        array = np.load(path, mmap_mode='r')
+        entry['shape'] = list(array.shape)
+        entry['dtype'] = array.dtype.str
+    return entry
+
+
+def _copy_files(src_dir, dst_dir, names):
+    os.makedirs(dst_dir)
+    for name in names:
+        shutil.copyfile(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+
+
+def _write_factors(bundle_dir, name, factors):
+    """Store factors raw; quantized factors keep their codes (and scales) as they are."""
+    path = os.path.join(bundle_dir, 'factors', f'{name}.npy')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(factors, QuantizedFactors):
+        for src, dst in zip(quantized_paths(factors.factors_path, factors.precision),
+                            quantized_paths(path, factors.precision)):
+            if src is not None:
+                shutil.copyfile(src, dst)
+        return factors.precision
+    np.save(path, np.asarray(factors, dtype=np.float32))
+    return 'float32'
+
+
+def write_bundle(bundle_dir, artifacts, version=None):
+    """
+    Write loaded artifacts as one versioned bundle directory.
+
+    Every array is stored as a raw .npy file (memory-mappable), the FAISS index in
+    its native format and the TF-IDF vectorizer as parameters + vocabulary + IDF
+    arrays. manifest.json records the bundle version, the components present and
+    the sha256, size, shape and dtype of every file. The bundle is written to a
+    temporary directory and renamed into place.
+
+    Parameters:
+    - bundle_dir (str): Output directory; must not exist yet.
+    - artifacts (tuple): As returned by load_recommendation_system().
+    - version (str, optional): Bundle version (defaults to a UTC timestamp).
+
+    Returns:
+    - manifest (dict): The written manifest.
+    """
+    (scorer, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations,
+     filtered_data, tfidf_vectorizer, tfidf_engine, _, exclusions, _) = artifacts
+    if os.path.exists(bundle_dir):
+        raise FileExistsError(f"Bundle directory {bundle_dir} already exists.")
+    parent = os.path.dirname(os.path.abspath(bundle_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.bundle-', dir=parent)
+    try:
+        components = {
+            'user_factors': _write_factors(tmp_dir, 'user_factors', user_factors),
+            'item_factors': _write_factors(tmp_dir, 'item_factors', item_factors),
+        }
+        os.makedirs(os.path.join(tmp_dir, 'id_maps'))
+        save_id_map(os.path.join(tmp_dir, 'id_maps'), 'user_id_map', user_id_map)
+        save_id_map(os.path.join(tmp_dir, 'id_maps'), 'item_id_map', item_id_map)
+        faiss.write_index(index, os.path.join(tmp_dir, 'item_index.faiss'))
+
+        recommendations_dir = os.path.join(tmp_dir, 'recommendations')
+        if isinstance(loaded_recommendations, RecommendationStore):
+            shutil.copytree(loaded_recommendations.store_dir, recommendations_dir)
+        else:
+            write_recommendation_store(recommendations_dir, loaded_recommendations.items())
+
+        details_dir = os.path.join(tmp_dir, 'product_details')
+        if isinstance(filtered_data, DetailStore):
+            shutil.copytree(filtered_data.store_dir, details_dir)
+        elif not filtered_data.empty:
+            build_detail_store(filtered_data, details_dir)
+        components['product_details'] = os.path.isdir(details_dir)
+
+        tfidf_dir = os.path.join(tmp_dir, 'tfidf')
+        os.makedirs(tfidf_dir)
+        params, terms, idf = vectorizer_to_arrays(tfidf_vectorizer)
+        matrix = tfidf_engine.matrix
+        for name, array in (('vocabulary', terms), ('idf', idf), ('data', matrix.data), ('indices', matrix.indices),
+                            ('indptr', matrix.indptr), ('posting_ptr', tfidf_engine.posting_ptr),
+                            ('posting_docs', tfidf_engine.posting_docs),
+                            ('posting_weights', tfidf_engine.posting_weights)):
+            np.save(os.path.join(tfidf_dir, f'{name}.npy'), np.asarray(array))
+        # Sorted term -> column arrays, memory-mapped as the vectorizer's vocabulary when serving
+        save_id_map(tfidf_dir, 'vocabulary', tfidf_vectorizer.vocabulary_)
+        components['tfidf'] = {'vectorizer': params, 'shape': list(matrix.shape)}
+
+        if exclusions is not None:
+            shutil.copytree(exclusions.store_dir, os.path.join(tmp_dir, 'interactions'))
+        components['interactions'] = exclusions is not None
+        if scorer is not None:
+            _copy_files(scorer.model_dir, os.path.join(tmp_dir, 'svdpp'), SVDPP_FILES)
+        components['svdpp'] = scorer is not None
+
+        files = {}
+        for root, _, names in os.walk(tmp_dir):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, tmp_dir).replace(os.sep, '/')] = _file_entry(path)
+        manifest = {
+            'format_version': BUNDLE_FORMAT_VERSION,
+            'version': version or time.strftime('%Y%m%d-%H%M%S', time.gmtime()),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'components': components,
+            'files': files,
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.rename(tmp_dir, bundle_dir)
+        return manifest
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def is_bundle(bundle_dir):
+    """Check whether `bundle_dir` holds a bundle manifest."""
+    return os.path.exists(os.path.join(bundle_dir, MANIFEST_FILE))
+
+
+class ArtifactBundle:
+    """
+    Lazy reader of a bundle written by write_bundle().
+
+    Opening a bundle only parses manifest.json. Each artifact is opened on first
+    access, arrays with mmap_mode='r', and its .npy header is checked against the
+    manifest's shape and dtype. Full checksum verification is left to verify(),
+    which reads every byte.
+    """
+
+    def __init__(self, bundle_dir):
+        self.bundle_dir = bundle_dir
+        with open(os.path.join(bundle_dir, MANIFEST_FILE), 'r') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported bundle format {self.manifest.get('format_version')} in {bundle_dir}; "
+                             f"expected {BUNDLE_FORMAT_VERSION}.")
+        self.components = self.manifest['components']
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    def path(self, name):
+        return os.path.join(self.bundle_dir, *name.split('/'))
+
+    def array(self, name):
+        """Memory-map one .npy file of the bundle, checking its shape and dtype against the manifest."""
+        entry = self.manifest['files'][name]
+        array = np.load(self.path(name), mmap_mode='r')
+        if list(array.shape) != entry['shape'] or array.dtype.str != entry['dtype']:
+            raise ValueError(f"{name} in {self.bundle_dir} does not match its manifest entry.")
+        return array
+
+    def verify(self):
+        """Recompute every checksum; returns the names of missing or corrupted files."""
+        bad = []
+        for name, entry in self.manifest['files'].items():
+            path = self.path(name)
+            if not os.path.exists(path) or _file_entry(path)['sha256'] != entry['sha256']:
+                bad.append(name)
+        return bad
+
+    def _factors(self, name):
+        precision = self.components[name]
+        if precision == 'float32':
+            return self.array(f'factors/{name}.npy')
+        return QuantizedFactors(self.path(f'factors/{name}.npy'), precision)
+
+    @cached_property
+    def user_factors(self):
+        return self._factors('user_factors')
+
+    @cached_property
+    def item_factors(self):
+        return self._factors('item_factors')
+
+    @cached_property
+    def user_id_map(self):
+        return load_id_map(self.path('id_maps'), 'user_id_map')
+
+    @cached_property
+    def item_id_map(self):
+        return load_id_map(self.path('id_maps'), 'item_id_map')
+
+    @cached_property
+    def index(self):
+        # Vector codes are memory-mapped where FAISS supports it
+        return load_item_index(self.path('item_index.faiss'), mmap=True)
+
+    @cached_property
+    def recommendations(self):
+        return RecommendationStore(self.path('recommendations'))
+
+    @cached_property
+    def product_details(self):
+        return DetailStore(self.path('product_details')) if self.components['product_details'] else pd.DataFrame()
+
+    @cached_property
+    def tfidf_vectorizer(self):
+        # Bundles written before the sorted vocabulary arrays fall back to a vocabulary dict
+        vocabulary = load_id_map(self.path('tfidf'), 'vocabulary') \
+            if 'tfidf/vocabulary_keys.npy' in self.manifest['files'] else None
+        return vectorizer_from_arrays(self.components['tfidf']['vectorizer'], self.array('tfidf/vocabulary.npy'),
+                                      self.array('tfidf/idf.npy'), vocabulary)
+
+    @cached_property
+    def tfidf_engine(self):
+        matrix = sparse.csr_matrix((self.array('tfidf/data.npy'), self.array('tfidf/indices.npy'),
+                                    self.array('tfidf/indptr.npy')),
+                                   shape=tuple(self.components['tfidf']['shape']), copy=False)
+        return ContentSearchEngine.from_arrays(self.tfidf_vectorizer, matrix, self.array('tfidf/posting_ptr.npy'),
+                                               self.array('tfidf/posting_docs.npy'),
+                                               self.array('tfidf/posting_weights.npy'))
+
+    @cached_property
+    def exclusions(self):
+        return InteractionStore(self.path('interactions')) if self.components['interactions'] else None
+
+    @cached_property
+    def scorer(self):
+        return SVDppScorer(self.path('svdpp')) if self.components['svdpp'] else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or verify a recommendation artifact bundle.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Bundle the artifacts the app currently loads")
+    build.add_argument('bundle_dir')
+    build.add_argument('--recommendations-dir', help="Source of factors, maps, index and TF-IDF files")
+    build.add_argument('--data-dir', help="Source of recommendations and product details")
+    build.add_argument('--version')
+
+    verify = subparsers.add_parser('verify', help="Check every file against the manifest checksums")
+    verify.add_argument('bundle_dir')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        from recommendations import load_recommendation_system
+        artifacts = load_recommendation_system(shared=False, bundle_dir='', recommendations_dir=args.recommendations_dir,
+                                               data_dir=args.data_dir)
+        manifest = write_bundle(args.bundle_dir, artifacts, args.version)
+        print(f"Wrote bundle {manifest['version']} with {len(manifest['files'])} files to {args.bundle_dir}")
+        return
+
+    bad = ArtifactBundle(args.bundle_dir).verify()
+    if bad:
+        print("Corrupted or missing files: " + ", ".join(bad))
+        sys.exit(1)
+    print(f"Bundle {args.bundle_dir} is intact.")
+
+
+if __name__ == "__main__":
+    main()
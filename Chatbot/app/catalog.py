@@ -0,0 +1,131 @@
+# app/catalog.py
+
+import numpy as np
+
+
+def _as_bytes(asins):
+    """Fixed-width byte strings of a sequence of ASINs (kept as is when it already is one)."""
+    if isinstance(asins, np.ndarray) and asins.dtype.kind == 'S':
+        return asins
+    asins = np.array([asin.encode('utf-8') if isinstance(asin, str) else asin for asin in asins], dtype=np.bytes_)
+    return asins if len(asins) else np.array([], dtype='S1')
+
+
+def _search(sorted_keys, keys):
+    """Positions of `keys` in the sorted byte array `sorted_keys`, -1 where absent."""
+    keys = np.asarray(keys)
+    if len(sorted_keys) == 0 or len(keys) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(np.asarray(sorted_keys[positions]) == keys, positions, -1).astype(np.int64)
+
+
+class ItemCatalog:
+    """
+    Dense item lookups shared by the recommenders and the product detail view.
+
+    Three item numberings exist in the recommendation artifacts:
+    - FAISS / factor index: the surprise internal item ID (values of item_id_map).
+    - TF-IDF row: the row of tfidf_matrix, which follows filtered_data's row order.
+    - Catalog row: the positional row of filtered_data.
+
+    ASINs are only held as sorted fixed-width byte arrays and found by binary
+    search. Those arrays are the memory-mapped ones of a SharedIdMap and a
+    DetailStore when the artifacts come from shared memory or a bundle, so a
+    worker process adds just the integer index arrays between the numberings
+    (no Python dicts or per-item objects).
+    """
+
+    def __init__(self, item_id_map, catalog_asins, popularity=None, sorted_order=None, sorted_asins=None):
+        """
+        Parameters:
+        - item_id_map (dict or SharedIdMap): Mapping from raw item ASINs to FAISS/factor indices.
+        - catalog_asins (sequence or np.ndarray): ASIN of each catalog (and TF-IDF) row;
+          a byte-string array is used without copying.
+        - popularity (sequence, optional): popularity_score of each catalog row.
+        - sorted_order, sorted_asins (np.ndarray, optional): Catalog rows ordered by
+          ASIN and their ASINs, if already available (e.g. from a DetailStore).
+        """
+        # Catalog row <-> ASIN
+        self.row_asins = _as_bytes(catalog_asins)
+        if sorted_order is None:
+            sorted_order = np.argsort(self.row_asins, kind='stable')
+        self.sorted_order = sorted_order
+        self.sorted_asins = sorted_asins if sorted_asins is not None else self.row_asins[sorted_order]
+        if popularity is None:
+            popularity = np.zeros(len(self.row_asins))
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+
+        # FAISS index <-> ASIN, through the id map's sorted keys
+        if hasattr(item_id_map, 'key_array'):
+            self.item_keys, self.item_values = item_id_map.key_array, item_id_map.value_array
+        else:
+            keys = _as_bytes(list(item_id_map))
+            values = np.fromiter(item_id_map.values(), dtype=np.int64, count=len(item_id_map))
+            order = np.argsort(keys, kind='stable')
+            self.item_keys, self.item_values = keys[order], values[order]
+        values = np.asarray(self.item_values, dtype=np.int64)
+        n_faiss = int(values.max()) + 1 if len(values) else 0
+        # Position of each FAISS index's ASIN in item_keys
+        self.faiss_keys = np.full(n_faiss, -1, dtype=np.int64)
+        self.faiss_keys[values] = np.arange(len(values))
+
+        # FAISS index <-> catalog row, -1 where an item exists on one side only
+        positions = _search(self.sorted_asins, self.item_keys)
+        found = positions >= 0
+        self.faiss_to_row = np.full(n_faiss, -1, dtype=np.int64)
+        self.row_to_faiss = np.full(len(self.row_asins), -1, dtype=np.int64)
+        rows = np.asarray(self.sorted_order)[positions[found]]
+        self.faiss_to_row[values[found]] = rows
+        self.row_to_faiss[rows] = values[found]
+
+    @classmethod
+    def from_filtered_data(cls, item_id_map, filtered_data):
+        """Build a catalog from item_id_map and the product DataFrame."""
+        if 'parent_asin' in filtered_data:
+            catalog_asins = filtered_data['parent_asin'].astype(str).tolist()
+        else:
+            catalog_asins = []
+        popularity = filtered_data['popularity_score'].to_numpy() if 'popularity_score' in filtered_data else None
+        return cls(item_id_map, catalog_asins, popularity)
+
+    @classmethod
+    def from_detail_store(cls, item_id_map, store):
+        """Build a catalog over the memory-mapped ASIN arrays of a DetailStore."""
+        return cls(item_id_map, store.asins, store.popularity(), store.sorted_order, store.sorted_asins)
+
+    def __len__(self):
+        return len(self.row_asins)
+
+    def row_of(self, asin):
+        """Return the catalog row of an ASIN, or None if it is not in the catalog."""
+        position = _search(self.sorted_asins, _as_bytes([asin]))[0]
+        return int(self.sorted_order[position]) if position >= 0 else None
+
+    def faiss_index_of(self, asin):
+        """Return the FAISS/factor index of an ASIN, or None if it has no factors."""
+        position = _search(self.item_keys, _as_bytes([asin]))[0]
+        return int(self.item_values[position]) if position >= 0 else None
+
+    def asins_from_faiss(self, item_indices):
+        """
+        Map FAISS result indices to ASINs, dropping FAISS padding (-1) and unknown indices.
+
+        Parameters:
+        - item_indices (array-like): FAISS item indices.
+
+        Returns:
+        - asins (list): ASINs in the same order.
+        """
+        item_indices = np.asarray(item_indices, dtype=np.int64)
+        valid = (item_indices >= 0) & (item_indices < len(self.faiss_keys))
+        positions = self.faiss_keys[item_indices[valid]]
+        return [asin.decode('utf-8') for asin in self.item_keys[positions[positions >= 0]]]
+
+    def asins_from_rows(self, rows):
+        """Map catalog / TF-IDF rows to ASINs."""
+        return [asin.decode('utf-8') for asin in self.row_asins[np.asarray(rows, dtype=np.int64)]]
+
+    def rows_from_faiss(self, item_indices):
+        """Map FAISS indices to catalog rows (-1 where the item has no catalog row)."""
+        return self.faiss_to_row[np.asarray(item_indices, dtype=np.int64)]
@@ -0,0 +1,475 @@
+# app/catalog_delta.py
+
+import os
+import re
+import json
+import pickle
+import argparse
+import numpy as np
+from scipy import sparse
+
+from detail_store import (build_detail_store, is_detail_store, format_description,
+                          format_details, format_categories)
+from interaction_store import search_excluding
+from quantized_factors import has_quantized, write_quantized_factors
+from rec_store import atomic_save
+from svdpp import is_svdpp_export, ITEM_BIAS_FILE, ITEM_FACTORS_FILE, IMPLICIT_FACTORS_FILE
+
+# Append-only log of new or changed products inside the delta directory
+DELTA_LOG_FILE = 'products.jsonl'
+# Number of finished compactions; a changed count means the log was replaced
+COMPACTIONS_FILE = 'compactions'
+
+
+def clean_text(text):
+    """Same cleaning as data_processing_filtering.ipynb, so delta rows match the fitted vocabulary."""
+    if not isinstance(text, str):
+        text = ''  # Convert non-string values to empty strings
+    text = re.sub(r'[^a-zA-Z\s]', '', text)  # Remove non-alphabetic characters
+    return text.lower()
+
+
+def product_text(description, categories):
+    """Build the TF-IDF input text of a product exactly as the notebook does."""
+    clean_categories = clean_text(' '.join(categories) if isinstance(categories, list) else '')
+    return clean_text(description) + ' ' + clean_categories
+
+
+def _json_default(value):
+    """JSON encoding of NumPy values in records, e.g. an item_vector taken from the factor model."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dump_record(record):
+    """One delta log line for a product record."""
+    return json.dumps(record, default=_json_default) + '\n'
+
+
+def read_compactions(delta_dir):
+    """Number of compactions of the delta log so far."""
+    try:
+        with open(os.path.join(delta_dir, COMPACTIONS_FILE), 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def normalize_record(record):
+    """Fill in defaults of a product record and compute its popularity_score if missing."""
+    record = dict(record)
+    record.setdefault('description', [])
+    record.setdefault('details', {})
+    record.setdefault('categories', [])
+    record.setdefault('average_rating', 0.0)
+    record.setdefault('rating_number', 0)
+    if record.get('popularity_score') is None:
+        # Same popularity formula as the notebook: 0.7 * avg + 0.3 * log(count)
+        count = max(float(record['rating_number']), 1.0)
+        record['popularity_score'] = 0.7 * float(record['average_rating']) + 0.3 * np.log(count)
+    return record
+
+
+class CatalogDelta:
+    """
+    Small side segment of new or changed products on top of the base artifacts.
+
+    Products are appended as JSON lines to `products.jsonl` in the delta directory
+    (later lines for the same ASIN win). The segment keeps, for its products:
+    - TF-IDF rows computed with the frozen base vectorizer,
+    - optional L2-normalized item vectors (`item_vector` in the record),
+    - the base catalog rows and FAISS indices they supersede.
+
+    Queries merge base and delta results by score; refresh() picks up lines
+    appended by other processes, and compact_catalog() folds the segment into
+    the base artifacts, which serving processes pick up on their next load.
+    Until then, a process keeps the records of a compacted log and reads the
+    log that replaced it from the start.
+    """
+
+    def __init__(self, delta_dir, tfidf_vectorizer, catalog):
+        """
+        Parameters:
+        - delta_dir (str): Directory holding the delta log, created if missing.
+        - tfidf_vectorizer (TfidfVectorizer): The base (frozen) vectorizer.
+        - catalog (ItemCatalog): Base item lookups.
+        """
+        self.delta_dir = delta_dir
+        self.log_path = os.path.join(delta_dir, DELTA_LOG_FILE)
+        self.vectorizer = tfidf_vectorizer
+        self.catalog = catalog
+        self.records = {}
+        # Which log file was read (compaction count, device, inode) and how far
+        self._log_id = None
+        self._log_offset = 0
+        # Incremented whenever the segment changes, so callers can tell stale results apart
+        self.generation = 0
+        os.makedirs(delta_dir, exist_ok=True)
+        self._rebuild()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, asin):
+        return asin in self.records
+
+    def refresh(self):
+        """Read lines appended to the log since the last refresh. Returns True if anything changed."""
+        try:
+            f = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            # A compaction moved the log away; its records stay until the base artifacts are reloaded
+            return False
+        changed = False
+        with f:
+            stat = os.fstat(f.fileno())
+            log_id = (read_compactions(self.delta_dir), stat.st_dev, stat.st_ino)
+            if log_id != self._log_id or stat.st_size < self._log_offset:
+                # A new log replaced the compacted one: read it from the start, on top of the
+                # old records, which this process's base artifacts do not contain yet
+                self._log_id = log_id
+                self._log_offset = 0
+            if stat.st_size == self._log_offset:
+                return False
+            f.seek(self._log_offset)
+            while True:
+                line = f.readline()
+                # Leave a partially written last line for the next refresh
+                if not line.endswith(b'\n'):
+                    break
+                self._log_offset = f.tell()
+                if line.strip():
+                    record = normalize_record(json.loads(line.decode('utf-8')))
+                    self.records[record['parent_asin']] = record
+                    changed = True
+        if not changed:
+            return False
+        self._rebuild()
+        self.generation += 1
+        return True
+
+    def upsert(self, record):
+        """Add or replace one product; it is visible to queries immediately."""
+        record = normalize_record(record)
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(dump_record(record))
+        self.refresh()
+
+    def _rebuild(self):
+        """Recompute the delta arrays; the segment is small, so this is cheap."""
+        self.asins = list(self.records)
+        records = [self.records[asin] for asin in self.asins]
+        texts = [product_text(r['description'], r['categories']) for r in records]
+        self.tfidf = sparse.csr_matrix(self.vectorizer.transform(texts), dtype=np.float64) if texts else None
+
+        # Base catalog rows superseded by a delta record
+        rows = [self.catalog.row_of(asin) for asin in self.asins]
+        self.replaced_rows = np.array(sorted(r for r in rows if r is not None), dtype=np.int64)
+
+        # Delta item vectors, normalized like the base FAISS index
+        with_vector = [i for i, r in enumerate(records) if r.get('item_vector') is not None]
+        self.vector_asins = [self.asins[i] for i in with_vector]
+        if with_vector:
+            # Raw factors are kept for SVD++ scoring
+            self.raw_vectors = np.array([records[i]['item_vector'] for i in with_vector], dtype=np.float32)
+            norms = np.linalg.norm(self.raw_vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.vectors = self.raw_vectors / norms
+        else:
+            self.raw_vectors = None
+            self.vectors = None
+        faiss_ids = [self.catalog.faiss_index_of(asin) for asin in self.vector_asins]
+        self.replaced_faiss = np.array(sorted(i for i in faiss_ids if i is not None), dtype=np.int64)
+
+    def search_content(self, engine, user_keywords, top_k=5):
+        """
+        Keyword search over base + delta, merged by cosine similarity.
+
+        Parameters:
+        - engine (ContentSearchEngine): Base keyword search engine.
+        - user_keywords (str): Keywords entered by the user.
+        - top_k (int): Number of products to return.
+
+        Returns:
+        - asins (list): Recommended ASINs, best first.
+        """
+        self.refresh()
+        query = engine.transform([user_keywords])
+        terms, weights = query.indices.astype(np.int64), query.data
+        # Over-fetch so superseded base rows can be dropped
+        rows, scores = engine.top_k(terms, weights, top_k + len(self.replaced_rows), return_scores=True)
+        keep = ~np.isin(rows, self.replaced_rows)
+        candidates = list(zip(scores[keep].tolist(), self.catalog.asins_from_rows(rows[keep])))
+
+        if self.tfidf is not None:
+            query_norm = np.sqrt(np.dot(weights, weights))
+            if query_norm > 0:
+                delta_scores = (self.tfidf @ query.T).toarray().ravel() / query_norm
+                candidates += list(zip(delta_scores.tolist(), self.asins))
+        candidates.sort(key=lambda pair: -pair[0])
+        return [asin for _, asin in candidates[:top_k]]
+
+    def search_vectors(self, index, user_vector, top_k=10, excluded=None):
+        """
+        FAISS search over base + delta item vectors, merged by inner product.
+
+        Parameters:
+        - index (faiss.Index): Base item index.
+        - user_vector (np.ndarray): (1, d) float32 query vector.
+        - top_k (int): Number of items to return.
+        - excluded (np.ndarray, optional): Base FAISS indices to leave out.
+
+        Returns:
+        - asins (list): Recommended ASINs, best first.
+        """
+        self.refresh()
+        excluded = np.empty(0, dtype=np.int64) if excluded is None else np.asarray(excluded, dtype=np.int64)
+        excluded = np.union1d(excluded, self.replaced_faiss)
+        scores, item_indices = search_excluding(index, user_vector, top_k, excluded)
+        valid = item_indices[0] >= 0
+        candidates = list(zip(scores[0][valid].tolist(), self.catalog.asins_from_faiss(item_indices[0][valid])))
+
+        if self.vectors is not None:
+            delta_scores = self.vectors @ np.asarray(user_vector, dtype=np.float32).reshape(-1)
+            candidates += list(zip(delta_scores.tolist(), self.vector_asins))
+        candidates.sort(key=lambda pair: -pair[0])
+        return [asin for _, asin in candidates[:top_k]]
+
+    def search_scorer(self, scorer, user_idx, top_k=10, excluded=None):
+        """
+        SVD++ ranking over base + delta items; delta items are predicted without an item bias.
+
+        Parameters:
+        - scorer (SVDppScorer): Exported SVD++ model.
+        - user_idx (int): Inner user index.
+        - top_k (int): Number of items to return.
+        - excluded (np.ndarray, optional): Base FAISS indices to leave out.
+
+        Returns:
+        - asins (list): Recommended ASINs, best first.
+        """
+        self.refresh()
+        excluded = np.empty(0, dtype=np.int64) if excluded is None else np.asarray(excluded, dtype=np.int64)
+        excluded = np.union1d(excluded, self.replaced_faiss)
+        item_indices, scores = scorer.top_k(user_idx, top_k, excluded)
+        candidates = list(zip(scores.tolist(), self.catalog.asins_from_faiss(item_indices)))
+
+        if self.raw_vectors is not None:
+            delta_scores = scorer.score_vectors(user_idx, self.raw_vectors)
+            candidates += list(zip(delta_scores.tolist(), self.vector_asins))
+        candidates.sort(key=lambda pair: -pair[0])
+        return [asin for _, asin in candidates[:top_k]]
+
+    def details(self, asin):
+        """Return the detail record of a delta product (same layout as get_product_details()), or None."""
+        self.refresh()
+        record = self.records.get(asin)
+        if record is None:
+            return None
+        return {
+            'ASIN': asin,
+            'Description': format_description(record['description']),
+            'Details': format_details(record['details']),
+            'Categories': format_categories(record['categories']),
+            'Average Rating': record['average_rating'],
+            'Number of Ratings': record['rating_number'],
+            'Popularity Score': record['popularity_score'],
+        }
+
+
+def _finish_compaction(delta_dir, compacting_path):
+    """Drop the compacted log and count the compaction, so readers know the next log is a new one."""
+    os.remove(compacting_path)
+    count = read_compactions(delta_dir) + 1
+    atomic_save(os.path.join(delta_dir, COMPACTIONS_FILE), lambda f: f.write(str(count).encode('utf-8')))
+
+
+def _update_svdpp_export(svdpp_dir, item_id_map, vector_records, n_items):
+    """
+    Write the compacted item vectors into the SVD++ export, so the scorer keeps ranking those items.
+
+    Their qi rows take the new vectors. Items new to the model get a zero bias and
+    zero implicit factors: before compaction the delta scored them without an item
+    bias, and no user has an implicit interaction with them.
+    """
+    arrays = {}
+    for name in (ITEM_FACTORS_FILE, ITEM_BIAS_FILE, IMPLICIT_FACTORS_FILE):
+        array = np.load(os.path.join(svdpp_dir, name))
+        if len(array) < n_items:
+            padding = np.zeros((n_items - len(array),) + array.shape[1:], dtype=array.dtype)
+            array = np.concatenate([array, padding])
+        arrays[name] = array
+    for record in vector_records:
+        arrays[ITEM_FACTORS_FILE][item_id_map[record['parent_asin']]] = record['item_vector']
+    for name, array in arrays.items():
+        atomic_save(os.path.join(svdpp_dir, name), lambda f, array=array: np.save(f, array))
+
+
+def _rebuild_bundle(bundle_dir, recommendations_dir, data_dir):
+    """Replace a bundle with one of the compacted artifacts; the old one no longer holds the folded-in products."""
+    import shutil
+    from bundle import write_bundle
+    from recommendations import load_recommendation_system
+
+    artifacts = load_recommendation_system(shared=False, bundle_dir='', recommendations_dir=recommendations_dir,
+                                           data_dir=data_dir)
+    new_dir, stale_dir = bundle_dir + '.new', bundle_dir + '.stale'
+    shutil.rmtree(new_dir, ignore_errors=True)
+    write_bundle(new_dir, artifacts)
+    # Processes serving the old bundle keep their memory-mapped files until they reload
+    os.replace(bundle_dir, stale_dir)
+    os.replace(new_dir, bundle_dir)
+    shutil.rmtree(stale_dir, ignore_errors=True)
+
+
+def compact_catalog(delta_dir, recommendations_dir, data_dir, bundle_dir=None):
+    """
+    Fold the delta segment into the base artifacts and start a new delta log.
+
+    Updates filtered_data_unique_asin.pkl, tfidf_matrix.npz, the product detail
+    store if there is one and, for records carrying an `item_vector`,
+    item_factors.npy (and its quantized copies), item_id_map.pkl, the SVD++
+    export's item arrays and item_index.faiss (rebuilt with the same index type
+    and parameters). Superseded product rows are dropped and every delta
+    product is appended, keeping the DataFrame and TF-IDF rows aligned.
+
+    Shared-memory copies are keyed by the source files' signature, so the next
+    load republishes them. A bundle is a snapshot and is rebuilt when given.
+
+    Parameters:
+    - delta_dir (str): Delta directory (holding products.jsonl).
+    - recommendations_dir (str): Directory with the TF-IDF, factor and FAISS artifacts.
+    - data_dir (str): Directory with filtered_data_unique_asin.pkl.
+    - bundle_dir (str, optional): Bundle serving these artifacts, replaced by a rebuilt one.
+
+    Returns:
+    - n_records (int): Number of products folded in.
+    """
+    import faiss
+    import pandas as pd
+    from faiss_index import build_item_index, index_params_of, index_type_of, set_search_params
+
+    log_path = os.path.join(delta_dir, DELTA_LOG_FILE)
+    if not os.path.exists(log_path):
+        return 0
+    # Freeze the log: new upserts go to a fresh file while we compact
+    compacting_path = log_path + '.compacting'
+    os.replace(log_path, compacting_path)
+    records = {}
+    with open(compacting_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = normalize_record(json.loads(line))
+                records[record['parent_asin']] = record
+    if not records:
+        _finish_compaction(delta_dir, compacting_path)
+        return 0
+
+    with open(os.path.join(recommendations_dir, 'tfidf_vectorizer.pkl'), 'rb') as f:
+        tfidf_vectorizer = pickle.load(f)
+    filtered_data_path = os.path.join(data_dir, 'filtered_data_unique_asin.pkl')
+    tfidf_matrix_path = os.path.join(recommendations_dir, 'tfidf_matrix.npz')
+    filtered_data = pd.read_pickle(filtered_data_path).reset_index(drop=True)
+    tfidf_matrix = sparse.csr_matrix(sparse.load_npz(tfidf_matrix_path))
+
+    # Product rows and TF-IDF rows: drop superseded rows, append every delta product
+    columns = ['parent_asin', 'description', 'details', 'categories',
+               'average_rating', 'rating_number', 'popularity_score']
+    record_list = list(records.values())
+    delta_rows = sparse.csr_matrix(tfidf_vectorizer.transform(
+        [product_text(r['description'], r['categories']) for r in record_list]))
+    keep = ~filtered_data['parent_asin'].isin(list(records)).to_numpy()
+    new_rows = pd.DataFrame([{column: record[column] for column in columns} for record in record_list])
+    filtered_data = pd.concat([filtered_data[keep], new_rows], ignore_index=True)
+    tfidf_matrix = sparse.vstack([tfidf_matrix[keep], delta_rows], format='csr')
+
+    atomic_save(tfidf_matrix_path, lambda f: sparse.save_npz(f, tfidf_matrix))
+    atomic_save(filtered_data_path, lambda f: filtered_data.to_pickle(f))
+    detail_store_dir = os.path.join(data_dir, 'product_details')
+    if is_detail_store(detail_store_dir):
+        build_detail_store(filtered_data, detail_store_dir)
+
+    # Item factors, ID map and FAISS index, for records that carry a vector
+    vector_records = [r for r in record_list if r.get('item_vector') is not None]
+    if vector_records:
+        item_factors_path = os.path.join(recommendations_dir, 'item_factors.npy')
+        item_id_map_path = os.path.join(recommendations_dir, 'item_id_map.pkl')
+        faiss_index_path = os.path.join(recommendations_dir, 'item_index.faiss')
+        item_factors = np.load(item_factors_path)
+        with open(item_id_map_path, 'rb') as f:
+            item_id_map = pickle.load(f)
+        old_index = faiss.read_index(faiss_index_path)
+        index_type = index_type_of(old_index)
+        build_params, search_params = index_params_of(old_index)
+
+        new_vectors = []
+        for record in vector_records:
+            vector = np.asarray(record['item_vector'], dtype=item_factors.dtype)
+            if record['parent_asin'] in item_id_map:
+                item_factors[item_id_map[record['parent_asin']]] = vector
+            else:
+                item_id_map[record['parent_asin']] = len(item_factors) + len(new_vectors)
+                new_vectors.append(vector)
+        if new_vectors:
+            item_factors = np.vstack([item_factors, np.array(new_vectors)])
+
+        atomic_save(item_factors_path, lambda f: np.save(f, item_factors))
+        for precision in ('float16', 'int8'):
+            # Keep quantized serving copies in step with the float32 file
+            if has_quantized(item_factors_path, precision):
+                write_quantized_factors(item_factors_path, precision, item_factors)
+        atomic_save(item_id_map_path, lambda f: pickle.dump(item_id_map, f))
+        svdpp_dir = os.path.join(recommendations_dir, 'svdpp')
+        if is_svdpp_export(svdpp_dir):
+            _update_svdpp_export(svdpp_dir, item_id_map, vector_records, len(item_factors))
+        # Keep a tuned nlist / PQ size / HNSW M and the stored nprobe / efSearch
+        index = build_item_index(item_factors, index_type, **build_params)
+        set_search_params(index, **search_params)
+        faiss.write_index(index, faiss_index_path + '.tmp')
+        os.replace(faiss_index_path + '.tmp', faiss_index_path)
+
+    if bundle_dir and os.path.exists(bundle_dir):
+        _rebuild_bundle(bundle_dir, recommendations_dir, data_dir)
+    _finish_compaction(delta_dir, compacting_path)
+    return len(records)
+
+
+def main():
+    from bundle import BUNDLE_ENV
+
+    parser = argparse.ArgumentParser(description="Manage the catalog delta segment.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add = subparsers.add_parser('add', help="Append new or changed products (JSON lines) to the delta log")
+    add.add_argument('delta_dir')
+    add.add_argument('products_jsonl')
+
+    compact = subparsers.add_parser('compact', help="Fold the delta log into the base artifacts")
+    compact.add_argument('delta_dir')
+    compact.add_argument('recommendations_dir')
+    compact.add_argument('data_dir')
+    compact.add_argument('--bundle-dir', default=os.environ.get(BUNDLE_ENV, ''),
+                         help="Bundle to rebuild from the compacted artifacts (default: $RECSYS_BUNDLE)")
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        os.makedirs(args.delta_dir, exist_ok=True)
+        n_records = 0
+        with open(args.products_jsonl, 'r', encoding='utf-8') as src, \
+                open(os.path.join(args.delta_dir, DELTA_LOG_FILE), 'a', encoding='utf-8') as dst:
+            for line in src:
+                if line.strip():
+                    dst.write(dump_record(normalize_record(json.loads(line))))
+                    n_records += 1
+        print(f"Appended {n_records} products to the delta log in {args.delta_dir}")
+    else:
+        n_records = compact_catalog(args.delta_dir, args.recommendations_dir, args.data_dir, args.bundle_dir)
+        print(f"Folded {n_records} delta products into the base artifacts")
+
+
+if __name__ == "__main__":
+    main()
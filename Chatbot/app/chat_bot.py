@@ -1,76 +1,148 @@
-import torch
 import re
+from generation import GenerationEngine, ChatSession
 
-def generate_answer(question, history, tokenizer, model):
-    # define pad_token
-    if tokenizer.pad_token is None:
-        tokenizer.add_special_tokens({'pad_token': '[PAD]'})
-        model.resize_token_embeddings(len(tokenizer))
+# build conversation history and limit to the last 3 turns
+MAX_HISTORY = 3
 
-    # build conversation history and limit to the last 3 turns
-    MAX_HISTORY = 3
-    history_text = ""
+# Engines by chat model, so each model is set up and moved to its device once
+_engines = {}
+
+def build_prompt_segments(question, history):
+    """Prompt as one text segment per turn, so a ChatSession can reuse the unchanged ones."""
+    segments = []
     for turn in history[-MAX_HISTORY:]:
         # use get() for safe access to keys
         user_text = turn.get('user', '')
         assistant_text = turn.get('assistant', '')
-        history_text += f"User: {user_text}\nAssistant: {assistant_text}\n"
-    
-    prompt = history_text + f"User: {question}\nAssistant:"
-
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    model.to(device)
-
-    # encode the prompt and generate the attention mask
-    inputs = tokenizer.encode_plus(
-        prompt,
-        return_tensors='pt',
-        truncation=True,
-        max_length=1024,  # ensure the prompt does not exceed the model's maximum input length
-        return_attention_mask=True
-    )
-    input_ids = inputs['input_ids'].to(device)
-    attention_mask = inputs['attention_mask'].to(device)
-
-    # dynamically adjust the generation length
-    max_new_tokens = 150
-    max_length = min(input_ids.shape[1] + max_new_tokens, 1024)
-    # avoid exceeding the model's maximum context window when combined with a long prompt
-
-    # generate the response
-    with torch.no_grad():
-        outputs = model.generate(
-            input_ids=input_ids,
-            attention_mask=attention_mask,
-            max_length=max_length,
-            temperature=0.7,
-            top_p=0.9,
-            do_sample=True,
-            num_beams=5,
-            no_repeat_ngram_size=2,
-            early_stopping=True,
-            eos_token_id=tokenizer.eos_token_id,
-            pad_token_id=tokenizer.eos_token_id,
-            num_return_sequences=1
-        )
-
-    # decoding
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    reply = generated_text[len(prompt):].strip()
-
-    # clean up the reply
+        segments.append(f"User: {user_text}\nAssistant: {assistant_text}\n")
+
+    segments.append(f"User: {question}\nAssistant:")
+    return segments
+
+def build_prompt(question, history):
+    return "".join(build_prompt_segments(question, history))
+
+FALLBACK_REPLY = "Sorry, I couldn't generate a response."
+# Start of the next turn; generation stops there, as everything after it is cut from the reply
+TURN_MARKERS = ("User:", "Assistant:")
+
+def _clean_text(reply):
+    reply = reply.strip()
     if "User:" in reply:
         reply = reply.split("User:")[0].strip()
     if "Assistant:" in reply:
         reply = reply.split("Assistant:")[0].strip()
-    if not reply:
-        reply = "Sorry, I couldn't generate a response."
     reply = re.sub(r'https?://\S+', '', reply)
     reply = re.sub(r'\[URL[^\]]*\]', '', reply)
     reply = re.sub(r'\s+', ' ', reply).strip()
+    return reply
 
-    # clean up GPU memory
-    if device == 'cuda':
-        torch.cuda.empty_cache()
+def clean_reply(reply):
+    return _clean_text(reply) or FALLBACK_REPLY
 
-    return reply
+class ReplyStreamCleaner:
+    """
+    clean_reply() applied incrementally to streamed text.
+
+    Text is released once later tokens can no longer change it: the trailing
+    word is held back (it may still grow into a URL or a turn marker), as is an
+    unclosed "[URL ...". Once "User:" or "Assistant:" appears the reply is
+    complete (`done`). The released chunks add up to clean_reply() of the text.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.emitted = ""
+        self.done = False
+
+    def _release(self, text):
+        clean = _clean_text(text)
+        if not clean.startswith(self.emitted):
+            return ""
+        chunk = clean[len(self.emitted):]
+        self.emitted = clean
+        return chunk
+
+    def feed(self, text):
+        """Add raw text; returns the newly released clean text (possibly empty)."""
+        if self.done:
+            return ""
+        self.raw += text
+        cuts = [self.raw.find(marker) for marker in TURN_MARKERS]
+        cuts = [cut for cut in cuts if cut >= 0]
+        if cuts:
+            self.raw = self.raw[:min(cuts)]
+            self.done = True
+            return self._release(self.raw)
+        stable = re.search(r'\S*$', self.raw).start()
+        # Never split a "[URL ...]" span (which may contain spaces): back off a word at a time
+        while stable > 0 and re.search(r'\[URL[^\]]*$', re.sub(r'https?://\S+', '', self.raw[:stable])):
+            stable = re.search(r'\S*\s*$', self.raw[:stable]).start()
+        return self._release(self.raw[:stable])
+
+    def finish(self):
+        """Release the rest once generation has ended."""
+        self.done = True
+        chunk = self._release(self.raw)
+        if not self.emitted:
+            self.emitted = chunk = FALLBACK_REPLY
+        return chunk
+
+def get_generation_engine(tokenizer, model):
+    """Return the GenerationEngine serving `model`, creating it on first use."""
+    engine = _engines.get(id(model))
+    if engine is None or engine.model is not model:
+        engine = GenerationEngine(tokenizer, model)
+        _engines[id(model)] = engine
+    return engine
+
+def generate_answer(question, history, tokenizer, model, profile=None, session=None, scheduler=None):
+    """
+    Generate the assistant's reply to a question.
+
+    Parameters:
+    - question (str): The user's message.
+    - history (list): Previous turns as {'user': ..., 'assistant': ...} dicts.
+    - tokenizer, model: As returned by the chat model loader.
+    - profile (str, optional): Decoding profile ('greedy', 'lookup', 'sampling' or 'beam',
+      see generation.py); defaults to the engine's configured profile.
+    - session (ChatSession, optional): The conversation's KV cache; the history turns it
+      already holds are not encoded again.
+    - scheduler (BatchScheduler, optional): Batch this request with concurrent ones
+      (see batching.py) instead of decoding it alone; `session` is then not used.
+
+    Returns:
+    - reply (str): The cleaned reply. The request's tokens/s and profile are on
+      get_generation_engine(tokenizer, model).last_stats.
+    """
+    if scheduler is not None:
+        reply, _ = scheduler.generate(build_prompt_segments(question, history), profile, stop_strings=TURN_MARKERS)
+        return clean_reply(reply)
+    engine = get_generation_engine(tokenizer, model)
+    reply, _ = engine.generate(build_prompt_segments(question, history), profile, session=session,
+                               stop_strings=TURN_MARKERS)
+    return clean_reply(reply)
+
+def stream_answer(question, history, tokenizer, model, profile=None, session=None):
+    """
+    Like generate_answer(), but yields the cleaned reply in chunks as tokens arrive.
+
+    Generation stops as soon as the reply reaches the next turn marker. The
+    chunks joined together are the reply.
+    """
+    engine = get_generation_engine(tokenizer, model)
+    cleaner = ReplyStreamCleaner()
+    chunks = engine.stream(build_prompt_segments(question, history), profile, session=session,
+                           stop_strings=TURN_MARKERS)
+    try:
+        for chunk in chunks:
+            released = cleaner.feed(chunk)
+            if released:
+                yield released
+            if cleaner.done:
+                break
+    finally:
+        chunks.close()
+    released = cleaner.finish()
+    if released:
+        yield released
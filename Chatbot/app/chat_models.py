@@ -1,33 +1,106 @@
 import os
+import sys
+import importlib.util
 import torch
+from safetensors import safe_open
 from transformers import GPT2Tokenizer, GPT2LMHeadModel
-from peft import PeftModel
 
-def get_chat_model_loader():
+from backends import prepare_backend
+
+# Adjust the path so MODELS_DIR is where your models_cli folder is located.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models_cli'))
+CHAT_MODEL_DIR = os.path.join(MODELS_DIR, 'gpt2')
+# Self-contained checkpoint with the LoRA adapter merged in (see export_merged_chat_model)
+MERGED_MODEL_DIR = os.path.join(MODELS_DIR, 'gpt2-merged')
+MERGED_WEIGHTS_FILE = 'model.safetensors'
+
+def load_chat_tokenizer(model_dir=CHAT_MODEL_DIR):
+    # Load the tokenizer (from the adapter folder) and set the pad token if needed.
+    chat_tokenizer = GPT2Tokenizer.from_pretrained(model_dir)
+    chat_tokenizer.pad_token = chat_tokenizer.eos_token  # Ensure the pad token is set
+    return chat_tokenizer
+
+def load_adapter_model(chat_tokenizer, model_dir=CHAT_MODEL_DIR):
+    """Base GPT-2 from its pretrained source with the LoRA adapter applied on top."""
+    from peft import PeftModel
+
+    # Load the base GPT-2 model from its original pretrained source.
+    base_model = GPT2LMHeadModel.from_pretrained("gpt2")
+
+    # ***IMPORTANT: Resize the embeddings to match the tokenizer's vocabulary.***
+    base_model.resize_token_embeddings(len(chat_tokenizer))
+
+    # Load the LoRA adapter onto the base model.
+    return PeftModel.from_pretrained(base_model, model_dir)
+
+def load_merged_model(model_dir=MERGED_MODEL_DIR):
+    """
+    Load the merged checkpoint without network access.
+
+    Parameters stored in the checkpoint are not initialized first; with accelerate
+    installed the model is built on the meta device and the safetensors weights are
+    loaded straight into it (low_cpu_mem_usage), so they are not held twice.
+    """
+    model = GPT2LMHeadModel.from_pretrained(model_dir, local_files_only=True,
+                                            low_cpu_mem_usage=importlib.util.find_spec('accelerate') is not None)
+    # from_pretrained only warns about missing weights (and shape mismatches raise already)
+    with safe_open(os.path.join(model_dir, MERGED_WEIGHTS_FILE), framework='pt') as f:
+        stored = set(f.keys())
+    expected = set(model.state_dict())
+    # The output projection is tied to the token embeddings, so it is not stored
+    missing = expected - stored - {'lm_head.weight'}
+    unexpected = stored - expected
+    if missing or unexpected:
+        raise ValueError(f"Checkpoint in {model_dir} does not match the GPT-2 config: "
+                         f"missing {sorted(missing)}, unexpected {sorted(unexpected)}")
+    return model.requires_grad_(False)
+
+def save_merged_model(adapter_model, output_dir):
+    """Merge the LoRA adapter into the base weights and save them with their config as safetensors."""
+    merged_model = adapter_model.merge_and_unload()
+    merged_model.save_pretrained(output_dir, safe_serialization=True)
+    return merged_model
+
+def export_merged_chat_model(output_dir=MERGED_MODEL_DIR):
+    """
+    One-time export: merge the LoRA adapter into the base weights and save the
+    result, with its config and tokenizer, as a self-contained checkpoint.
+
+    Returns:
+    - output_dir (str): Where the checkpoint was written.
+    """
+    chat_tokenizer = load_chat_tokenizer()
+    save_merged_model(load_adapter_model(chat_tokenizer), output_dir)
+    chat_tokenizer.save_pretrained(output_dir)
+    return output_dir
+
+def get_chat_model_loader(backend=None):
+    """
+    Parameters:
+    - backend (str, optional): Inference backend ('fp32', 'int8', 'bf16' or 'compile',
+      see backends.py); defaults to CHAT_BACKEND, then 'fp32'.
+    """
     def load_chat_model():
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        
-        # Adjust the path so MODELS_DIR is where your models_cli folder is located.
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        MODELS_DIR = os.path.abspath(os.path.join(BASE_DIR, '..', 'models_cli'))
-        chat_model_path = os.path.join(MODELS_DIR, 'gpt2')
-        
-        # Load the tokenizer (from the adapter folder) and set the pad token if needed.
-        chat_tokenizer = GPT2Tokenizer.from_pretrained(chat_model_path)
-        chat_tokenizer.pad_token = chat_tokenizer.eos_token  # Ensure the pad token is set
-        
-        # Load the base GPT-2 model from its original pretrained source.
-        base_model = GPT2LMHeadModel.from_pretrained("gpt2")
-        
-        # ***IMPORTANT: Resize the embeddings to match the tokenizer's vocabulary.***
-        base_model.resize_token_embeddings(len(chat_tokenizer))
-        
-        # Load the LoRA adapter onto the base model.
-        chat_model = PeftModel.from_pretrained(base_model, chat_model_path)
-        
+
+        # Prefer the merged checkpoint: no hub download and no adapter matmuls per token
+        if os.path.exists(os.path.join(MERGED_MODEL_DIR, MERGED_WEIGHTS_FILE)):
+            chat_tokenizer = load_chat_tokenizer(MERGED_MODEL_DIR)
+            chat_model = load_merged_model()
+        else:
+            chat_tokenizer = load_chat_tokenizer()
+            chat_model = load_adapter_model(chat_tokenizer)
+
         # Move the model to the appropriate device and set it to eval mode.
         chat_model.to(device)
         chat_model.eval()
-        
+        chat_model, _ = prepare_backend(chat_model, backend, device)
+
         return chat_tokenizer, chat_model
     return load_chat_model
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['export']:
+        sys.exit("Usage: python app/chat_models.py export")
+    print(f"Merged chat model written to {export_merged_chat_model()}")
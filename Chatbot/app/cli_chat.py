@@ -25,14 +25,22 @@ os.environ["TRANSFORMERS_VERBOSITY"] = "error"
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from recommendations import (
+    DATA_DIR,
     load_recommendation_system,
+    artifact_version,
     recommend,
     load_hot_products,
+    load_trending_engine,
+    fold_in_new_user,
     get_product_details,
     content_based_recommendation,
+    hybrid_recommendation,
 )
+from content_search import ContentSearchEngine
+from fold_in import UserVectorCache
+from result_cache import ResultCache, normalize_keywords
 from chat_models import get_chat_model_loader
-from chat_bot import generate_answer
+from chat_bot import stream_answer, get_generation_engine, ChatSession
 
 # Initialize colorama
 init(autoreset=True)
@@ -57,6 +65,8 @@ def load_model_in_background():
     for _ in tqdm(range(3), desc="Loading chat model"):
         time.sleep(1)  # Simulate loading process
     chat_tokenizer, chat_model = chat_model_loader()
+    # Set the generation engine up once, off the chat loop
+    get_generation_engine(chat_tokenizer, chat_model)
     model_loaded = True
     print(Fore.GREEN + "Chat model loaded!\n" + Style.RESET_ALL)
 
@@ -271,6 +281,13 @@ def display_hot_products(top_5_df):
         print("\n")
 
 
+def request_keywords(question, trigger_phrases):
+    """The product keywords of a recommendation request, i.e. the question without its trigger phrases."""
+    text = question.lower()
+    for phrase in trigger_phrases:
+        text = re.sub(r"\b" + re.escape(phrase) + r"s?\b", " ", text)
+    return " ".join(text.split())
+
 def generate_recommendation_response(
     user_id,
     user_factors,
@@ -282,11 +299,52 @@ def generate_recommendation_response(
     filtered_data,
     tfidf_vectorizer,
     tfidf_matrix,
+    catalog=None,
+    exclusions=None,
+    user_vectors=None,
+    delta=None,
+    scorer=None,
+    cache=None,
+    query=None,
 ):
     """Generate recommendation chat response"""
-    recommendations_list = recommend(
-        user_id, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations
-    )
+    top_k, content_top_k = 10, 5
+
+    # A user with a CF vector who also named products gets the hybrid blend of both
+    query_terms = normalize_keywords(query, tfidf_vectorizer) if query else ""
+    has_user_vector = user_id in user_id_map or (user_vectors is not None and user_id in user_vectors)
+    if query_terms and has_user_vector and catalog is not None and isinstance(tfidf_matrix, ContentSearchEngine):
+        def compute_hybrid_recommendations():
+            return hybrid_recommendation(
+                user_id, query, user_factors, item_factors, user_id_map, index, tfidf_matrix, catalog,
+                top_k=top_k, exclusions=exclusions, user_vectors=user_vectors, delta=delta, scorer=scorer,
+            )
+
+        if cache is not None:
+            hybrid_list = cache.get_or_compute(("hybrid", user_id, query_terms, top_k), compute_hybrid_recommendations)
+        else:
+            hybrid_list = compute_hybrid_recommendations()
+        if hybrid_list:
+            formatted_recommendations = ""
+            for idx, asin in enumerate(hybrid_list[:5], 1):
+                formatted_recommendations += f"{idx}. ASIN: {asin}\n"
+            response = f"""
+Assistant: Based on your interests and "{query}", I recommend the following products:
+{formatted_recommendations}
+Assistant: Would you like to know more details about any of these products? If so, please enter the corresponding number (e.g., 1).
+"""
+            return response.strip(), hybrid_list, query
+
+    def compute_recommendations():
+        return recommend(
+            user_id, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations,
+            top_k=top_k, catalog=catalog, exclusions=exclusions, user_vectors=user_vectors, delta=delta, scorer=scorer,
+        )
+
+    if cache is not None:
+        recommendations_list = cache.get_or_compute(("user", user_id, top_k), compute_recommendations)
+    else:
+        recommendations_list = compute_recommendations()
 
     user_keywords = None  # Initialize variable
 
@@ -307,9 +365,18 @@ Assistant: Would you like to know more details about any of these products? If s
         if not user_keywords:
             print(Fore.RED + "No keywords entered; unable to provide recommendations." + Style.RESET_ALL)
             return "Sorry, unable to provide recommendations.", [], None
-        content_recommendations = content_based_recommendation(
-            user_keywords, tfidf_vectorizer, tfidf_matrix, filtered_data, top_k=5
-        )
+        def compute_content_recommendations():
+            return content_based_recommendation(
+                user_keywords, tfidf_vectorizer, tfidf_matrix, filtered_data, top_k=content_top_k, catalog=catalog,
+                delta=delta,
+            )
+
+        if cache is not None:
+            # Rephrasings with the same TF-IDF terms share one entry
+            key = ("keywords", normalize_keywords(user_keywords, tfidf_vectorizer), content_top_k)
+            content_recommendations = cache.get_or_compute(key, compute_content_recommendations)
+        else:
+            content_recommendations = compute_content_recommendations()
         if content_recommendations:
             recommendations_list = content_recommendations
             formatted_recommendations = ""
@@ -335,8 +402,10 @@ def main():
     for _ in tqdm(range(3), desc="Loading recommendation system"):
         time.sleep(1)  # Simulate loading process
 
+    # The review event log is read from the same data directory as the artifacts
+    data_dir = DATA_DIR
     (
-        recommendation_model,
+        scorer,
         user_factors,
         item_factors,
         user_id_map,
@@ -346,21 +415,47 @@ def main():
         filtered_data,
         tfidf_vectorizer,
         tfidf_matrix,
-    ) = load_recommendation_system()
+        catalog,
+        exclusions,
+        delta,
+    ) = load_recommendation_system(data_dir=data_dir)
+    # Folded-in vectors for users who arrived after the model export, against the
+    # SVD++ baseline (mu + b_i) when its export is loaded
+    if scorer is not None:
+        user_vectors = UserVectorCache(item_factors, catalog, global_mean=scorer.global_mean, item_bias=scorer.bi)
+    else:
+        user_vectors = UserVectorCache(item_factors, catalog)
+    # Time-decayed hot lists per category, kept current from the review event log
+    trending = load_trending_engine(filtered_data, data_dir)
+    # Repeated users / keyword queries are answered from cache until the artifacts or
+    # the catalog delta change (refresh() picks up products appended by other processes;
+    # the cache calls it at most once per check_interval)
+    loaded_version = artifact_version(data_dir=data_dir)
+
+    def data_version():
+        delta.refresh()
+        return loaded_version, delta.generation
+
+    result_cache = ResultCache(version_fn=data_version)
     print(Fore.GREEN + "Recommendation system loaded!\n" + Style.RESET_ALL)
 
     # User login
     user_id = login()
     if not user_id:
         sys.exit(1)
+    # Users who arrived after the model export get a vector from their logged reviews
+    fold_in_new_user(user_id, user_id_map, user_vectors, data_dir=data_dir)
 
     # Load and display hot products
-    top_5_df = load_hot_products()
+    top_5_df = load_hot_products(trending, filtered_data)
     display_hot_products(top_5_df)
 
     # Chat loop
     history = []
+    # KV cache of this conversation, reused across turns
+    chat_session = ChatSession()
     print(Fore.GREEN + "=== Let’s get started! Feel free to ask me anything or request product recommendations ===" + Style.RESET_ALL)
+    print("Enter 'hot <category>' (e.g. 'hot dogs') to see what is trending in a category.")
     print("Enter 'exit' or 'quit' to end the chat.\n")
 
     # Define keywords that trigger recommendations
@@ -388,8 +483,23 @@ def main():
             print(Fore.YELLOW + "Please enter a valid question.\n" + Style.RESET_ALL)
             continue
 
+        # Category-specific hot list, e.g. "hot dogs" or "trending cats"
+        command, _, category = question.partition(" ")
+        if command.lower() in ["hot", "trending"]:
+            category = category.strip() or None
+            if category and (trending is None or trending.find_category(category) is None):
+                print(Fore.YELLOW + f"Sorry, I don't know the category '{category}'.\n" + Style.RESET_ALL)
+                continue
+            display_hot_products(load_hot_products(trending, filtered_data, category))
+            continue
+
         # Check if the input contains any recommendation keywords
         if any(keyword in question.lower() for keyword in recommendation_keywords):
+            # Reviews logged since login refresh a folded-in vector; results cached for the old one are dropped
+            previous_vector = user_vectors.get(user_id)
+            fold_in_new_user(user_id, user_id_map, user_vectors, data_dir=data_dir)
+            if user_vectors.get(user_id) is not previous_vector:
+                result_cache.invalidate()
             # Generate recommendation response and get recommendation list and user keywords
             response, recommendations_list, user_keywords = generate_recommendation_response(
                 user_id,
@@ -402,6 +512,13 @@ def main():
                 filtered_data,
                 tfidf_vectorizer,
                 tfidf_matrix,
+                catalog,
+                exclusions,
+                user_vectors,
+                delta,
+                scorer,
+                result_cache,
+                request_keywords(question, recommendation_keywords),
             )
             print(Fore.MAGENTA + f"{response}\n" + Style.RESET_ALL)
             # Do not add recommendation reply to history
@@ -420,7 +537,7 @@ def main():
                     selected_idx = int(follow_up)
                     if 1 <= selected_idx <= len(recommendations_list):
                         selected_asin = recommendations_list[selected_idx - 1]
-                        product_details = get_product_details(filtered_data, selected_asin)
+                        product_details = get_product_details(filtered_data, selected_asin, catalog, delta)
                         if product_details:
                             details_response = "Assistant: Here are the details of the product:\n"
                             for key, value in product_details.items():
@@ -443,7 +560,7 @@ def main():
                             selected_idx = int(match.group())
                             if 1 <= selected_idx <= len(recommendations_list):
                                 selected_asin = recommendations_list[selected_idx - 1]
-                                product_details = get_product_details(filtered_data, selected_asin)
+                                product_details = get_product_details(filtered_data, selected_asin, catalog, delta)
                                 if product_details:
                                     details_response = "Assistant: Here are the details of the product:\n"
                                     for key, value in product_details.items():
@@ -473,9 +590,19 @@ def main():
                     time.sleep(1)  # Simulate loading process
                 while not model_loaded:
                     time.sleep(0.5)
-            answer = generate_answer(question, history, chat_tokenizer, chat_model)
+            # Print the reply as it is generated
+            print(Fore.MAGENTA + "Assistant: ", end="", flush=True)
+            answer = ""
+            for chunk in stream_answer(question, history, chat_tokenizer, chat_model, session=chat_session):
+                print(Fore.MAGENTA + chunk, end="", flush=True)
+                answer += chunk
+            print("\n")
             history.append({"user": question, "assistant": answer})
-            print(Fore.MAGENTA + f"Assistant: {answer}\n" + Style.RESET_ALL)
+            if os.environ.get("CHAT_STATS") == "1":
+                stats = get_generation_engine(chat_tokenizer, chat_model).last_stats
+                print(Style.DIM + f"({stats['prompt_tokens'] - stats['cached_tokens']} prompt tokens encoded, "
+                      f"{stats['new_tokens']} tokens in {stats['seconds']:.2f}s, "
+                      f"{stats['tokens_per_s']:.1f} tokens/s, {stats['profile']})\n" + Style.RESET_ALL)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,200 @@
+# app/content_search.py
+
+from functools import cached_property
+import numpy as np
+from scipy import sparse
+
+# Queries per sparse product in search_many(); each product holds every
+# (query, product) pair that shares a term
+SEARCH_BATCH = 256
+# Scores are ranked at this many decimals, so products whose cosine similarities
+# only differ by rounding (summed in another order) count as tied
+SCORE_DECIMALS = 12
+
+
+class ContentSearchEngine:
+    """
+    Inverted-index keyword search over the product TF-IDF matrix.
+
+    The TF-IDF matrix (products x terms) is stored transposed as term-major CSR,
+    i.e. one posting list of (product row, weight) per term. A query only visits
+    the posting lists of its own terms, accumulates the dot products of the
+    products it touches and selects the top-k with a partial sort, so latency
+    scales with the query's posting lengths rather than the catalog size.
+
+    Scores are cosine similarities, equal to
+    `cosine_similarity(query_tfidf, tfidf_matrix)` up to rounding. Ties (at
+    SCORE_DECIMALS) are broken towards the higher product row, i.e. the order of
+    `np.argsort(scores, kind='stable')[-top_k:][::-1]`; the default (quicksort)
+    argsort of the original code left the order of tied products unspecified.
+    """
+
+    def __init__(self, tfidf_vectorizer, tfidf_matrix):
+        """
+        Parameters:
+        - tfidf_vectorizer (TfidfVectorizer or None): Vectorizer for string queries.
+        - tfidf_matrix (sparse matrix): Pre-computed TF-IDF matrix for all products.
+        """
+        self.vectorizer = tfidf_vectorizer
+        self.matrix = sparse.csr_matrix(tfidf_matrix, dtype=np.float64)
+        self.n_docs, self.n_terms = self.matrix.shape
+
+        # Posting lists: row t of the transposed matrix holds the products containing term t
+        postings = self.matrix.T.tocsr()
+        postings.sort_indices()
+        self.posting_ptr = postings.indptr.astype(np.int64)
+        self.posting_docs = postings.indices.astype(np.int64)
+        self.posting_weights = postings.data
+
+        # Fold the product norms into the posting weights so a dot product is a cosine
+        doc_norms = np.sqrt(np.asarray(self.matrix.multiply(self.matrix).sum(axis=1)).ravel())
+        doc_norms[doc_norms == 0] = 1.0
+        self.posting_weights = self.posting_weights / doc_norms[self.posting_docs]
+
+    @classmethod
+    def from_arrays(cls, tfidf_vectorizer, tfidf_matrix, posting_ptr, posting_docs, posting_weights):
+        """Wrap posting lists built by an earlier instance (e.g. memory-mapped from shared_artifacts.py)."""
+        engine = cls.__new__(cls)
+        engine.vectorizer = tfidf_vectorizer
+        engine.matrix = tfidf_matrix
+        engine.n_docs, engine.n_terms = tfidf_matrix.shape
+        engine.posting_ptr = posting_ptr
+        engine.posting_docs = posting_docs
+        engine.posting_weights = posting_weights
+        return engine
+
+    @cached_property
+    def postings(self):
+        """The posting lists as a (n_terms x n_docs) CSR matrix of norm-folded weights."""
+        return sparse.csr_matrix((self.posting_weights, self.posting_docs, self.posting_ptr),
+                                 shape=(self.n_terms, self.n_docs), copy=False)
+
+    def transform(self, queries):
+        """Vectorize a list of keyword strings into a CSR query matrix."""
+        return sparse.csr_matrix(self.vectorizer.transform(queries), dtype=np.float64)
+
+    def score(self, query_terms, query_weights):
+        """
+        Score the products sharing at least one term with a query.
+
+        Parameters:
+        - query_terms (np.ndarray): Term indices of the query.
+        - query_weights (np.ndarray): TF-IDF weights of those terms.
+
+        Returns:
+        - docs (np.ndarray): Product rows touched by the query, ascending.
+        - scores (np.ndarray): Cosine similarity of each of those products.
+        """
+        query_norm = np.sqrt(np.dot(query_weights, query_weights))
+        if query_norm == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        starts = self.posting_ptr[query_terms]
+        ends = self.posting_ptr[query_terms + 1]
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        # Gather the postings of all query terms in one go
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        docs = self.posting_docs[positions]
+        contributions = self.posting_weights[positions] * np.repeat(query_weights / query_norm, lengths)
+
+        # Sum contributions per product
+        docs, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse.ravel(), weights=contributions, minlength=len(docs))
+        return docs, scores
+
+    def top_k(self, query_terms, query_weights, top_k=5, return_scores=False):
+        """
+        Return the top-k product rows of one vectorized query, best first.
+
+        Products that share no term with the query score 0 and only fill the
+        list when fewer than `top_k` products match. With `return_scores`, the
+        cosine similarity of each returned row is returned as well.
+        """
+        docs, scores = self.score(query_terms, query_weights)
+        return self.rank(docs, scores, top_k, return_scores)
+
+    def rank(self, docs, scores, top_k, return_scores=False):
+        """Top-k of products already scored by score(), as top_k() returns them."""
+        top_k = min(top_k, self.n_docs)
+        if top_k <= 0:
+            empty = np.empty(0, dtype=np.int64)
+            return (empty, np.empty(0, dtype=np.float64)) if return_scores else empty
+
+        rounded = np.round(scores, SCORE_DECIMALS)
+        if len(docs) > top_k:
+            # Partial selection of the k best, then order only those
+            kth = np.argpartition(-rounded, top_k - 1)[:top_k]
+            threshold = rounded[kth].min()
+            # Keep every product tied with the k-th score so tie-breaking is exact
+            keep = np.flatnonzero(rounded >= threshold)
+            docs, scores, rounded = docs[keep], scores[keep], rounded[keep]
+
+        # Descending score, ties by descending product row
+        order = np.lexsort((-docs, -rounded))
+        positive = scores[order] > 0
+        ranked = docs[order][positive][:top_k]
+        ranked_scores = scores[order][positive][:top_k]
+
+        if len(ranked) < top_k:
+            # Pad with zero-score products, highest rows first
+            matched = set(ranked.tolist())
+            padding = []
+            row = self.n_docs - 1
+            while len(ranked) + len(padding) < top_k:
+                if row not in matched:
+                    padding.append(row)
+                row -= 1
+            ranked = np.concatenate((ranked, np.array(padding, dtype=np.int64)))
+            ranked_scores = np.concatenate((ranked_scores, np.zeros(len(padding))))
+        if return_scores:
+            return ranked, ranked_scores
+        return ranked
+
+    def search(self, user_keywords, top_k=5):
+        """
+        Return the top-k product rows for a keyword string.
+
+        Parameters:
+        - user_keywords (str): Keywords entered by the user.
+        - top_k (int): Number of top products to return.
+
+        Returns:
+        - rows (np.ndarray): Product (TF-IDF / catalog) rows, best first.
+        """
+        return self.search_many([user_keywords], top_k)[0]
+
+    def search_many(self, queries, top_k=5):
+        """
+        Batched search: vectorize all queries at once and score them with one
+        sparse product against the posting lists per SEARCH_BATCH queries.
+
+        Parameters:
+        - queries (list of str or sparse matrix): Keyword strings, or an already
+          vectorized (n_queries x n_terms) TF-IDF matrix.
+        - top_k (int): Number of top products to return per query.
+
+        Returns:
+        - results (list of np.ndarray): Product rows per query, best first.
+        """
+        if sparse.issparse(queries):
+            query_matrix = sparse.csr_matrix(queries, dtype=np.float64)
+        elif len(queries) == 0:
+            return []
+        else:
+            query_matrix = self.transform(list(queries))
+        query_matrix.sum_duplicates()
+        # Unit-length queries, so the products are cosine similarities
+        query_norms = np.sqrt(np.asarray(query_matrix.multiply(query_matrix).sum(axis=1)).ravel())
+        query_norms[query_norms == 0] = 1.0
+        query_matrix = sparse.csr_matrix(sparse.diags(1.0 / query_norms) @ query_matrix)
+
+        results = []
+        for start in range(0, query_matrix.shape[0], SEARCH_BATCH):
+            scores = sparse.csr_matrix(query_matrix[start:start + SEARCH_BATCH] @ self.postings)
+            for i in range(scores.shape[0]):
+                begin, end = scores.indptr[i], scores.indptr[i + 1]
+                results.append(self.rank(scores.indices[begin:end].astype(np.int64), scores.data[begin:end], top_k))
+        return results
@@ -0,0 +1,209 @@
+# app/detail_store.py
+
+import os
+import sys
+from functools import lru_cache
+import numpy as np
+
+# File names inside a product detail store directory
+ASINS_FILE = 'asins.npy'
+ORDER_FILE = 'sorted_order.npy'
+SORTED_ASINS_FILE = 'sorted_asins.npy'
+OFFSETS_FILE = 'offsets.npy'
+TEXT_FILE = 'text.bin'
+NUMBERS_FILE = 'numbers.npy'
+# Category lists, kept apart from the rendered ' > ' text, which cannot be split back safely
+CATEGORY_ROWS_FILE = 'category_rows.npy'
+CATEGORY_OFFSETS_FILE = 'category_offsets.npy'
+CATEGORY_TEXT_FILE = 'categories.bin'
+
+# Pre-rendered text fields, in the order they are laid out in text.bin
+TEXT_FIELDS = ('Description', 'Details', 'Categories')
+
+
+def format_description(description):
+    return ' '.join(description) if isinstance(description, list) else str(description)
+
+
+def format_details(details):
+    return ', '.join([f"{k}: {v}" for k, v in details.items()]) if isinstance(details, dict) else str(details)
+
+
+def format_categories(categories):
+    return ' > '.join(categories) if isinstance(categories, list) else str(categories)
+
+
+def _map_bytes(path):
+    """Memory-map a byte file (an empty file cannot be mapped)."""
+    if os.path.getsize(path) > 0:
+        return np.memmap(path, dtype=np.uint8, mode='r')
+    return np.empty(0, dtype=np.uint8)
+
+
+class DetailStore:
+    """
+    Read-only store of pre-rendered product detail records keyed by ASIN.
+
+    Records keep the catalog (filtered_data) row order. The directory holds:
+    - asins.npy: fixed-width byte ASIN of each row.
+    - sorted_order.npy: rows ordered by ASIN, for binary search.
+    - sorted_asins.npy: the ASINs in that order (stores built before it
+      existed get an in-memory copy instead).
+    - offsets.npy: int64 boundaries of the Description/Details/Categories
+      strings of each row inside text.bin (3 * n_rows + 1 entries).
+    - text.bin: the concatenated UTF-8 strings.
+    - numbers.npy: float64 (average_rating, rating_number, popularity_score) per row.
+    - category_rows.npy: int64 row pointers, row i owns categories
+      category_rows[i]:category_rows[i + 1] (n_rows + 1 entries).
+    - category_offsets.npy: int64 boundaries of each category name inside categories.bin.
+    - categories.bin: the concatenated UTF-8 category names (stores built before
+      the three category files existed split the rendered text instead).
+
+    Everything is memory-mapped; decoded records of hot items are kept in a
+    bounded LRU cache keyed by row, so an ASIN that is absent is looked up again.
+    """
+
+    def __init__(self, store_dir, cache_size=1024):
+        self.store_dir = store_dir
+        self.asins = np.load(os.path.join(store_dir, ASINS_FILE), mmap_mode='r')
+        self.sorted_order = np.load(os.path.join(store_dir, ORDER_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self.numbers = np.load(os.path.join(store_dir, NUMBERS_FILE), mmap_mode='r')
+        self.text = _map_bytes(os.path.join(store_dir, TEXT_FILE))
+        sorted_asins_path = os.path.join(store_dir, SORTED_ASINS_FILE)
+        if os.path.exists(sorted_asins_path):
+            self.sorted_asins = np.load(sorted_asins_path, mmap_mode='r')
+        else:
+            self.sorted_asins = self.asins[self.sorted_order]
+        self.category_rows = None
+        if os.path.exists(os.path.join(store_dir, CATEGORY_ROWS_FILE)):
+            self.category_rows = np.load(os.path.join(store_dir, CATEGORY_ROWS_FILE), mmap_mode='r')
+            self.category_offsets = np.load(os.path.join(store_dir, CATEGORY_OFFSETS_FILE), mmap_mode='r')
+            self.category_text = _map_bytes(os.path.join(store_dir, CATEGORY_TEXT_FILE))
+        # Per-instance LRU so separate stores do not share entries
+        self._load_row = lru_cache(maxsize=cache_size)(self._decode)
+
+    def __len__(self):
+        return len(self.asins)
+
+    def __contains__(self, asin):
+        return self.row_of(asin) is not None
+
+    def row_asins(self):
+        """Return the ASIN of each catalog row as a list of strings."""
+        return [asin.decode('utf-8') for asin in self.asins]
+
+    def popularity(self):
+        """Return the popularity_score of each catalog row."""
+        return np.asarray(self.numbers[:, 2])
+
+    def categories(self):
+        """Return the category list of each catalog row (decoded directly, bypassing the cache)."""
+        if self.category_rows is None:
+            starts, ends = np.asarray(self.offsets[2::3]), np.asarray(self.offsets[3::3])
+            text = [bytes(self.text[start:end]).decode('utf-8') for start, end in zip(starts, ends)]
+            return [categories.split(' > ') if categories else [] for categories in text]
+        offsets = np.asarray(self.category_offsets)
+        names = [bytes(self.category_text[start:end]).decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        rows = np.asarray(self.category_rows)
+        return [names[start:end] for start, end in zip(rows[:-1], rows[1:])]
+
+    def row_of(self, asin):
+        """Return the catalog row of an ASIN via binary search, or None if absent."""
+        key = asin.encode('utf-8') if isinstance(asin, str) else asin
+        if len(key) > self.asins.dtype.itemsize:
+            return None
+        pos = int(np.searchsorted(self.sorted_asins, key))
+        if pos < len(self.sorted_asins) and self.sorted_asins[pos] == key:
+            return int(self.sorted_order[pos])
+        return None
+
+    def get(self, asin):
+        """
+        Return the detail record of one product.
+
+        Parameters:
+        - asin (str): The ASIN of the product.
+
+        Returns:
+        - details (dict or None): Same layout as get_product_details(), or None if not found.
+        """
+        row = self.row_of(asin)
+        return self._load_row(row) if row is not None else None
+
+    def _decode(self, row):
+        """Decode the detail record of one catalog row."""
+        asin = self.asins[row].decode('utf-8')
+        bounds = self.offsets[3 * row:3 * row + 4]
+        text = [bytes(self.text[bounds[i]:bounds[i + 1]]).decode('utf-8') for i in range(3)]
+        average_rating, rating_number, popularity_score = self.numbers[row]
+        details = {'ASIN': asin}
+        details.update(zip(TEXT_FIELDS, text))
+        details['Average Rating'] = float(average_rating)
+        # Products without ratings may carry NaN
+        details['Number of Ratings'] = int(np.nan_to_num(rating_number))
+        details['Popularity Score'] = float(popularity_score)
+        return details
+
+
+def build_detail_store(filtered_data, store_dir):
+    """
+    Render the detail record of every product and write a detail store.
+
+    Parameters:
+    - filtered_data (pd.DataFrame): DataFrame containing product details.
+    - store_dir (str): Output directory, created if missing.
+
+    Returns:
+    - n_products (int): Number of records written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    asins = np.array([str(asin).encode('utf-8') for asin in filtered_data['parent_asin']], dtype=np.bytes_)
+    if len(asins) == 0:
+        asins = np.array([], dtype='S1')
+
+    offsets = [0]
+    category_rows, category_offsets = [0], [0]
+    with open(os.path.join(store_dir, TEXT_FILE), 'wb') as f, \
+            open(os.path.join(store_dir, CATEGORY_TEXT_FILE), 'wb') as category_file:
+        columns = zip(filtered_data['description'], filtered_data['details'], filtered_data['categories'])
+        for description, details, categories in columns:
+            for text in (format_description(description), format_details(details), format_categories(categories)):
+                encoded = text.encode('utf-8')
+                f.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+            names = categories if isinstance(categories, list) else []
+            for name in names:
+                encoded = str(name).encode('utf-8')
+                category_file.write(encoded)
+                category_offsets.append(category_offsets[-1] + len(encoded))
+            category_rows.append(category_rows[-1] + len(names))
+
+    numbers = filtered_data[['average_rating', 'rating_number', 'popularity_score']].to_numpy(dtype=np.float64)
+    numbers[:, 1] = np.nan_to_num(numbers[:, 1])
+    sorted_order = np.argsort(asins, kind='stable').astype(np.int64)
+
+    np.save(os.path.join(store_dir, ASINS_FILE), asins)
+    np.save(os.path.join(store_dir, ORDER_FILE), sorted_order)
+    np.save(os.path.join(store_dir, SORTED_ASINS_FILE), asins[sorted_order])
+    np.save(os.path.join(store_dir, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(store_dir, NUMBERS_FILE), numbers.reshape(-1, 3))
+    np.save(os.path.join(store_dir, CATEGORY_ROWS_FILE), np.array(category_rows, dtype=np.int64))
+    np.save(os.path.join(store_dir, CATEGORY_OFFSETS_FILE), np.array(category_offsets, dtype=np.int64))
+    return len(asins)
+
+
+def is_detail_store(store_dir):
+    """Check whether `store_dir` contains a complete detail store."""
+    return all(os.path.exists(os.path.join(store_dir, name))
+               for name in (ASINS_FILE, ORDER_FILE, OFFSETS_FILE, TEXT_FILE, NUMBERS_FILE))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python detail_store.py <filtered_data_unique_asin.pkl> <output_store_dir>")
+        sys.exit(1)
+    import pandas as pd
+    n_products = build_detail_store(pd.read_pickle(sys.argv[1]), sys.argv[2])
+    print(f"Wrote detail records for {n_products} products into {sys.argv[2]}")
@@ -0,0 +1,261 @@
+# app/faiss_index.py
+
+import os
+import time
+import argparse
+import numpy as np
+import faiss
+
+# Supported item index types and their default construction parameters
+INDEX_DEFAULTS = {
+    'flat': {},
+    'ivf_flat': {'nlist': 1024},
+    # pq_m None picks the largest divisor of the factor dimension up to MAX_PQ_M
+    'ivf_pq': {'nlist': 1024, 'pq_m': None, 'pq_bits': 8},
+    'hnsw': {'hnsw_m': 32, 'ef_construction': 200},
+    # Scalar-quantized flat indexes matching the float16 / int8 factor files (quantized_factors.py)
+    'sq_fp16': {},
+    'sq_int8': {},
+}
+
+# Upper bound on the automatic number of PQ sub-quantizers
+MAX_PQ_M = 16
+
+# Query-time parameters can be set per deployment through the environment
+NPROBE_ENV = 'FAISS_NPROBE'
+EF_SEARCH_ENV = 'FAISS_EF_SEARCH'
+
+
+def default_pq_m(d, limit=MAX_PQ_M):
+    """Largest number of PQ sub-quantizers that divides the dimension `d` and is at most `limit`."""
+    return max(m for m in range(1, min(d, limit) + 1) if d % m == 0)
+
+
+def build_item_index(item_factors, index_type='flat', normalize=True, **params):
+    """
+    Build an inner-product FAISS index over the item factors.
+
+    Parameters:
+    - item_factors (np.ndarray): Item factor matrix, one row per FAISS item index.
+    - index_type (str): One of 'flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq_fp16', 'sq_int8'.
+    - normalize (bool): L2-normalize the vectors first, as the CF_model export does.
+    - params: Overrides for INDEX_DEFAULTS (nlist, pq_m, pq_bits, hnsw_m, ef_construction).
+
+    Returns:
+    - index (faiss.Index): The trained index with all items added.
+    """
+    if index_type not in INDEX_DEFAULTS:
+        raise ValueError(f"Unknown index type '{index_type}'. Choose from {sorted(INDEX_DEFAULTS)}.")
+    config = dict(INDEX_DEFAULTS[index_type], **params)
+
+    vectors = np.ascontiguousarray(item_factors, dtype='float32')
+    if normalize:
+        vectors = vectors.copy()
+        faiss.normalize_L2(vectors)
+    n_items, d = vectors.shape
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatIP(d)
+    elif index_type in ('sq_fp16', 'sq_int8'):
+        qtype = faiss.ScalarQuantizer.QT_fp16 if index_type == 'sq_fp16' else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(d, qtype, faiss.METRIC_INNER_PRODUCT)
+        # Learns the per-dimension value ranges (a no-op for float16)
+        index.train(vectors)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, config['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = config['ef_construction']
+    else:
+        # IVF needs enough training points per list; shrink nlist for small catalogs
+        nlist = max(1, min(config['nlist'], n_items // 39))
+        quantizer = faiss.IndexFlatIP(d)
+        if index_type == 'ivf_flat':
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            pq_m = config['pq_m'] or default_pq_m(d)
+            if d % pq_m != 0:
+                raise ValueError(f"pq_m={pq_m} must divide the factor dimension {d}.")
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, config['pq_bits'],
+                                     faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+
+    index.add(vectors)
+    return index
+
+
+def index_type_of(index):
+    """Return the INDEX_DEFAULTS name of a loaded item index."""
+    if hasattr(index, 'hnsw'):
+        return 'hnsw'
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return 'ivf_pq' if isinstance(faiss.downcast_index(ivf), faiss.IndexIVFPQ) else 'ivf_flat'
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return 'sq_fp16' if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else 'sq_int8'
+    return 'flat'
+
+
+def index_params_of(index):
+    """
+    Return the construction and query-time parameters of a loaded item index.
+
+    Returns:
+    - build_params (dict): build_item_index() overrides reproducing the index
+      (nlist, pq_m, pq_bits, hnsw_m, ef_construction as they apply).
+    - search_params (dict): set_search_params() arguments (nprobe, ef_search).
+    """
+    if hasattr(index, 'hnsw'):
+        # Levels above 0 hold M neighbours per node (level 0 holds 2 * M)
+        return ({'hnsw_m': int(index.hnsw.nb_neighbors(1)), 'ef_construction': int(index.hnsw.efConstruction)},
+                {'ef_search': int(index.hnsw.efSearch)})
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is None:
+        return {}, {}
+    build_params = {'nlist': int(ivf.nlist)}
+    ivf = faiss.downcast_index(ivf)
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        build_params.update(pq_m=int(ivf.pq.M), pq_bits=int(ivf.pq.nbits))
+    return build_params, {'nprobe': int(ivf.nprobe)}
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """
+    Apply query-time parameters; values that do not apply to the index type are ignored.
+
+    Parameters:
+    - index (faiss.Index): The item index.
+    - nprobe (int or None): Number of inverted lists to visit (IVF indexes).
+    - ef_search (int or None): Size of the HNSW search queue (HNSW indexes).
+    """
+    if nprobe is not None:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = int(nprobe)
+    if ef_search is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = int(ef_search)
+
+
+def load_item_index(path, nprobe=None, ef_search=None, mmap=False):
+    """
+    Read an item index of any supported type and apply its query-time parameters.
+
+    Parameters that are not given fall back to the FAISS_NPROBE / FAISS_EF_SEARCH
+    environment variables. With `mmap`, the vector codes are memory-mapped from the
+    file (FAISS >= 1.11), so processes loading the same index share its pages.
+    """
+    if mmap and hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC)
+    else:
+        index = faiss.read_index(path)
+    if nprobe is None and os.environ.get(NPROBE_ENV):
+        nprobe = int(os.environ[NPROBE_ENV])
+    if ef_search is None and os.environ.get(EF_SEARCH_ENV):
+        ef_search = int(os.environ[EF_SEARCH_ENV])
+    set_search_params(index, nprobe, ef_search)
+    return index
+
+
+def index_memory_bytes(index):
+    """Return the serialized size of an index, a proxy for its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def benchmark_index(index, flat_index, queries, top_k=10):
+    """
+    Compare an index against the exact flat index.
+
+    Parameters:
+    - index (faiss.Index): The index under test.
+    - flat_index (faiss.Index): Exact IndexFlatIP over the same vectors.
+    - queries (np.ndarray): Query vectors (e.g. a sample of user factors).
+    - top_k (int): Cut-off for recall@k.
+
+    Returns:
+    - report (dict): recall@k, p50/p99 single-query latency in ms and memory in MB.
+    """
+    queries = np.ascontiguousarray(queries, dtype='float32')
+    _, exact = flat_index.search(queries, top_k)
+
+    latencies = []
+    found = np.empty_like(exact)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, found[i:i + 1] = index.search(queries[i:i + 1], top_k)
+        latencies.append(time.perf_counter() - start)
+
+    hits = sum(len(set(exact[i]) & set(found[i])) for i in range(len(queries)))
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        f'recall@{top_k}': hits / float(exact.size),
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'memory_mb': index_memory_bytes(index) / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or benchmark the FAISS item index.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="Build an item index from item_factors.npy")
+    build.add_argument('item_factors')
+    build.add_argument('output')
+    build.add_argument('--type', default='flat', choices=sorted(INDEX_DEFAULTS))
+    build.add_argument('--nlist', type=int)
+    build.add_argument('--pq-m', type=int)
+    build.add_argument('--hnsw-m', type=int)
+
+    bench = subparsers.add_parser('benchmark', help="Report recall@k, latency and memory per index type")
+    bench.add_argument('item_factors')
+    bench.add_argument('user_factors')
+    bench.add_argument('--top-k', type=int, default=10)
+    bench.add_argument('--queries', type=int, default=1000)
+    bench.add_argument('--nprobe', type=int, nargs='+', default=[8, 32])
+    bench.add_argument('--ef-search', type=int, nargs='+', default=[64, 128])
+    bench.add_argument('--pq-m', type=int, help="PQ sub-quantizers for ivf_pq (default: largest divisor of d up to 16)")
+    args = parser.parse_args()
+
+    item_factors = np.load(args.item_factors)
+    if args.command == 'build':
+        params = {key: value for key, value in
+                  (('nlist', args.nlist), ('pq_m', args.pq_m), ('hnsw_m', args.hnsw_m)) if value is not None}
+        index = build_item_index(item_factors, args.type, **params)
+        faiss.write_index(index, args.output)
+        print(f"Wrote {args.type} index with {index.ntotal} items to {args.output}")
+        return
+
+    user_factors = np.load(args.user_factors, mmap_mode='r')
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(user_factors), min(args.queries, len(user_factors)), replace=False)
+    queries = np.ascontiguousarray(user_factors[np.sort(sample)], dtype='float32')
+
+    flat_index = build_item_index(item_factors, 'flat')
+    print(f"{'index':<24}{'recall@' + str(args.top_k):>12}{'p50 ms':>10}{'p99 ms':>10}{'MB':>10}")
+    runs = [('flat', {})]
+    for index_type in ('ivf_flat', 'ivf_pq'):
+        runs += [(index_type, {'nprobe': n}) for n in args.nprobe]
+    runs += [('hnsw', {'ef_search': ef}) for ef in args.ef_search]
+    runs += [('sq_fp16', {}), ('sq_int8', {})]
+
+    built = {'flat': flat_index}
+    build_params = {'ivf_pq': {'pq_m': args.pq_m}}
+    for index_type, search_params in runs:
+        if index_type not in built:
+            try:
+                built[index_type] = build_item_index(item_factors, index_type, **build_params.get(index_type, {}))
+            except ValueError as error:
+                # An incompatible setting skips this index type instead of ending the benchmark
+                print(f"{index_type:<24}skipped: {error}")
+                built[index_type] = None
+        index = built[index_type]
+        if index is None:
+            continue
+        set_search_params(index, **search_params)
+        report = benchmark_index(index, flat_index, queries, args.top_k)
+        label = index_type + ''.join(f" {k}={v}" for k, v in search_params.items())
+        print(f"{label:<24}{report[f'recall@{args.top_k}']:>12.3f}{report['p50_ms']:>10.3f}"
+              f"{report['p99_ms']:>10.3f}{report['memory_mb']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# app/fold_in.py
+
+import os
+import json
+from collections import OrderedDict
+import numpy as np
+
+
+def fold_in_user(item_factors, item_indices, ratings=None, baseline=0.0, reg=0.1):
+    """
+    Solve for a user vector against fixed item factors (one ridge regression).
+
+    Minimizes sum_i (r_i - baseline_i - q_i . p)^2 + reg * n * |p|^2 over the
+    user's interacted items, i.e. p = (Q^T Q + reg * n * I)^-1 Q^T (r - baseline).
+    The system is d x d, so this takes well under a millisecond.
+
+    Parameters:
+    - item_factors (np.ndarray): Item factor matrix (FAISS / factor index rows).
+    - item_indices (array-like): Factor indices of the items the user bought or rated.
+    - ratings (array-like, optional): Ratings of those items; implicit feedback
+      (purchases without a rating) counts as 1.0.
+    - baseline (float or array-like): Value subtracted from each rating, e.g. the
+      global mean plus item biases.
+    - reg (float): Regularization strength, scaled by the number of interactions.
+
+    Returns:
+    - user_vector (np.ndarray or None): float32 vector of length d, or None without interactions.
+    """
+    item_indices = np.asarray(item_indices, dtype=np.int64)
+    if len(item_indices) == 0:
+        return None
+    q = np.asarray(item_factors[item_indices], dtype=np.float64)
+    if ratings is None:
+        targets = np.ones(len(item_indices))
+    else:
+        targets = np.asarray(ratings, dtype=np.float64)
+    targets = targets - np.asarray(baseline, dtype=np.float64)
+
+    d = q.shape[1]
+    gram = q.T @ q + reg * len(item_indices) * np.eye(d)
+    return np.linalg.solve(gram, q.T @ targets).astype('float32')
+
+
+def _parse_event(line):
+    """
+    (user_id, parent_asin, rating) of one event log line, or None for a line that
+    is blank, malformed or lacks either ID. A missing rating counts as 1.0.
+    """
+    try:
+        event = json.loads(line)
+        if not isinstance(event, dict):
+            return None
+        user_id, asin, rating = event.get('user_id'), event.get('parent_asin'), event.get('rating')
+        if not isinstance(user_id, str) or not isinstance(asin, str):
+            return None
+        return user_id, asin, 1.0 if rating is None else float(rating)
+    except (ValueError, TypeError):
+        return None
+
+
+class InteractionLog:
+    """
+    Per-user index into a JSON-lines review / purchase event log.
+
+    refresh() indexes only the lines appended since its last call, keeping the
+    byte offset of every user's lines, so collecting one user's interactions
+    reads their own lines instead of the whole log. Blank, partially written
+    and malformed lines are skipped.
+    """
+
+    def __init__(self, events_path):
+        self.events_path = events_path
+        self.offset = 0
+        self._lines = {}
+
+    def refresh(self):
+        """
+        Index the complete lines appended since the last call (all of them after a truncation).
+
+        Returns:
+        - n_events (int): Number of events indexed.
+        """
+        if self.events_path is None or not os.path.exists(self.events_path):
+            return 0
+        if os.path.getsize(self.events_path) < self.offset:
+            self.offset, self._lines = 0, {}
+        n_events = 0
+        with open(self.events_path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                start = self.offset
+                line = f.readline()
+                # Leave a partially written last line for the next call
+                if not line or not line.endswith(b'\n'):
+                    break
+                self.offset = f.tell()
+                event = _parse_event(line)
+                if event is not None:
+                    self._lines.setdefault(event[0], []).append(start)
+                    n_events += 1
+        return n_events
+
+    def count(self, user_id):
+        """Number of indexed events of a user."""
+        return len(self._lines.get(user_id, ()))
+
+    def interactions(self, user_id):
+        """
+        Collect one user's indexed interactions. A later event on the same ASIN
+        replaces the earlier one.
+
+        Returns:
+        - asins (list): The user's interacted ASINs, in first-seen order.
+        - ratings (list): Their ratings, aligned with `asins`.
+        """
+        ratings = {}
+        offsets = self._lines.get(user_id)
+        if offsets:
+            with open(self.events_path, 'rb') as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    _, asin, rating = _parse_event(f.readline())
+                    ratings[asin] = rating
+        return list(ratings), list(ratings.values())
+
+
+def read_user_interactions(events_path, user_id):
+    """
+    Collect one user's interactions from a JSON-lines review / purchase event log.
+
+    Lines need 'user_id' and 'parent_asin'; 'rating' is optional (purchases
+    without one count as implicit feedback, 1.0). A later event on the same
+    ASIN replaces the earlier one. This reads the whole log; use an
+    InteractionLog to look up users repeatedly.
+
+    Returns:
+    - asins (list): The user's interacted ASINs, in first-seen order.
+    - ratings (list): Their ratings, aligned with `asins`.
+    """
+    log = InteractionLog(events_path)
+    log.refresh()
+    return log.interactions(user_id)
+
+
+class UserVectorCache:
+    """
+    Bounded LRU cache of folded-in vectors for users missing from user_id_map.
+
+    Vectors are computed by fold_in_user() from a user's interactions and can be
+    passed straight to FAISS, so new users get personalized retrieval without
+    retraining the model.
+    """
+
+    def __init__(self, item_factors, catalog, max_users=100000, reg=0.1, global_mean=0.0, item_bias=None):
+        """
+        Parameters:
+        - item_factors (np.ndarray): Item factor matrix.
+        - catalog (ItemCatalog): Maps ASINs to factor indices.
+        - max_users (int): Maximum number of cached vectors.
+        - reg (float): Regularization strength for fold_in_user().
+        - global_mean (float), item_bias (np.ndarray, optional): mu and b_i of the model
+          (e.g. of the SVD++ export); mu + b_i is the default baseline of fold_in().
+        """
+        self.item_factors = item_factors
+        self.catalog = catalog
+        self.max_users = max_users
+        self.reg = reg
+        self.global_mean = global_mean
+        self.item_bias = item_bias
+        self._vectors = OrderedDict()
+        # Event log path -> InteractionLog
+        self._logs = {}
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def __contains__(self, user_id):
+        return user_id in self._vectors
+
+    def get(self, user_id):
+        """Return the cached vector of a user (refreshing its LRU position), or None."""
+        entry = self._vectors.get(user_id)
+        if entry is None:
+            return None
+        self._vectors.move_to_end(user_id)
+        return entry[0]
+
+    def seen_items(self, user_id):
+        """Return the sorted factor indices the user's vector was folded in from."""
+        entry = self._vectors.get(user_id)
+        return entry[1] if entry is not None else np.empty(0, dtype=np.int64)
+
+    def fold_in(self, user_id, asins, ratings=None, baseline=None, n_events=None):
+        """
+        Fold in a user from their interacted ASINs and cache the resulting vector.
+
+        ASINs without item factors are ignored.
+
+        Parameters:
+        - user_id (str): The ID of the user.
+        - asins (list): ASINs the user bought or rated.
+        - ratings (list, optional): Ratings aligned with `asins`.
+        - baseline (float or array-like, optional): See fold_in_user(); defaults to
+          global_mean plus the item biases.
+        - n_events (int, optional): Number of logged events the vector covers (see fold_in_from_log()).
+
+        Returns:
+        - user_vector (np.ndarray or None): The new vector, or None if no ASIN had factors.
+        """
+        indices = [self.catalog.faiss_index_of(asin) for asin in asins]
+        known = [i for i, idx in enumerate(indices) if idx is not None]
+        if ratings is not None:
+            ratings = np.asarray(ratings, dtype=np.float64)[known]
+        item_indices = np.array([indices[i] for i in known], dtype=np.int64)
+        if baseline is None:
+            baseline = self.global_mean
+            if self.item_bias is not None:
+                baseline = baseline + np.asarray(self.item_bias[item_indices], dtype=np.float64)
+        elif np.ndim(baseline) > 0:
+            baseline = np.asarray(baseline, dtype=np.float64)[known]
+        vector = fold_in_user(self.item_factors, item_indices, ratings, baseline, self.reg)
+        if vector is None:
+            return None
+
+        self._vectors[user_id] = (vector, np.unique(item_indices), n_events)
+        self._vectors.move_to_end(user_id)
+        while len(self._vectors) > self.max_users:
+            self._vectors.popitem(last=False)
+        return vector
+
+    def fold_in_from_log(self, user_id, events_path):
+        """
+        Fold in a user from their events in a review / purchase log (see InteractionLog).
+
+        The log is tailed from where the last call stopped. A cached vector is
+        returned as is while the user has no new events, and folded in again
+        otherwise.
+
+        Returns:
+        - user_vector (np.ndarray or None): The user's vector, or None if the user has
+          no interactions with known items.
+        """
+        log = self._logs.get(events_path)
+        if log is None:
+            log = self._logs[events_path] = InteractionLog(events_path)
+        log.refresh()
+        n_events = log.count(user_id)
+        entry = self._vectors.get(user_id)
+        if entry is not None and entry[2] == n_events:
+            self._vectors.move_to_end(user_id)
+            return entry[0]
+        asins, ratings = log.interactions(user_id)
+        vector = self.fold_in(user_id, asins, ratings, n_events=n_events) if asins else None
+        if vector is None:
+            self._vectors.pop(user_id, None)
+        return vector
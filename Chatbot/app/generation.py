@@ -0,0 +1,693 @@
+# app/generation.py
+
+import os
+import time
+import argparse
+import threading
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+# Decoding profiles; under load the engine moves down PROFILE_ORDER (most to
+# least expensive) until the request fits its time budget.
+# 'lookup' is greedy with prompt-lookup speculative decoding: fewer forward passes, opt-in
+# and not a fallback. A draft copies tokens that follow an n-gram already in the sequence,
+# so the n-gram blocker would reject every draft at the default no_repeat_ngram_size=2; the
+# profile sets its own size instead (0: replies may copy product names from the history),
+# and its output is that of greedy with the same no_repeat_ngram_size.
+PROFILES = {
+    'beam': {'num_beams': 3},
+    'sampling': {'do_sample': True, 'temperature': 0.7, 'top_k': 50, 'top_p': 0.9},
+    'greedy': {},
+    'lookup': {'prompt_lookup': True, 'no_repeat_ngram_size': 0},
+}
+PROFILE_ORDER = ('beam', 'sampling', 'greedy')
+NO_REPEAT_NGRAM_SIZE = 2
+# Prompt lookup: longest n-gram matched against earlier tokens, and draft length
+LOOKUP_MAX_NGRAM = 3
+LOOKUP_DRAFT_TOKENS = 10
+
+# Defaults can be set per deployment through the environment
+PROFILE_ENV = 'CHAT_PROFILE'
+MAX_NEW_TOKENS_ENV = 'CHAT_MAX_NEW_TOKENS'
+MAX_TIME_ENV = 'CHAT_MAX_TIME'
+NO_REPEAT_NGRAM_SIZE_ENV = 'CHAT_NO_REPEAT_NGRAM_SIZE'
+DEFAULT_PROFILE = 'sampling'
+DEFAULT_MAX_NEW_TOKENS = 150
+DEFAULT_MAX_TIME = 10.0
+# Weight of the latest request in the per-profile tokens/s estimate
+RATE_SMOOTHING = 0.3
+
+# Prompts of the prompt-lookup benchmark: questions about products detailed in earlier turns
+LOOKUP_BENCHMARK_PROMPTS = (
+    "User: Tell me about the Kong Classic Dog Toy\nAssistant: The Kong Classic Dog Toy is a durable natural "
+    "rubber chew toy for dogs. It can be stuffed with treats and is available in sizes from small to extra large.\n"
+    "User: Is the Kong Classic Dog Toy good for puppies?\nAssistant:",
+    "User: What is in Blue Buffalo Life Protection Formula Adult Dog Food?\nAssistant: Blue Buffalo Life Protection "
+    "Formula Adult Dog Food is made with real chicken, brown rice and LifeSource Bits, with no corn, wheat or soy.\n"
+    "User: Does Blue Buffalo Life Protection Formula contain chicken?\nAssistant:",
+    "User: I need a filter for a 20 gallon fish tank\nAssistant: The Aqueon QuietFlow LED Pro Aquarium Power Filter "
+    "fits tanks from 10 to 20 gallons and runs quietly.\n"
+    "User: How loud is the Aqueon QuietFlow LED Pro Aquarium Power Filter?\nAssistant:",
+    "User: hi\nAssistant: Hello! How can I help you today?\nUser: What food is good for a puppy?\nAssistant:",
+)
+
+
+class NgramBlocker:
+    """
+    Incremental no_repeat_ngram_size: bans every token that would complete an
+    n-gram already present in the sequence (prompt included), as the
+    no_repeat_ngram_size option of model.generate does.
+    """
+
+    def __init__(self, n, tokens=()):
+        self.n = n
+        self.tokens = []
+        self.seen = {}
+        self.extend(tokens)
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.tokens.append(int(token))
+            if self.n > 0 and len(self.tokens) >= self.n:
+                key = tuple(self.tokens[len(self.tokens) - self.n:-1])
+                self.seen.setdefault(key, set()).add(self.tokens[-1])
+
+    def banned(self):
+        """Tokens that may not come next."""
+        if self.n <= 0 or len(self.tokens) < self.n - 1:
+            return ()
+        return self.seen.get(tuple(self.tokens[len(self.tokens) - self.n + 1:]), ())
+
+    def allowed_prefix(self, tokens):
+        """Number of leading `tokens` that can follow in turn without completing a banned n-gram."""
+        if self.n <= 0:
+            return len(tokens)
+        sequence = self.tokens[max(len(self.tokens) - self.n + 1, 0):]
+        added = {}
+        for i, token in enumerate(tokens):
+            if len(sequence) >= self.n - 1:
+                key = tuple(sequence[len(sequence) - self.n + 1:])
+                if token in self.seen.get(key, ()) or token in added.get(key, ()):
+                    return i
+                added.setdefault(key, set()).add(token)
+            sequence.append(token)
+        return len(tokens)
+
+
+class PromptLookup:
+    """
+    Draft tokens for speculative decoding, taken from the sequence itself.
+
+    The last 1..`max_ngram` tokens are looked up among the earlier tokens
+    (prompt and reply so far, longest match and latest occurrence first); the
+    tokens that followed that occurrence are the draft. Replies often copy
+    product names and details from the history this way.
+    """
+
+    def __init__(self, max_ngram, tokens=()):
+        self.max_ngram = max_ngram
+        self.tokens = []
+        # n-gram -> index of the token that followed its latest occurrence
+        self.follows = [{} for _ in range(max_ngram + 1)]
+        self.extend(tokens)
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.tokens.append(int(token))
+            end = len(self.tokens) - 1
+            for n in range(1, min(self.max_ngram, end) + 1):
+                self.follows[n][tuple(self.tokens[end - n:end])] = end
+
+    def draft(self, max_tokens, no_repeat_ngram_size=0):
+        """
+        Up to `max_tokens` tokens that followed the latest earlier occurrence of the current suffix.
+
+        With `no_repeat_ngram_size` s > 0, suffixes of s - 1 tokens or more are not
+        matched: the first draft token would complete an n-gram the sequence already
+        has, and the blocker would reject the whole draft. Shorter matches are tried.
+        """
+        longest = min(self.max_ngram, len(self.tokens))
+        if no_repeat_ngram_size > 0:
+            longest = min(longest, no_repeat_ngram_size - 2)
+        for n in range(longest, 0, -1):
+            start = self.follows[n].get(tuple(self.tokens[len(self.tokens) - n:]))
+            if start is not None:
+                return self.tokens[start:start + max_tokens]
+        return []
+
+
+class StopStrings:
+    """
+    Detects stop strings (e.g. the next turn's "User:") in generated tokens.
+
+    Checked after every token: only the text of the last few tokens is decoded,
+    enough to hold the longest stop string, since an earlier occurrence would
+    already have stopped decoding.
+    """
+
+    def __init__(self, tokenizer, stop_strings):
+        self.tokenizer = tokenizer
+        self.stop_strings = tuple(stop_strings)
+        # Stop strings are ASCII, so each of their tokens covers at least one character
+        self.window = max((len(text) for text in self.stop_strings), default=0) + 1
+
+    def __bool__(self):
+        return bool(self.stop_strings)
+
+    def _found(self, tokens):
+        text = self.tokenizer.decode(tokens, skip_special_tokens=True)
+        return any(stop in text for stop in self.stop_strings)
+
+    def completed_by_last(self, tokens):
+        """Whether the last token of `tokens` completes a stop string."""
+        return bool(self.stop_strings) and self._found(tokens[-self.window:])
+
+    def contains(self, tokens):
+        """Whether a stop string occurs anywhere in `tokens`."""
+        return bool(self.stop_strings) and self._found(tokens)
+
+
+class _StopAllBeams(StoppingCriteria):
+    """Ends beam search once every live beam has passed a stop string."""
+
+    def __init__(self, stop_strings, prompt_length):
+        self.stop_strings = stop_strings
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        done = [self.stop_strings.contains(row[self.prompt_length:].tolist()) for row in input_ids]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class _FinishBeamsAtStop(LogitsProcessor):
+    """Forces EOS on beams that passed a stop string, so they are finalized like ended replies."""
+
+    def __init__(self, stop_strings, prompt_length, eos_token_id):
+        self.stop_strings = stop_strings
+        self.prompt_length = prompt_length
+        self.eos_token_id = eos_token_id
+
+    def __call__(self, input_ids, scores):
+        for row, ids in enumerate(input_ids):
+            if self.stop_strings.completed_by_last(ids[self.prompt_length:].tolist()):
+                scores[row] = -float('inf')
+                scores[row, self.eos_token_id] = 0.0
+        return scores
+
+
+def legacy_past(past):
+    """A model's past_key_values as a tuple of per-layer (key, value) tensors."""
+    if hasattr(past, 'to_legacy_cache'):
+        past = past.to_legacy_cache()
+    return past
+
+
+def slice_past(past, start, end):
+    """Cut the cached keys / values of positions [start, end) out of a model's past_key_values."""
+    past = legacy_past(past)
+    return tuple(tuple(tensor[:, :, start:end] for tensor in layer) for layer in past)
+
+
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class ChatSession:
+    """
+    KV cache of one conversation, reused across turns.
+
+    Holds the keys / values of the last prompt and generated reply. The next
+    turn only runs the tokens that differ from the cached ones, i.e. the new
+    question (plus the reply where cleanup changed it). When the history window
+    moves, the window is re-encoded, so replies match an uncached run. With
+    `exact=False` the oldest turn's entries are cut out of the cache instead and
+    the rest keep their original positions; this is an approximation, as they
+    were encoded with the dropped turn in view, so replies can differ from an
+    uncached run. Once positions would pass the model's context length the
+    window is re-encoded from position 0.
+    """
+
+    def __init__(self, exact=True):
+        """
+        Parameters:
+        - exact (bool): Re-encode the window when it moves. False reuses the
+          entries of the remaining turns, which saves encoding the history on
+          those turns but gives approximate replies.
+        """
+        self.exact = exact
+        self.reset()
+
+    def reset(self):
+        self.past = None
+        # Tokens whose keys / values are cached, starting at position `offset`
+        self.tokens = []
+        self.offset = 0
+        # (text, n_tokens) of the prompt segments the cached tokens start with
+        self.segments = []
+        self._token_cache = {}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def tokenize(self, tokenizer, text):
+        """Token IDs of a prompt segment; segments seen on the previous turn are not re-tokenized."""
+        tokens = self._token_cache.get(text)
+        if tokens is None:
+            tokens = tokenizer.encode(text)
+            self._token_cache[text] = tokens
+        return tokens
+
+    def plan(self, token_segments, max_new_tokens, context_length):
+        """
+        Decide what to reuse for a new prompt.
+
+        Returns:
+        - past: Cached keys / values to continue from (None to start over).
+        - n_cached (int): Number of leading prompt tokens covered by `past`.
+        - position (int): Position ID of the first token to feed.
+        """
+        prompt = [token for tokens in token_segments for token in tokens]
+        best_drop, best_match = 0, 0
+        dropped = 0
+        # Try sliding out 0, 1, ... of the oldest cached segments
+        for n_segments in range(1 if self.exact else len(self.segments) + 1):
+            match = _common_prefix(self.tokens[dropped:], prompt)
+            if match > best_match:
+                best_drop, best_match = dropped, match
+            if n_segments < len(self.segments):
+                dropped += self.segments[n_segments][1]
+        # At least one prompt token must be fed to get the next-token logits
+        best_match = min(best_match, len(prompt) - 1)
+        offset = self.offset + best_drop
+        if self.past is None or best_match <= 0 or offset + len(prompt) + max_new_tokens > context_length:
+            return None, 0, 0
+        return slice_past(self.past, best_drop, best_drop + best_match), best_match, offset + best_match
+
+    def update(self, segments, token_segments, past, tokens, offset):
+        """Remember the cache after a turn: `tokens` (starting at position `offset`) are covered by `past`."""
+        self.past = past
+        self.tokens = tokens
+        self.offset = offset
+        self.segments = [(text, len(ids)) for text, ids in zip(segments, token_segments)]
+        self._token_cache = {text: ids for text, ids in zip(segments, token_segments)}
+
+
+def select_token(logits, banned=(), do_sample=False, temperature=1.0, top_k=0, top_p=1.0):
+    """
+    Pick the next token from one row of logits.
+
+    Greedy takes the arg-max; sampling applies temperature, top-k and nucleus
+    (top-p) filtering before drawing, in the order model.generate applies them.
+    """
+    logits = logits.float()
+    if banned:
+        logits = logits.clone()
+        logits[list(banned)] = -float('inf')
+    if not do_sample:
+        return int(torch.argmax(logits))
+    logits = logits / temperature
+    if 0 < top_k < logits.shape[-1]:
+        threshold = torch.topk(logits, top_k).values[-1]
+        logits = logits.masked_fill(logits < threshold, -float('inf'))
+    if top_p < 1.0:
+        sorted_logits, sorted_indices = torch.sort(logits)
+        cumulative = sorted_logits.softmax(dim=-1).cumsum(dim=-1)
+        remove = cumulative <= 1.0 - top_p
+        remove[-1] = False
+        logits = logits.clone()
+        logits[sorted_indices[remove]] = -float('inf')
+    return int(torch.multinomial(logits.softmax(dim=-1), 1))
+
+
+class GenerationEngine:
+    """
+    Owns the chat model on its device and runs one reply per request.
+
+    Greedy and sampling profiles decode token by token on the model's KV cache,
+    so the time budget is checked after every token (the lookup profile may
+    accept several greedy tokens per forward pass); the beam profile runs
+    model.generate with the same budget as max_time. When the measured
+    tokens/s of a profile (shared by the requests in flight) cannot deliver
+    `max_new_tokens` within the budget, the request falls back to the next
+    cheaper profile. Each request reports its profile, token counts and tokens/s.
+    """
+
+    def __init__(self, tokenizer, model, device=None, profile=None, max_new_tokens=None, max_time=None,
+                 no_repeat_ngram_size=None):
+        """
+        Parameters:
+        - tokenizer (GPT2Tokenizer): Chat tokenizer.
+        - model (PreTrainedModel or PeftModel): Chat model.
+        - device (str, optional): Defaults to 'cuda' when available, else 'cpu'.
+        - profile (str, optional): Default profile; defaults to CHAT_PROFILE, then 'sampling'.
+        - max_new_tokens (int, optional): Token budget; defaults to CHAT_MAX_NEW_TOKENS, then 150.
+        - max_time (float, optional): Wall-clock budget in seconds; defaults to CHAT_MAX_TIME,
+          then 10. Zero or negative disables it.
+        - no_repeat_ngram_size (int, optional): No n-gram of this size occurs twice in prompt and
+          reply; defaults to CHAT_NO_REPEAT_NGRAM_SIZE, then 2. Zero disables it.
+        """
+        # define pad_token
+        if tokenizer.pad_token is None:
+            tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+            model.resize_token_embeddings(len(tokenizer))
+        self.tokenizer = tokenizer
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        # Moved once here instead of on every turn
+        self.model = model.to(self.device)
+        self.model.eval()
+
+        self.profile = profile or os.environ.get(PROFILE_ENV) or DEFAULT_PROFILE
+        if self.profile not in PROFILES:
+            raise ValueError(f"Unknown decoding profile '{self.profile}'. Choose from {tuple(PROFILES)}.")
+        self.max_new_tokens = max_new_tokens or int(os.environ.get(MAX_NEW_TOKENS_ENV) or DEFAULT_MAX_NEW_TOKENS)
+        if max_time is None:
+            max_time = float(os.environ.get(MAX_TIME_ENV) or DEFAULT_MAX_TIME)
+        self.max_time = max_time if max_time > 0 else None
+        if no_repeat_ngram_size is None:
+            no_repeat_ngram_size = int(os.environ.get(NO_REPEAT_NGRAM_SIZE_ENV) or NO_REPEAT_NGRAM_SIZE)
+        self.no_repeat_ngram_size = no_repeat_ngram_size
+        self.context_length = getattr(model.config, 'n_positions', 1024)
+        self.eos_token_id = tokenizer.eos_token_id
+
+        self._lock = threading.Lock()
+        self._active = 0
+        self._rates = {}
+        self.last_stats = None
+
+    def choose_profile(self, profile, max_new_tokens, max_time):
+        """Cheapest fallback needed for `max_new_tokens` to fit `max_time` at the current load."""
+        candidates = PROFILE_ORDER[PROFILE_ORDER.index(profile):] if profile in PROFILE_ORDER else (profile,)
+        for name in candidates:
+            rate = self._rates.get(name)
+            if max_time is None or rate is None:
+                return name
+            if max_new_tokens * max(self._active, 1) / rate <= max_time:
+                return name
+        return candidates[-1]
+
+    def encode(self, prompt, max_new_tokens, session=None):
+        """
+        Tokenize a prompt so the reply fits the context window.
+
+        Parameters:
+        - prompt (str or list of str): Prompt text, or its segments (one per
+          conversation turn, oldest first).
+        - max_new_tokens (int): Room to leave for the reply.
+        - session (ChatSession, optional): Reuses the token IDs of known segments.
+
+        Returns:
+        - segments (list of str), token_segments (list of list): The segments that fit,
+          dropping the oldest whole segments first, then the oldest tokens.
+        """
+        segments = [prompt] if isinstance(prompt, str) else list(prompt)
+        tokenize = (lambda text: session.tokenize(self.tokenizer, text)) if session is not None else self.tokenizer.encode
+        token_segments = [tokenize(text) for text in segments]
+        limit = max(self.context_length - max_new_tokens, 1)
+        while len(token_segments) > 1 and sum(len(tokens) for tokens in token_segments) > limit:
+            segments.pop(0)
+            token_segments.pop(0)
+        if len(token_segments[0]) > limit:
+            token_segments[0] = token_segments[0][-limit:]
+        return segments, token_segments
+
+    def _decode(self, input_ids, params, max_new_tokens, deadline, state, stop_strings, past=None, n_cached=0,
+                position=0, prompt_lookup=False, no_repeat_ngram_size=None):
+        """
+        Yield new tokens, decoded on the model's KV cache.
+
+        `past` holds the keys / values of the first `n_cached` prompt tokens, whose
+        successor gets position ID `position`. Decoding ends after the token that
+        completes a stop string. The stop reason, the final cache, the tokens it
+        covers and the number of forward passes are left in `state`.
+        `no_repeat_ngram_size` defaults to the engine's.
+
+        With `prompt_lookup` (greedy only), each forward pass also feeds a draft
+        continuation (see PromptLookup), cut before any token the n-gram blocker
+        would ban. Every draft token that equals the greedy choice after the ones
+        before it is accepted, plus the greedy token that follows them, so the
+        output is the same as one token per pass; the cache of rejected draft
+        tokens is dropped.
+        """
+        if no_repeat_ngram_size is None:
+            no_repeat_ngram_size = self.no_repeat_ngram_size
+        blocker = NgramBlocker(no_repeat_ngram_size, input_ids)
+        lookup = PromptLookup(LOOKUP_MAX_NGRAM, input_ids) if prompt_lookup else None
+        feed, fed, generated = list(input_ids[n_cached:]), list(input_ids[:n_cached]), []
+        state['reason'] = None if max_new_tokens > 0 else 'max_tokens'
+        state['forward_passes'] = 0
+        with torch.no_grad():
+            while state['reason'] is None:
+                draft = []
+                if lookup is not None:
+                    budget = min(LOOKUP_DRAFT_TOKENS, max_new_tokens - len(generated) - 1,
+                                 self.context_length - position - len(feed))
+                    if budget > 0:
+                        draft = lookup.draft(budget, no_repeat_ngram_size)
+                        draft = draft[:blocker.allowed_prefix(draft)]
+                ids = torch.tensor([feed + draft], device=self.device)
+                positions = torch.arange(position, position + ids.shape[1], device=self.device).unsqueeze(0)
+                outputs = self.model(input_ids=ids, position_ids=positions, past_key_values=past, use_cache=True)
+                state['forward_passes'] += 1
+
+                accepted = []
+                for i, logits in enumerate(outputs.logits[0, len(feed) - 1:]):
+                    token = select_token(logits, blocker.banned(), **params)
+                    if token == self.eos_token_id:
+                        state['reason'] = 'eos'
+                        break
+                    blocker.extend([token])
+                    generated.append(token)
+                    accepted.append(token)
+                    if stop_strings.completed_by_last(generated):
+                        state['reason'] = 'stop_string'
+                    elif deadline is not None and time.perf_counter() >= deadline:
+                        state['reason'] = 'time'
+                    elif len(generated) >= max_new_tokens:
+                        state['reason'] = 'max_tokens'
+                    if state['reason'] is not None or i == len(draft) or token != draft[i]:
+                        break
+
+                # The cache keeps the fed tokens and the accepted draft tokens that were context
+                covered = feed + accepted[:-1]
+                past = outputs.past_key_values
+                if len(covered) < ids.shape[1]:
+                    past = legacy_past(past)
+                    past = slice_past(past, 0, past[0][0].shape[2] - ids.shape[1] + len(covered))
+                fed.extend(covered)
+                position += len(covered)
+                state['past'], state['cached_tokens'] = past, fed
+                if lookup is not None:
+                    lookup.extend(accepted)
+                for token in accepted:
+                    yield token
+                feed = accepted[-1:]
+
+    def _beam_search(self, input_ids, params, max_new_tokens, max_time, state, stop_strings):
+        ids = torch.tensor([input_ids], device=self.device)
+        stopping = StoppingCriteriaList()
+        processors = LogitsProcessorList()
+        if stop_strings:
+            stopping.append(_StopAllBeams(stop_strings, len(input_ids)))
+            processors.append(_FinishBeamsAtStop(stop_strings, len(input_ids), self.eos_token_id))
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                max_new_tokens=max_new_tokens,
+                max_time=max_time,
+                num_beams=params['num_beams'],
+                no_repeat_ngram_size=self.no_repeat_ngram_size,
+                early_stopping=True,
+                eos_token_id=self.eos_token_id,
+                pad_token_id=self.eos_token_id,
+                num_return_sequences=1,
+                stopping_criteria=stopping,
+                logits_processor=processors,
+            )
+        tokens = outputs[0, len(input_ids):].tolist()
+        state['reason'] = 'max_tokens' if len(tokens) >= max_new_tokens else 'eos'
+        if self.eos_token_id in tokens:
+            tokens = tokens[:tokens.index(self.eos_token_id)]
+        if stop_strings.contains(tokens):
+            state['reason'] = 'stop_string'
+        return tokens
+
+    def tokens(self, prompt, profile=None, max_new_tokens=None, max_time=None, session=None, stop_strings=()):
+        """
+        Yield the new token IDs of a prompt's continuation as they are decoded.
+
+        Closing the generator early stops decoding (stop reason 'closed'). The
+        request's stats are recorded on `last_stats` when it ends; see generate().
+        """
+        max_new_tokens = max_new_tokens or self.max_new_tokens
+        max_time = max_time if max_time is not None else self.max_time
+        segments, token_segments = self.encode(prompt, max_new_tokens, session)
+        input_ids = [token for tokens in token_segments for token in tokens]
+        max_new_tokens = min(max_new_tokens, self.context_length - len(input_ids))
+        stop_strings = StopStrings(self.tokenizer, stop_strings)
+
+        with self._lock:
+            self._active += 1
+            name = self.choose_profile(profile or self.profile, max_new_tokens, max_time)
+        state = {}
+        n_cached, n_new = 0, 0
+        start = time.perf_counter()
+        try:
+            params = dict(PROFILES[name])
+            prompt_lookup = params.pop('prompt_lookup', False)
+            no_repeat_ngram_size = params.pop('no_repeat_ngram_size', self.no_repeat_ngram_size)
+            if params.get('num_beams', 1) > 1:
+                tokens = self._beam_search(input_ids, params, max_new_tokens, max_time, state, stop_strings)
+            else:
+                deadline = start + max_time if max_time is not None else None
+                past, position = None, 0
+                if session is not None:
+                    past, n_cached, position = session.plan(token_segments, max_new_tokens, self.context_length)
+                tokens = self._decode(input_ids, params, max_new_tokens, deadline, state, stop_strings,
+                                      past, n_cached, position, prompt_lookup, no_repeat_ngram_size)
+            for token in tokens:
+                n_new += 1
+                yield token
+        except GeneratorExit:
+            state['reason'] = 'closed'
+            raise
+        finally:
+            if session is not None and 'past' in state:
+                session.update(segments, token_segments, state['past'], state['cached_tokens'],
+                               position - n_cached if past is not None else 0)
+            with self._lock:
+                self._active -= 1
+            self.record(name, len(input_ids), n_cached, n_new, time.perf_counter() - start,
+                        state.get('reason') or 'error', state.get('forward_passes'))
+
+    def generate(self, prompt, profile=None, max_new_tokens=None, max_time=None, session=None, stop_strings=()):
+        """
+        Generate the continuation of a prompt.
+
+        Parameters:
+        - prompt (str or list of str): Full prompt text, or its segments (see encode()).
+        - profile (str, optional): Requested profile (defaults to the engine's); may be degraded.
+        - max_new_tokens (int, optional): Token budget of this request.
+        - max_time (float, optional): Wall-clock budget of this request in seconds.
+        - session (ChatSession, optional): Conversation cache; only the prompt tokens it
+          does not cover yet are encoded. Beam search always encodes the full prompt.
+        - stop_strings (iterable of str): Decoding ends with the token that completes one
+          of them (kept in the text). Beams that pass one are finalized, and beam search
+          ends once every beam has.
+
+        Returns:
+        - text (str): The decoded new tokens.
+        - stats (dict): profile, prompt_tokens, cached_tokens (prompt tokens reused from
+          the session), new_tokens, seconds, tokens_per_s, forward_passes (None for beam
+          search) and stop ('eos', 'stop_string', 'max_tokens' or 'time').
+        """
+        tokens = list(self.tokens(prompt, profile, max_new_tokens, max_time, session, stop_strings))
+        return self.tokenizer.decode(tokens, skip_special_tokens=True), self.last_stats
+
+    def stream(self, prompt, profile=None, max_new_tokens=None, max_time=None, session=None, stop_strings=()):
+        """
+        Yield the decoded continuation of a prompt as text chunks, token by token.
+
+        Same parameters as generate(). Beam search yields its text in one chunk at
+        the end. Stats are on `last_stats` once the generator is exhausted or closed.
+        """
+        tokens, text = [], ''
+        for token in self.tokens(prompt, profile, max_new_tokens, max_time, session, stop_strings):
+            tokens.append(token)
+            decoded = self.tokenizer.decode(tokens, skip_special_tokens=True)
+            # Hold back a multi-byte character until all of its tokens arrived
+            if decoded.endswith('\ufffd') or len(decoded) <= len(text):
+                continue
+            yield decoded[len(text):]
+            text = decoded
+        decoded = self.tokenizer.decode(tokens, skip_special_tokens=True)
+        if len(decoded) > len(text):
+            yield decoded[len(text):]
+
+    def record(self, profile, prompt_tokens, cached_tokens, new_tokens, seconds, reason, forward_passes=None):
+        """Set `last_stats` for a finished request and update the profile's tokens/s estimate."""
+        tokens_per_s = new_tokens / seconds if seconds > 0 else 0.0
+        with self._lock:
+            if new_tokens:
+                previous = self._rates.get(profile)
+                self._rates[profile] = tokens_per_s if previous is None else \
+                    (1 - RATE_SMOOTHING) * previous + RATE_SMOOTHING * tokens_per_s
+        self.last_stats = {
+            'profile': profile,
+            'prompt_tokens': prompt_tokens,
+            'cached_tokens': cached_tokens,
+            'new_tokens': new_tokens,
+            'seconds': seconds,
+            'tokens_per_s': tokens_per_s,
+            'forward_passes': forward_passes,
+            'stop': reason,
+        }
+        return self.last_stats
+
+
+def benchmark_prompt_lookup(engine, prompts=LOOKUP_BENCHMARK_PROMPTS, max_new_tokens=60):
+    """
+    Greedy decoding with and without prompt lookup on the same prompts.
+
+    'greedy' runs at the engine's no_repeat_ngram_size (the deployed setting),
+    'lookup' at the lookup profile's. Lookup replies are checked against greedy
+    replies decoded with the lookup profile's no_repeat_ngram_size. The engine
+    should have no time budget (max_time=0), so that no reply is cut short or
+    moved to another profile.
+
+    Returns:
+    - results (dict): Per profile ('greedy', 'lookup'), 'new_tokens', 'forward_passes',
+      'tokens_per_pass' and 'tokens_per_s' over all prompts, plus 'identical' (whether
+      every lookup reply equals the greedy one) and 'speedup' (over deployed greedy)
+      under 'lookup'.
+    """
+    replies, results = {}, {}
+    engine.generate(prompts[0], 'greedy', max_new_tokens)
+    for name in ('greedy', 'lookup'):
+        new_tokens, passes, seconds = 0, 0, 0.0
+        replies[name] = []
+        for prompt in prompts:
+            replies[name].append(list(engine.tokens(prompt, name, max_new_tokens)))
+            new_tokens += engine.last_stats['new_tokens']
+            passes += engine.last_stats['forward_passes']
+            seconds += engine.last_stats['seconds']
+        results[name] = {
+            'new_tokens': new_tokens,
+            'forward_passes': passes,
+            'tokens_per_pass': new_tokens / passes if passes else 0.0,
+            'tokens_per_s': new_tokens / seconds if seconds > 0 else 0.0,
+        }
+    reference = GenerationEngine(engine.tokenizer, engine.model, device=engine.device, profile='greedy', max_time=0,
+                                 no_repeat_ngram_size=PROFILES['lookup']['no_repeat_ngram_size'])
+    expected = [list(reference.tokens(prompt, 'greedy', max_new_tokens)) for prompt in prompts]
+    results['lookup']['identical'] = replies['lookup'] == expected
+    results['lookup']['speedup'] = results['lookup']['tokens_per_s'] / results['greedy']['tokens_per_s'] \
+        if results['greedy']['tokens_per_s'] else 0.0
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark prompt-lookup speculative decoding against greedy.")
+    parser.add_argument('--max-new-tokens', type=int, default=60)
+    parser.add_argument('--no-repeat-ngram-size', type=int,
+                        help="Overrides CHAT_NO_REPEAT_NGRAM_SIZE for greedy (lookup uses its profile's)")
+    args = parser.parse_args()
+
+    from chat_models import get_chat_model_loader
+    tokenizer, model = get_chat_model_loader()()
+    engine = GenerationEngine(tokenizer, model, max_time=0, no_repeat_ngram_size=args.no_repeat_ngram_size)
+    results = benchmark_prompt_lookup(engine, max_new_tokens=args.max_new_tokens)
+    print(f"no_repeat_ngram_size: greedy {engine.no_repeat_ngram_size}, "
+          f"lookup {PROFILES['lookup']['no_repeat_ngram_size']}")
+    for name, result in results.items():
+        print(f"{name:<7} {result['new_tokens']:>5} tokens in {result['forward_passes']:>4} passes "
+              f"({result['tokens_per_pass']:.2f} tokens/pass), {result['tokens_per_s']:.1f} tokens/s")
+    print(f"identical to greedy: {results['lookup']['identical']}, speedup {results['lookup']['speedup']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
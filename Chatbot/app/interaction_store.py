@@ -0,0 +1,193 @@
+# app/interaction_store.py
+
+import os
+import sys
+import pickle
+import numpy as np
+import faiss
+
+# File names inside an interaction store directory
+OFFSETS_FILE = 'offsets.npy'
+ITEMS_FILE = 'items.npy'
+# Batched searches leave users with more excluded items than this to search_excluding()
+HEAVY_EXCLUSIONS = 256
+
+
+class InteractionStore:
+    """
+    Memory-mapped per-user sets of already interacted (purchased / rated) items.
+
+    Rows follow the user factor index (values of user_id_map). User u's items
+    are the sorted FAISS item indices items[offsets[u]:offsets[u + 1]].
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self.items = np.load(os.path.join(store_dir, ITEMS_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def seen_items(self, user_idx):
+        """Return the sorted FAISS item indices a user has interacted with."""
+        if user_idx is None or not 0 <= user_idx < len(self):
+            return np.empty(0, dtype=np.int64)
+        return np.asarray(self.items[self.offsets[user_idx]:self.offsets[user_idx + 1]], dtype=np.int64)
+
+
+def write_interaction_store(store_dir, user_indices, item_indices, n_users):
+    """
+    Write an interaction store from parallel arrays of (user index, item index) pairs.
+
+    Parameters:
+    - store_dir (str): Output directory, created if missing.
+    - user_indices (array-like): User factor index of each interaction.
+    - item_indices (array-like): FAISS item index of each interaction.
+    - n_users (int): Number of users (rows) in the store.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    pairs = np.unique(np.stack([np.asarray(user_indices, dtype=np.int64),
+                                np.asarray(item_indices, dtype=np.int64)], axis=1), axis=0)
+    pairs = pairs.reshape(-1, 2)
+    # np.unique sorts by user, then item, so rows are contiguous and sorted
+    counts = np.bincount(pairs[:, 0], minlength=n_users)
+    offsets = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    np.save(os.path.join(store_dir, OFFSETS_FILE), offsets)
+    np.save(os.path.join(store_dir, ITEMS_FILE), pairs[:, 1].astype(np.int32))
+
+
+def is_interaction_store(store_dir):
+    """Check whether `store_dir` contains a complete interaction store."""
+    return all(os.path.exists(os.path.join(store_dir, name)) for name in (OFFSETS_FILE, ITEMS_FILE))
+
+
+def _search_parameters(index, selector):
+    """Wrap an ID selector in search parameters that keep the index's own nprobe / efSearch."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def search_excluding(index, user_vectors, top_k, excluded):
+    """
+    Top-k FAISS search that never returns excluded items.
+
+    With FAISS >= 1.7.3 the exclusions are applied inside the search through an
+    IDSelectorNot(IDSelectorBatch) selector. Older FAISS versions fall back to a
+    single over-fetch of top_k + len(excluded), which is still exact for flat
+    indexes because at most len(excluded) results can be dropped.
+
+    Parameters:
+    - index (faiss.Index): FAISS item index.
+    - user_vectors (np.ndarray): (1, d) or (n, d) float32 query vectors sharing `excluded`.
+    - top_k (int): Number of unseen items to return.
+    - excluded (np.ndarray): FAISS item indices to exclude.
+
+    Returns:
+    - scores (np.ndarray), item_indices (np.ndarray): As index.search(), shape (n, top_k);
+      item index -1 pads rows when the index holds fewer unseen items.
+    """
+    user_vectors = np.ascontiguousarray(user_vectors, dtype='float32').reshape(-1, index.d)
+    excluded = np.asarray(excluded, dtype=np.int64)
+    if len(excluded) == 0:
+        return index.search(user_vectors, top_k)
+
+    if hasattr(faiss, 'IDSelectorNot') and hasattr(faiss, 'SearchParameters'):
+        selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(excluded))
+        return index.search(user_vectors, top_k, params=_search_parameters(index, selector))
+
+    k_fetch = min(top_k + len(excluded), index.ntotal)
+    scores, item_indices = index.search(user_vectors, k_fetch)
+    return filter_excluded(scores, item_indices, [excluded] * len(user_vectors), top_k)
+
+
+def filter_excluded(scores, item_indices, excluded_per_row, top_k):
+    """
+    Drop excluded items from over-fetched search results and cut each row to top_k.
+
+    Parameters:
+    - scores, item_indices (np.ndarray): Over-fetched index.search() output.
+    - excluded_per_row (list of np.ndarray): Sorted excluded item indices for each row.
+    - top_k (int): Number of items to keep per row.
+
+    Returns:
+    - scores (np.ndarray), item_indices (np.ndarray): Shape (n, top_k), padded with -1.
+    """
+    out_scores = np.full((len(item_indices), top_k), -np.inf, dtype=scores.dtype)
+    out_items = np.full((len(item_indices), top_k), -1, dtype=np.int64)
+    for row, excluded in enumerate(excluded_per_row):
+        keep = ~np.isin(item_indices[row], excluded) & (item_indices[row] >= 0)
+        kept_items = item_indices[row][keep][:top_k]
+        out_items[row, :len(kept_items)] = kept_items
+        out_scores[row, :len(kept_items)] = scores[row][keep][:top_k]
+    return out_scores, out_items
+
+
+def search_excluding_many(index, user_vectors, top_k, excluded_per_row, heavy=HEAVY_EXCLUSIONS):
+    """
+    Top-k FAISS search for many users, each with their own excluded items.
+
+    Rows are grouped by exclusion count (powers of two) and each group is
+    searched in one call that over-fetches by the group's longest list, so one
+    user with a long history does not widen the search of the whole batch.
+    Rows excluding more than `heavy` items are searched one by one with
+    search_excluding().
+
+    Parameters:
+    - index (faiss.Index): FAISS item index.
+    - user_vectors (np.ndarray): (n, d) float32 query vectors.
+    - top_k (int): Number of unseen items per row.
+    - excluded_per_row (list of np.ndarray or None): Excluded item indices of each row.
+    - heavy (int): Exclusion count above which a row is searched on its own.
+
+    Returns:
+    - scores (np.ndarray), item_indices (np.ndarray): Shape (n, top_k), padded with -inf / -1.
+    """
+    user_vectors = np.ascontiguousarray(user_vectors, dtype='float32').reshape(-1, index.d)
+    out_scores = np.full((len(user_vectors), top_k), -np.inf, dtype=np.float32)
+    out_items = np.full((len(user_vectors), top_k), -1, dtype=np.int64)
+    lengths = [len(items) if items is not None else 0 for items in excluded_per_row]
+    groups = {}
+    for row, length in enumerate(lengths):
+        groups.setdefault(-1 if length > heavy else length.bit_length(), []).append(row)
+
+    for group, rows in groups.items():
+        if group < 0:
+            for row in rows:
+                scores, item_indices = search_excluding(index, user_vectors[row], top_k, excluded_per_row[row])
+                out_scores[row], out_items[row] = scores[0], item_indices[0]
+            continue
+        rows = np.array(rows, dtype=np.int64)
+        if group == 0:
+            scores, item_indices = index.search(user_vectors[rows], top_k)
+        else:
+            k_fetch = min(top_k + max(lengths[row] for row in rows), index.ntotal)
+            scores, item_indices = index.search(user_vectors[rows], k_fetch)
+            scores, item_indices = filter_excluded(scores, item_indices,
+                                                   [excluded_per_row[row] for row in rows], top_k)
+        out_scores[rows], out_items[rows] = scores, item_indices
+    return out_scores, out_items
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5:
+        print("Usage: python interaction_store.py <interactions.csv> <user_id_map.pkl> <item_id_map.pkl> <output_store_dir>")
+        print("The CSV needs 'user_id' and 'parent_asin' columns (e.g. the CF training interactions).")
+        sys.exit(1)
+    import pandas as pd
+    interactions = pd.read_csv(sys.argv[1], usecols=['user_id', 'parent_asin'])
+    with open(sys.argv[2], 'rb') as f:
+        user_id_map = pickle.load(f)
+    with open(sys.argv[3], 'rb') as f:
+        item_id_map = pickle.load(f)
+    user_indices = interactions['user_id'].map(user_id_map)
+    item_indices = interactions['parent_asin'].map(item_id_map)
+    known = user_indices.notna() & item_indices.notna()
+    write_interaction_store(sys.argv[4], user_indices[known].to_numpy(), item_indices[known].to_numpy(),
+                            len(user_id_map))
+    print(f"Wrote {int(known.sum())} interactions for {len(user_id_map)} users into {sys.argv[4]}")
@@ -0,0 +1,232 @@
+# app/precompute.py
+
+import os
+import sys
+import json
+import glob
+import pickle
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import faiss
+from tqdm import tqdm
+
+# Add current directory to sys.path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from faiss_index import load_item_index
+from interaction_store import InteractionStore, is_interaction_store, search_excluding_many
+from rec_store import atomic_save, write_recommendation_matrix
+from svdpp import SVDppScorer, is_svdpp_export, IMPLICIT_DIR, USER_VECTORS_FILE
+
+# Checkpoint layout: one .npy per finished chunk plus the run parameters
+PARAMS_FILE = 'params.json'
+CHUNK_PATTERN = 'chunk_{start:010d}.npy'
+# Default number of worker processes ranking by SVD++: each one holds a block of
+# scores (see svdpp.MAX_BLOCK_SCORES) and runs multi-threaded BLAS products itself
+SCORER_WORKERS = 4
+
+# Artifacts of a worker process, loaded once by _init_worker()
+_state = None
+
+
+def _init_worker(artifacts_dir, interactions_dir, omp_threads, svdpp_dir=None):
+    global _state
+    if omp_threads:
+        # Keep FAISS from oversubscribing the cores shared by the worker processes
+        faiss.omp_set_num_threads(omp_threads)
+    exclusions = None
+    if interactions_dir and is_interaction_store(interactions_dir):
+        exclusions = InteractionStore(interactions_dir)
+    _state = {
+        'user_factors': np.load(os.path.join(artifacts_dir, 'user_factors.npy'), mmap_mode='r'),
+        'index': load_item_index(os.path.join(artifacts_dir, 'item_index.faiss')),
+        'exclusions': exclusions,
+        'scorer': SVDppScorer(svdpp_dir) if svdpp_dir else None,
+    }
+
+
+def _run_chunk(args):
+    """Rank one range of user indices and checkpoint the (n, top_k) int32 result."""
+    start, end, top_k, chunk_path = args
+    user_factors, index, exclusions = _state['user_factors'], _state['index'], _state['exclusions']
+    scorer = _state['scorer']
+
+    if scorer is not None:
+        # Full SVD++ predictions, the same ranking recommend() serves with the scorer
+        excluded = [exclusions.seen_items(user_idx) for user_idx in range(start, end)] if exclusions is not None else None
+        item_indices, _ = scorer.top_k_many(np.arange(start, end), top_k, excluded)
+        atomic_save(chunk_path, lambda f: np.save(f, item_indices.astype(np.int32)))
+        return start, end
+
+    user_vectors = np.ascontiguousarray(user_factors[start:end], dtype='float32')
+    if exclusions is not None:
+        excluded = [exclusions.seen_items(user_idx) for user_idx in range(start, end)]
+        # Over-fetch per group of similar exclusion counts, then per-user filtering
+        _, item_indices = search_excluding_many(index, user_vectors, top_k, excluded)
+    else:
+        _, item_indices = index.search(user_vectors, top_k)
+
+    # A chunk file is either complete or absent, so a resumed run can trust it
+    atomic_save(chunk_path, lambda f: np.save(f, item_indices.astype(np.int32)))
+    return start, end
+
+
+def default_workers(svdpp=False):
+    """Default worker count: one per core for FAISS ranking, at most SCORER_WORKERS for SVD++."""
+    cores = os.cpu_count() or 1
+    return min(cores, SCORER_WORKERS) if svdpp else cores
+
+
+def _check_params(checkpoint_dir, params, restart):
+    """Start a fresh checkpoint directory, or verify that an existing one belongs to the same run."""
+    params_path = os.path.join(checkpoint_dir, PARAMS_FILE)
+    if restart and os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    if os.path.exists(params_path):
+        with open(params_path, 'r') as f:
+            previous = json.load(f)
+        if previous != params:
+            raise ValueError(f"Checkpoints in {checkpoint_dir} were produced with different parameters "
+                             f"({previous}); rerun with --restart to discard them.")
+    else:
+        with open(params_path, 'w') as f:
+            json.dump(params, f)
+
+
+def _artifact_signature(path):
+    """Size and modification time, enough to notice a re-exported artifact."""
+    stat = os.stat(path)
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def precompute_recommendations(artifacts_dir, store_dir, top_k=20, chunk_size=1000, workers=1,
+                               checkpoint_dir=None, interactions_dir=None, restart=False,
+                               keep_checkpoints=False):
+    """
+    Generate top-k recommendations for every user of the factor model and write a recommendation store.
+
+    Users are processed in ranges of `chunk_size` user indices. Each finished
+    range is checkpointed as an int32 matrix of FAISS item indices, so a crashed
+    or interrupted run resumes with the remaining chunks only. The final merge
+    writes the memory-mapped store read by load_recommendation_system(), with
+    ASINs resolved by one array lookup over item_id_map.
+
+    When `artifacts_dir`/svdpp holds an SVD++ export (see svdpp.py), users are
+    ranked by full SVD++ predictions, as recommend() does with the scorer;
+    otherwise by the FAISS inner product. The store records which one was used.
+
+    Parameters:
+    - artifacts_dir (str): Directory holding user_factors.npy, user_id_map.pkl,
+      item_id_map.pkl and item_index.faiss (as exported by CF_model.ipynb).
+    - store_dir (str): Output recommendation store directory.
+    - top_k (int): Number of recommendations per user.
+    - chunk_size (int): Number of users per chunk (and per FAISS search).
+    - workers (int, optional): Number of worker processes; 1 runs in-process, None
+      picks default_workers() for the ranking used.
+    - checkpoint_dir (str, optional): Where chunk results are kept (defaults to `store_dir` + '.chunks').
+    - interactions_dir (str, optional): Interaction store whose items are excluded per user
+      (defaults to `artifacts_dir`/interactions, then the SVD++ training interactions, when present).
+    - restart (bool): Discard existing checkpoints instead of resuming.
+    - keep_checkpoints (bool): Keep the chunk files after a successful merge.
+
+    Returns:
+    - n_users (int): Number of users written.
+    """
+    checkpoint_dir = checkpoint_dir or store_dir.rstrip(os.sep) + '.chunks'
+    svdpp_dir = os.path.join(artifacts_dir, 'svdpp')
+    svdpp_dir = svdpp_dir if is_svdpp_export(svdpp_dir) else None
+    if interactions_dir is None:
+        interactions_dir = os.path.join(artifacts_dir, 'interactions')
+        if not is_interaction_store(interactions_dir) and svdpp_dir:
+            interactions_dir = os.path.join(svdpp_dir, IMPLICIT_DIR)
+
+    with open(os.path.join(artifacts_dir, 'user_id_map.pkl'), 'rb') as f:
+        user_id_map = pickle.load(f)
+    with open(os.path.join(artifacts_dir, 'item_id_map.pkl'), 'rb') as f:
+        item_id_map = pickle.load(f)
+    n_users = np.load(os.path.join(artifacts_dir, 'user_factors.npy'), mmap_mode='r').shape[0]
+
+    if workers is None:
+        workers = default_workers(svdpp_dir is not None)
+
+    params = {
+        'top_k': top_k,
+        'chunk_size': chunk_size,
+        'n_users': int(n_users),
+        'index': _artifact_signature(os.path.join(artifacts_dir, 'item_index.faiss')),
+        'user_factors': _artifact_signature(os.path.join(artifacts_dir, 'user_factors.npy')),
+        'exclusions': is_interaction_store(interactions_dir),
+        'ranking': 'svdpp' if svdpp_dir else 'faiss',
+        'svdpp': _artifact_signature(os.path.join(svdpp_dir, USER_VECTORS_FILE)) if svdpp_dir else None,
+    }
+    _check_params(checkpoint_dir, params, restart)
+
+    tasks = []
+    for start in range(0, n_users, chunk_size):
+        chunk_path = os.path.join(checkpoint_dir, CHUNK_PATTERN.format(start=start))
+        if not os.path.exists(chunk_path):
+            tasks.append((start, min(start + chunk_size, n_users), top_k, chunk_path))
+    n_chunks = (n_users + chunk_size - 1) // chunk_size
+    if len(tasks) < n_chunks:
+        print(f"Resuming: {n_chunks - len(tasks)} of {n_chunks} chunks already done.")
+
+    with tqdm(total=len(tasks), desc="Generating recommendations") as progress:
+        if workers <= 1:
+            _init_worker(artifacts_dir, interactions_dir, 0, svdpp_dir)
+            for task in tasks:
+                _run_chunk(task)
+                progress.update(1)
+        elif tasks:
+            omp_threads = max(1, (os.cpu_count() or 1) // workers)
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(artifacts_dir, interactions_dir, omp_threads, svdpp_dir)) as executor:
+                for future in as_completed([executor.submit(_run_chunk, task) for task in tasks]):
+                    future.result()
+                    progress.update(1)
+
+    # Merge: chunks are stacked in user-index order, so row u belongs to user index u
+    chunk_paths = sorted(glob.glob(os.path.join(checkpoint_dir, 'chunk_*.npy')))
+    item_indices = np.concatenate([np.load(path) for path in chunk_paths]) if chunk_paths else \
+        np.empty((0, top_k), dtype=np.int32)
+    if len(item_indices) != n_users:
+        raise RuntimeError(f"Expected {n_users} rows in {checkpoint_dir}, found {len(item_indices)}.")
+
+    user_ids = np.empty(n_users, dtype=object)
+    for user_id, user_idx in user_id_map.items():
+        user_ids[user_idx] = user_id
+    n_faiss = max(item_id_map.values()) + 1 if item_id_map else 0
+    item_asins = np.empty(n_faiss, dtype=object)
+    for asin, item_idx in item_id_map.items():
+        item_asins[item_idx] = asin
+
+    n_written = write_recommendation_matrix(store_dir, user_ids, item_indices, item_asins, params['ranking'])
+    if not keep_checkpoints:
+        shutil.rmtree(checkpoint_dir)
+    return n_written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-compute recommendations for every user into a recommendation store.")
+    parser.add_argument('artifacts_dir', help="Directory with user_factors.npy, user_id_map.pkl, item_id_map.pkl and item_index.faiss")
+    parser.add_argument('store_dir', help="Output recommendation store directory (e.g. <DATA_DIR>/recommendations_store)")
+    parser.add_argument('--top-k', type=int, default=20)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"Defaults to one per core, at most {SCORER_WORKERS} when ranking by SVD++")
+    parser.add_argument('--checkpoint-dir', default=None)
+    parser.add_argument('--interactions-dir', default=None)
+    parser.add_argument('--restart', action='store_true', help="Discard existing checkpoints")
+    parser.add_argument('--keep-checkpoints', action='store_true')
+    args = parser.parse_args()
+
+    n_users = precompute_recommendations(args.artifacts_dir, args.store_dir, args.top_k, args.chunk_size,
+                                         args.workers, args.checkpoint_dir, args.interactions_dir,
+                                         args.restart, args.keep_checkpoints)
+    print(f"Wrote recommendations for {n_users} users into {args.store_dir}")
+
+
+if __name__ == "__main__":
+    main()
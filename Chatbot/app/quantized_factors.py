@@ -0,0 +1,224 @@
+# app/quantized_factors.py
+
+import os
+import time
+import tempfile
+import argparse
+import numpy as np
+
+# Serving precision of the factor matrices can be set per deployment through the environment
+PRECISION_ENV = 'FACTORS_PRECISION'
+PRECISIONS = ('float32', 'float16', 'int8')
+# FAISS index type matching each precision (see faiss_index.INDEX_DEFAULTS)
+PRECISION_INDEX_TYPES = {'float32': 'flat', 'float16': 'sq_fp16', 'int8': 'sq_int8'}
+
+
+def quantized_paths(factors_path, precision):
+    """Return the (codes, scales) file paths of a quantized variant; scales is None for float16."""
+    base = factors_path[:-len('.npy')] if factors_path.endswith('.npy') else factors_path
+    if precision == 'float16':
+        return base + '_fp16.npy', None
+    if precision == 'int8':
+        return base + '_int8.npy', base + '_int8_scale.npy'
+    raise ValueError(f"Unknown quantized precision '{precision}'. Choose 'float16' or 'int8'.")
+
+
+def has_quantized(factors_path, precision):
+    """Check whether the quantized variant of a factor file exists."""
+    return all(path is None or os.path.exists(path) for path in quantized_paths(factors_path, precision))
+
+
+def quantize_factors(factors, precision):
+    """
+    Quantize a factor matrix.
+
+    int8 uses one symmetric scale per row (max |value| / 127), so every row keeps
+    its own dynamic range and dequantizes as codes * scale.
+
+    Parameters:
+    - factors (np.ndarray): (n, d) float matrix.
+    - precision (str): 'float16' or 'int8'.
+
+    Returns:
+    - codes (np.ndarray), scales (np.ndarray or None): Quantized matrix and per-row float32 scales.
+    """
+    factors = np.asarray(factors, dtype=np.float32)
+    if precision == 'float16':
+        return factors.astype(np.float16), None
+    if precision == 'int8':
+        scales = np.abs(factors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(factors / scales[:, None]).clip(-127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantized precision '{precision}'. Choose 'float16' or 'int8'.")
+
+
+def write_quantized_factors(factors_path, precision, factors=None):
+    """
+    Write the quantized variant next to a factor file (e.g. user_factors_int8.npy + user_factors_int8_scale.npy).
+
+    Parameters:
+    - factors_path (str): The float factor file (e.g. user_factors.npy).
+    - precision (str): 'float16' or 'int8'.
+    - factors (np.ndarray, optional): The matrix, if already in memory.
+    """
+    if factors is None:
+        factors = np.load(factors_path, mmap_mode='r')
+    codes, scales = quantize_factors(factors, precision)
+    codes_path, scales_path = quantized_paths(factors_path, precision)
+    np.save(codes_path, codes)
+    if scales_path is not None:
+        np.save(scales_path, scales)
+
+
+class QuantizedFactors:
+    """
+    Memory-mapped float16 or per-row int8 factor matrix, dequantized on demand.
+
+    Indexing works like the float32 array it replaces (int, slice or index
+    array) and returns float32 rows, so only the rows a request touches are
+    read and converted.
+    """
+
+    def __init__(self, factors_path, precision):
+        self.factors_path = factors_path
+        self.precision = precision
+        codes_path, scales_path = quantized_paths(factors_path, precision)
+        self.codes = np.load(codes_path, mmap_mode='r')
+        self.scales = np.load(scales_path, mmap_mode='r') if scales_path is not None else None
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, rows):
+        codes = np.asarray(self.codes[rows], dtype=np.float32)
+        if self.scales is None:
+            return codes
+        scales = np.asarray(self.scales[rows], dtype=np.float32)
+        return codes * scales[..., None]
+
+
+def load_factors(factors_path, precision=None):
+    """
+    Load a factor matrix at the configured precision.
+
+    Parameters:
+    - factors_path (str): The float factor file (e.g. user_factors.npy).
+    - precision (str, optional): 'float32', 'float16' or 'int8'; defaults to the
+      FACTORS_PRECISION environment variable, then 'float32'.
+
+    Returns:
+    - factors (np.ndarray or QuantizedFactors): Row-indexable factor matrix.
+    """
+    precision = precision or os.environ.get(PRECISION_ENV) or 'float32'
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown factor precision '{precision}'. Choose from {PRECISIONS}.")
+    if precision != 'float32':
+        if has_quantized(factors_path, precision):
+            return QuantizedFactors(factors_path, precision)
+        print(f"No {precision} variant of '{os.path.basename(factors_path)}'; loading float32. "
+              f"Run 'python app/quantized_factors.py quantize' to create it.")
+    return np.load(factors_path)
+
+
+def benchmark_precisions(item_factors, user_factors, n_queries=1000, top_k=10):
+    """
+    Compare float16 / int8 factors and their FAISS indexes against the float32 path.
+
+    Each precision is written to a temporary directory and served from memory-mapped
+    files, so the footprint and latency are those of serving.
+
+    Parameters:
+    - item_factors, user_factors (np.ndarray): Float factor matrices.
+    - n_queries (int): Number of sampled users.
+    - top_k (int): Cut-off for ranking agreement.
+
+    Returns:
+    - reports (dict): Per precision: factor_mb, index_mb, p50_ms and p99_ms of one
+      user lookup + search, overlap@k and the share of identical top-k lists.
+    """
+    from faiss_index import build_item_index, index_memory_bytes
+
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(len(user_factors), min(n_queries, len(user_factors)), replace=False))
+    reports = {}
+    reference = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        item_path = os.path.join(tmp_dir, 'item_factors.npy')
+        user_path = os.path.join(tmp_dir, 'user_factors.npy')
+        np.save(item_path, np.asarray(item_factors, dtype=np.float32))
+        np.save(user_path, np.asarray(user_factors, dtype=np.float32))
+
+        for precision in PRECISIONS:
+            if precision != 'float32':
+                write_quantized_factors(item_path, precision)
+                write_quantized_factors(user_path, precision)
+            users = load_factors(user_path, precision) if precision != 'float32' else np.load(user_path, mmap_mode='r')
+            items = load_factors(item_path, precision) if precision != 'float32' else np.load(item_path, mmap_mode='r')
+            index = build_item_index(items[:], PRECISION_INDEX_TYPES[precision])
+
+            latencies = []
+            found = np.empty((len(sample), top_k), dtype=np.int64)
+            for row, user_idx in enumerate(sample):
+                start = time.perf_counter()
+                user_vector = np.asarray(users[int(user_idx)], dtype='float32').reshape(1, -1)
+                _, found[row:row + 1] = index.search(user_vector, top_k)
+                latencies.append(time.perf_counter() - start)
+            if reference is None:
+                reference = found
+
+            factor_bytes = users.nbytes + items.nbytes
+            overlap = sum(len(set(reference[i]) & set(found[i])) for i in range(len(sample)))
+            latencies_ms = np.array(latencies) * 1000
+            reports[precision] = {
+                'factor_mb': factor_bytes / 2 ** 20,
+                'index_mb': index_memory_bytes(index) / 2 ** 20,
+                'p50_ms': float(np.percentile(latencies_ms, 50)),
+                'p99_ms': float(np.percentile(latencies_ms, 99)),
+                f'overlap@{top_k}': overlap / float(reference.size),
+                'identical': float(np.mean(np.all(reference == found, axis=1))),
+            }
+            del users, items, index
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize factor matrices or benchmark the quantized serving path.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    quantize = subparsers.add_parser('quantize', help="Write float16 / int8 variants next to factor files")
+    quantize.add_argument('factors', nargs='+', help="e.g. user_factors.npy item_factors.npy")
+    quantize.add_argument('--precision', default='int8', choices=PRECISIONS[1:])
+
+    bench = subparsers.add_parser('benchmark', help="Report memory, latency and ranking agreement per precision")
+    bench.add_argument('item_factors')
+    bench.add_argument('user_factors')
+    bench.add_argument('--top-k', type=int, default=10)
+    bench.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == 'quantize':
+        for path in args.factors:
+            write_quantized_factors(path, args.precision)
+            print(f"Wrote {args.precision} variant of {path}")
+        return
+
+    reports = benchmark_precisions(np.load(args.item_factors, mmap_mode='r'), np.load(args.user_factors, mmap_mode='r'),
+                                   args.queries, args.top_k)
+    overlap = f'overlap@{args.top_k}'
+    print(f"{'precision':<12}{'factor MB':>12}{'index MB':>10}{'p50 ms':>10}{'p99 ms':>10}{overlap:>12}{'identical':>11}")
+    for precision, report in reports.items():
+        print(f"{precision:<12}{report['factor_mb']:>12.2f}{report['index_mb']:>10.2f}{report['p50_ms']:>10.3f}"
+              f"{report['p99_ms']:>10.3f}{report[overlap]:>12.3f}{report['identical']:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+# app/rec_store.py
+
+import os
+import sys
+import numpy as np
+
+# File names inside a recommendation store directory
+USER_KEYS_FILE = 'user_keys.npy'
+OFFSETS_FILE = 'offsets.npy'
+ITEMS_FILE = 'items.npy'
+ASINS_FILE = 'asins.npy'
+# Optional: name of the scoring that ranked the lists ('svdpp' or 'faiss')
+RANKING_FILE = 'ranking.txt'
+
+
+class RecommendationStore:
+    """
+    Read-only, memory-mapped store of pre-generated recommendations.
+
+    The store is a directory holding four NumPy arrays:
+    - user_keys.npy: sorted fixed-width byte strings, one per user.
+    - offsets.npy: int64 row pointers, user i owns items[offsets[i]:offsets[i + 1]].
+    - items.npy: int32 indices into asins.npy, in ranked order.
+    - asins.npy: fixed-width byte strings mapping item index to ASIN.
+    An optional ranking.txt names the scoring the lists were ranked by.
+
+    All arrays are opened with mmap_mode='r', so opening the store costs nothing
+    and a lookup only touches the pages of a binary search plus one user's row.
+    It supports the same `in` / `[]` access as the dict it replaces.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.user_keys = np.load(os.path.join(store_dir, USER_KEYS_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self.items = np.load(os.path.join(store_dir, ITEMS_FILE), mmap_mode='r')
+        self.asins = np.load(os.path.join(store_dir, ASINS_FILE), mmap_mode='r')
+        ranking_path = os.path.join(store_dir, RANKING_FILE)
+        self.ranking = None
+        if os.path.exists(ranking_path):
+            with open(ranking_path, 'r') as f:
+                self.ranking = f.read().strip() or None
+
+    def __len__(self):
+        return len(self.user_keys)
+
+    def _find(self, user_id):
+        """Return the row of `user_id` via binary search, or -1 if absent."""
+        key = user_id.encode('utf-8') if isinstance(user_id, str) else user_id
+        # Keys longer than the stored width can never match
+        if len(key) > self.user_keys.dtype.itemsize:
+            return -1
+        pos = int(np.searchsorted(self.user_keys, key))
+        if pos < len(self.user_keys) and self.user_keys[pos] == key:
+            return pos
+        return -1
+
+    def __contains__(self, user_id):
+        return self._find(user_id) >= 0
+
+    def __getitem__(self, user_id):
+        row = self._find(user_id)
+        if row < 0:
+            raise KeyError(user_id)
+        return self._row_asins(row)
+
+    def get(self, user_id, top_k=None):
+        """
+        Return the ranked ASINs for a user, or None if the user is not stored.
+
+        Parameters:
+        - user_id (str): The ID of the user.
+        - top_k (int or None): Only decode the first `top_k` items.
+
+        Returns:
+        - recommendations (list or None): List of recommended item ASINs.
+        """
+        row = self._find(user_id)
+        if row < 0:
+            return None
+        return self._row_asins(row, top_k)
+
+    def item_indices(self, user_id, top_k=None):
+        """Return the raw item-index row of a user (empty if absent)."""
+        row = self._find(user_id)
+        if row < 0:
+            return np.empty(0, dtype=np.int32)
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        if top_k is not None:
+            end = min(end, start + top_k)
+        return np.asarray(self.items[start:end])
+
+    def _row_asins(self, row, top_k=None):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        if top_k is not None:
+            end = min(end, start + top_k)
+        return [asin.decode('utf-8') for asin in self.asins[self.items[start:end]]]
+
+
+def atomic_save(path, save):
+    """
+    Write a file under a temporary name and rename it, so readers see either the old or the new file.
+
+    Parameters:
+    - path (str): Destination file.
+    - save (callable): Writes the contents to an open binary file, e.g. `lambda f: np.save(f, array)`.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        save(f)
+    os.replace(tmp_path, path)
+
+
+def _write_ranking(store_dir, ranking):
+    """Record the scoring of a rewritten store, dropping the note of a previous one."""
+    ranking_path = os.path.join(store_dir, RANKING_FILE)
+    if ranking:
+        with open(ranking_path, 'w') as f:
+            f.write(ranking + '\n')
+    elif os.path.exists(ranking_path):
+        os.remove(ranking_path)
+
+
+def write_recommendation_store(store_dir, recommendations):
+    """
+    Write a recommendation store from an iterable of (user_id, asin_list) pairs.
+
+    Parameters:
+    - store_dir (str): Output directory, created if missing.
+    - recommendations (iterable): Pairs of user ID and ranked list of ASINs.
+      Empty strings (HDF5 padding) are dropped.
+
+    Returns:
+    - n_users (int): Number of users written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    user_ids = []
+    row_lengths = []
+    flat_asins = []
+    for user_id, asins in recommendations:
+        asins = [a for a in asins if a]
+        user_ids.append(user_id.encode('utf-8') if isinstance(user_id, str) else user_id)
+        row_lengths.append(len(asins))
+        flat_asins.extend(a.encode('utf-8') if isinstance(a, str) else a for a in asins)
+
+    # Item vocabulary: each distinct ASIN is stored once and referenced by index
+    asin_vocab, flat_items = np.unique(np.array(flat_asins, dtype=np.bytes_), return_inverse=True)
+    if len(asin_vocab) == 0:
+        asin_vocab = np.array([], dtype='S1')
+
+    # Sort users by key so lookups can binary search
+    user_keys = np.array(user_ids, dtype=np.bytes_)
+    if len(user_keys) == 0:
+        user_keys = np.array([], dtype='S1')
+    row_lengths = np.array(row_lengths, dtype=np.int64)
+    row_starts = np.concatenate(([0], np.cumsum(row_lengths)))[:-1]
+    order = np.argsort(user_keys, kind='stable')
+
+    sorted_lengths = row_lengths[order]
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(sorted_lengths, out=offsets[1:])
+    # Gather each user's row in sorted-key order
+    gather = np.repeat(row_starts[order] - offsets[:-1], sorted_lengths) + np.arange(offsets[-1])
+    items = flat_items.reshape(-1).astype(np.int32)[gather]
+
+    np.save(os.path.join(store_dir, USER_KEYS_FILE), user_keys[order])
+    np.save(os.path.join(store_dir, OFFSETS_FILE), offsets)
+    np.save(os.path.join(store_dir, ITEMS_FILE), items)
+    np.save(os.path.join(store_dir, ASINS_FILE), asin_vocab)
+    _write_ranking(store_dir, None)
+    return len(order)
+
+
+def write_recommendation_matrix(store_dir, user_ids, item_indices, asins, ranking=None):
+    """
+    Write a recommendation store from a dense matrix of ranked item indices.
+
+    Unlike write_recommendation_store() nothing is decoded per item: the
+    indices are kept as they are and `asins` becomes the store's item vocabulary.
+
+    Parameters:
+    - store_dir (str): Output directory, created if missing.
+    - user_ids (sequence): User ID of each matrix row.
+    - item_indices (np.ndarray): (n_users, top_k) indices into `asins`, ranked best
+      first; negative entries are padding and are dropped.
+    - asins (sequence): ASIN of each item index.
+    - ranking (str, optional): Scoring that ranked the rows, recorded in ranking.txt.
+
+    Returns:
+    - n_users (int): Number of users written.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+
+    user_keys = np.array([u.encode('utf-8') if isinstance(u, str) else u for u in user_ids], dtype=np.bytes_)
+    if len(user_keys) == 0:
+        user_keys = np.array([], dtype='S1')
+    asin_vocab = np.array([a.encode('utf-8') if isinstance(a, str) else (a or b'') for a in asins], dtype=np.bytes_)
+    if len(asin_vocab) == 0:
+        asin_vocab = np.array([], dtype='S1')
+
+    order = np.argsort(user_keys, kind='stable')
+    rows = np.asarray(item_indices).reshape(len(user_keys), -1)[order]
+    valid = rows >= 0
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(valid.sum(axis=1), out=offsets[1:])
+
+    np.save(os.path.join(store_dir, USER_KEYS_FILE), user_keys[order])
+    np.save(os.path.join(store_dir, OFFSETS_FILE), offsets)
+    # Boolean indexing is row-major, so each user's ranking order is kept
+    np.save(os.path.join(store_dir, ITEMS_FILE), rows[valid].astype(np.int32))
+    np.save(os.path.join(store_dir, ASINS_FILE), asin_vocab)
+    _write_ranking(store_dir, ranking)
+    return len(order)
+
+
+def convert_h5_to_store(h5_path, store_dir):
+    """
+    Convert the legacy `recommendations.h5` (one dataset per user, as written by
+    CF_model.ipynb) into a memory-mapped recommendation store.
+
+    Parameters:
+    - h5_path (str): Path to the HDF5 file.
+    - store_dir (str): Output directory for the store.
+
+    Returns:
+    - n_users (int): Number of users converted.
+    """
+    import h5py
+
+    def iter_h5():
+        with h5py.File(h5_path, 'r') as hf:
+            for user_id in hf.keys():
+                recommended_items = hf[user_id][:]
+                yield user_id, [item.decode('utf-8') if isinstance(item, bytes) else str(item)
+                                for item in recommended_items]
+
+    return write_recommendation_store(store_dir, iter_h5())
+
+
+def is_recommendation_store(store_dir):
+    """Check whether `store_dir` contains a complete recommendation store."""
+    return all(os.path.exists(os.path.join(store_dir, name))
+               for name in (USER_KEYS_FILE, OFFSETS_FILE, ITEMS_FILE, ASINS_FILE))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python rec_store.py <recommendations.h5> <output_store_dir>")
+        sys.exit(1)
+    n_users = convert_h5_to_store(sys.argv[1], sys.argv[2])
+    print(f"Converted recommendations for {n_users} users into {sys.argv[2]}")
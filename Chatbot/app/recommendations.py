@@ -1,5 +1,8 @@
 import os
+import json
+import hashlib
 import pickle
+import time
 import faiss
 import h5py
 import numpy as np
@@ -7,69 +10,227 @@ import pandas as pd
 from scipy import sparse
 from sklearn.metrics.pairwise import cosine_similarity
 
-def load_recommendation_system():
-    RECOMMENDATIONS_DIR = '/home/sagemaker-user/Pet-Product-RecSystem-Chatbot/Chatbot/recommendations/'
-    MODEL_DIR = '/home/sagemaker-user/Models/'
-    DATA_DIR = '/home/sagemaker-user/Data/'
-    
-    # Load the SVD++ model
-    model_path = os.path.join(MODEL_DIR, 'SVD++_best_model.pkl')
-    with open(model_path, 'rb') as f:
-        recommendation_model = pickle.load(f)
-    
-    # Load user and item factors
-    user_factors_path = os.path.join(RECOMMENDATIONS_DIR, 'user_factors.npy')
-    item_factors_path = os.path.join(RECOMMENDATIONS_DIR, 'item_factors.npy')
-    
-    user_factors = np.load(user_factors_path)
-    item_factors = np.load(item_factors_path)
-    
-    # Load user and item ID mappings
-    user_id_map_path = os.path.join(RECOMMENDATIONS_DIR, 'user_id_map.pkl')
-    item_id_map_path = os.path.join(RECOMMENDATIONS_DIR, 'item_id_map.pkl')
-    
-    with open(user_id_map_path, 'rb') as f:
-        user_id_map = pickle.load(f)
-    
-    with open(item_id_map_path, 'rb') as f:
-        item_id_map = pickle.load(f)
-    
-    # Load FAISS index
-    faiss_index_path = os.path.join(RECOMMENDATIONS_DIR, 'item_index.faiss')
-    index = faiss.read_index(faiss_index_path)
-    
-    # Load pre-generated recommendations
-    recommendations_path = os.path.join(DATA_DIR, 'recommendations.h5')
-    loaded_recommendations = {}
-    with h5py.File(recommendations_path, 'r') as hf:
-        for user_id in hf.keys():
-            recommended_items = hf[user_id][:]
-            # Decode bytes to strings if necessary
-            recommended_items = [item.decode('utf-8') if isinstance(item, bytes) else item for item in recommended_items]
-            loaded_recommendations[user_id] = recommended_items
-    
-    # Load product details
-    filtered_data_path = os.path.join(DATA_DIR, 'filtered_data_unique_asin.pkl')
-    if os.path.exists(filtered_data_path):
-        filtered_data = pd.read_pickle(filtered_data_path)
+from bundle import ArtifactBundle, BUNDLE_ENV
+from catalog import ItemCatalog
+from catalog_delta import CatalogDelta
+from content_search import ContentSearchEngine
+from detail_store import (DetailStore, is_detail_store, format_description,
+                          format_details, format_categories)
+from faiss_index import load_item_index
+from quantized_factors import load_factors, PRECISION_ENV
+from interaction_store import InteractionStore, is_interaction_store, search_excluding, search_excluding_many
+from rec_store import RecommendationStore, is_recommendation_store
+from shared_artifacts import SHARED_ENV, source_signature, publish_artifacts, attach_artifacts
+from svdpp import SVDppScorer, is_svdpp_export, IMPLICIT_DIR
+from trending import TrendingEngine
+
+# Artifact locations; override them through the environment, or serve a bundle (see bundle.py)
+RECOMMENDATIONS_DIR = os.environ.get('RECSYS_RECOMMENDATIONS_DIR',
+                                     '/home/sagemaker-user/Pet-Product-RecSystem-Chatbot/Chatbot/recommendations/')
+DATA_DIR = os.environ.get('RECSYS_DATA_DIR', '/home/sagemaker-user/Data/')
+# New reviews / ratings (with the reviewer's user_id) are appended to this JSON-lines log as they arrive
+REVIEW_EVENTS_FILE = 'review_events.jsonl'
+
+def _with_catalog(scorer, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations,
+                  filtered_data, tfidf_vectorizer, tfidf_matrix, exclusions, data_dir):
+    """Build the item catalog and catalog delta over loaded artifacts and return the full artifact tuple."""
+    # Build the shared item lookups once (FAISS index / TF-IDF row / catalog row / ASIN),
+    # binary searching the memory-mapped ASIN arrays of the detail store and id map
+    if isinstance(filtered_data, DetailStore):
+        catalog = ItemCatalog.from_detail_store(item_id_map, filtered_data)
     else:
-        print("Product details file does not exist. Please ensure 'filtered_data_unique_asin.pkl' is in the DATA_DIR.")
-        filtered_data = pd.DataFrame()
+        catalog = ItemCatalog.from_filtered_data(item_id_map, filtered_data)
+    
+    # New or changed products since the last artifact build (see catalog_delta.py)
+    delta = CatalogDelta(os.path.join(data_dir, 'catalog_delta'), tfidf_vectorizer, catalog)
+    
+    return (scorer, user_factors, item_factors,
+            user_id_map, item_id_map, index, loaded_recommendations,
+            filtered_data, tfidf_vectorizer, tfidf_matrix, catalog, exclusions, delta)
+
+def load_recommendation_system(shared=None, bundle_dir=None, recommendations_dir=None, data_dir=None):
+    """
+    Load every artifact the recommenders need.
     
-    # Load TF-IDF Vectorizer and matrix
-    tfidf_vectorizer_path = os.path.join(RECOMMENDATIONS_DIR, 'tfidf_vectorizer.pkl')
-    tfidf_matrix_path = os.path.join(RECOMMENDATIONS_DIR, 'tfidf_matrix.npz')
+    Parameters:
+    - shared (bool, optional): Attach to artifacts published in shared memory by another
+      process (see shared_artifacts.py), publishing them first if none are current.
+      Defaults to the ARTIFACTS_SHARED environment variable.
+    - bundle_dir (str, optional): Serve a bundle written by bundle.py instead of the individual
+      artifacts; its arrays are memory-mapped, so shared mode is not needed. Defaults to the
+      RECSYS_BUNDLE environment variable; pass '' to load the individual artifacts.
+    - recommendations_dir, data_dir (str, optional): Locations of the individual artifacts
+      (default to RECOMMENDATIONS_DIR and DATA_DIR).
+    """
+    recommendations_dir = recommendations_dir or RECOMMENDATIONS_DIR
+    data_dir = data_dir or DATA_DIR
     
-    with open(tfidf_vectorizer_path, 'rb') as f:
-        tfidf_vectorizer = pickle.load(f)
+    if bundle_dir is None:
+        bundle_dir = os.environ.get(BUNDLE_ENV, '')
+    if bundle_dir:
+        # Every component is opened lazily on first use; the catalog below touches most of them
+        bundle = ArtifactBundle(bundle_dir)
+        return _with_catalog(bundle.scorer, bundle.user_factors, bundle.item_factors, bundle.user_id_map,
+                             bundle.item_id_map, bundle.index, bundle.recommendations, bundle.product_details,
+                             bundle.tfidf_vectorizer, bundle.tfidf_engine, bundle.exclusions, data_dir)
     
-    tfidf_matrix = sparse.load_npz(tfidf_matrix_path)
+    if shared is None:
+        shared = os.environ.get(SHARED_ENV, '') == '1'
     
-    return (recommendation_model, user_factors, item_factors,
-            user_id_map, item_id_map, index, loaded_recommendations,
-            filtered_data, tfidf_vectorizer, tfidf_matrix)
+    # Load the SVD++ scorer from its exported arrays (see svdpp.py); the pickled
+    # surprise model with its trainset is no longer needed at serving time
+    svdpp_dir = os.path.join(recommendations_dir, 'svdpp')
+    if is_svdpp_export(svdpp_dir):
+        scorer = SVDppScorer(svdpp_dir)
+    else:
+        print("SVD++ export not found; ranking by the FAISS index. "
+              "Run 'python app/svdpp.py' to export 'SVD++_best_model.pkl'.")
+        scorer = None
+    
+    user_factors_path = os.path.join(recommendations_dir, 'user_factors.npy')
+    item_factors_path = os.path.join(recommendations_dir, 'item_factors.npy')
+    user_id_map_path = os.path.join(recommendations_dir, 'user_id_map.pkl')
+    item_id_map_path = os.path.join(recommendations_dir, 'item_id_map.pkl')
+    recommendations_store_dir = os.path.join(data_dir, 'recommendations_store')
+    recommendations_path = os.path.join(data_dir, 'recommendations.h5')
+    detail_store_dir = os.path.join(data_dir, 'product_details')
+    filtered_data_path = os.path.join(data_dir, 'filtered_data_unique_asin.pkl')
+    tfidf_vectorizer_path = os.path.join(recommendations_dir, 'tfidf_vectorizer.pkl')
+    tfidf_matrix_path = os.path.join(recommendations_dir, 'tfidf_matrix.npz')
+    
+    # Load FAISS index (flat, IVF or HNSW; nprobe / efSearch come from the environment)
+    faiss_index_path = os.path.join(recommendations_dir, 'item_index.faiss')
+    index = load_item_index(faiss_index_path, mmap=shared)
+    
+    # In shared mode, attach zero-copy to the artifacts another process published
+    # (the TF-IDF vectorizer included, so it is not unpickled again)
+    attached = None
+    if shared:
+        sources = source_signature([
+            user_factors_path, item_factors_path, user_id_map_path, item_id_map_path,
+            os.path.join(recommendations_store_dir, 'user_keys.npy'), recommendations_path,
+            os.path.join(detail_store_dir, 'asins.npy'), filtered_data_path, tfidf_matrix_path,
+            tfidf_vectorizer_path,
+        ])
+        sources['precision'] = os.environ.get(PRECISION_ENV) or 'float32'
+        attached = attach_artifacts(sources)
+    
+    if attached is None:
+        # Load TF-IDF Vectorizer
+        with open(tfidf_vectorizer_path, 'rb') as f:
+            tfidf_vectorizer = pickle.load(f)
+        
+        # Load user and item factors (float16 / int8 memory-mapped variants when FACTORS_PRECISION is set)
+        user_factors = load_factors(user_factors_path)
+        item_factors = load_factors(item_factors_path)
+        
+        # Load user and item ID mappings
+        with open(user_id_map_path, 'rb') as f:
+            user_id_map = pickle.load(f)
+        
+        with open(item_id_map_path, 'rb') as f:
+            item_id_map = pickle.load(f)
+        
+        # Load pre-generated recommendations, preferring the memory-mapped store
+        # (see rec_store.py) over materialising the legacy HDF5 file into a dict
+        if is_recommendation_store(recommendations_store_dir):
+            loaded_recommendations = RecommendationStore(recommendations_store_dir)
+        else:
+            print("Recommendation store not found; loading 'recommendations.h5'. "
+                  "Run 'python app/precompute.py' (or 'python app/rec_store.py' to convert it) for faster startup.")
+            loaded_recommendations = {}
+            with h5py.File(recommendations_path, 'r') as hf:
+                for user_id in hf.keys():
+                    recommended_items = hf[user_id][:]
+                    # Decode bytes to strings if necessary
+                    recommended_items = [item.decode('utf-8') if isinstance(item, bytes) else item for item in recommended_items]
+                    loaded_recommendations[user_id] = recommended_items
+        
+        # Load product details, preferring the pre-rendered detail store (see detail_store.py)
+        # so the full object-dtype DataFrame is not held in memory
+        if is_detail_store(detail_store_dir):
+            filtered_data = DetailStore(detail_store_dir)
+        elif os.path.exists(filtered_data_path):
+            filtered_data = pd.read_pickle(filtered_data_path)
+        else:
+            print("Product details file does not exist. Please ensure 'filtered_data_unique_asin.pkl' is in the DATA_DIR.")
+            filtered_data = pd.DataFrame()
+        
+        # Load the TF-IDF matrix and build the inverted index used for keyword search
+        # (the raw matrix stays on `.matrix`)
+        tfidf_matrix = sparse.load_npz(tfidf_matrix_path)
+        tfidf_matrix = ContentSearchEngine(tfidf_vectorizer, tfidf_matrix)
+        
+        if shared:
+            # Publish for the other workers, then drop the private copies in favour of the shared ones
+            publish_artifacts(sources, user_factors, item_factors, user_id_map, item_id_map,
+                              loaded_recommendations, filtered_data, tfidf_matrix)
+            attached = attach_artifacts(sources)
+    
+    if attached is not None:
+        user_factors = attached['user_factors']
+        item_factors = attached['item_factors']
+        user_id_map = attached['user_id_map']
+        item_id_map = attached['item_id_map']
+        loaded_recommendations = attached['loaded_recommendations']
+        filtered_data = attached['filtered_data']
+        tfidf_vectorizer = attached['tfidf_vectorizer']
+        tfidf_matrix = attached['tfidf_matrix']
+    
+    # Load the per-user sets of already interacted items, if exported
+    interactions_dir = os.path.join(recommendations_dir, 'interactions')
+    if not is_interaction_store(interactions_dir):
+        # The SVD++ export carries the training interactions N(u)
+        interactions_dir = os.path.join(svdpp_dir, IMPLICIT_DIR)
+    exclusions = InteractionStore(interactions_dir) if is_interaction_store(interactions_dir) else None
+    
+    return _with_catalog(scorer, user_factors, item_factors, user_id_map, item_id_map, index,
+                         loaded_recommendations, filtered_data, tfidf_vectorizer, tfidf_matrix,
+                         exclusions, data_dir)
+
+def artifact_version(bundle_dir=None, recommendations_dir=None, data_dir=None):
+    """
+    Identify the artifacts load_recommendation_system() serves with the same arguments.
+    
+    A bundle is identified by the version in its manifest; individual artifacts by
+    the size and modification time of their files. Result caches compare it to
+    tell whether cached recommendations are still current.
+    """
+    if bundle_dir is None:
+        bundle_dir = os.environ.get(BUNDLE_ENV, '')
+    if bundle_dir:
+        return 'bundle:' + ArtifactBundle(bundle_dir).version
+    recommendations_dir = recommendations_dir or RECOMMENDATIONS_DIR
+    data_dir = data_dir or DATA_DIR
+    signature = source_signature([
+        os.path.join(recommendations_dir, name) for name in
+        ('user_factors.npy', 'item_factors.npy', 'item_id_map.pkl', 'item_index.faiss', 'tfidf_matrix.npz',
+         os.path.join('svdpp', 'user_vectors.npy'), os.path.join('interactions', 'offsets.npy'))
+    ] + [
+        os.path.join(data_dir, name) for name in
+        (os.path.join('recommendations_store', 'user_keys.npy'), 'recommendations.h5',
+         os.path.join('product_details', 'asins.npy'), 'filtered_data_unique_asin.pkl')
+    ])
+    return 'files:' + hashlib.sha1(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()[:16]
 
-def recommend(user_id, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations, top_k=10):
+def _pregenerated(loaded_recommendations, user_id, top_k, scorer=None):
+    """
+    A user's pre-generated list, or None.
+    
+    With an SVD++ scorer, only a store ranked by SVD++ (see precompute.py) is
+    used; lists ranked by the FAISS inner product would disagree with the scorer.
+    """
+    if isinstance(loaded_recommendations, RecommendationStore):
+        if scorer is not None and loaded_recommendations.ranking != 'svdpp':
+            return None
+        # Only the requested user's row is read from the memory-mapped store
+        return loaded_recommendations.get(user_id, top_k)
+    if scorer is not None or user_id not in loaded_recommendations:
+        return None
+    return loaded_recommendations[user_id][:top_k]
+
+def recommend(user_id, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations, top_k=10, catalog=None,
+              exclusions=None, user_vectors=None, delta=None, scorer=None):
     """
     Generate recommendations for a given user using collaborative filtering.
     
@@ -80,63 +241,461 @@ def recommend(user_id, user_factors, item_factors, user_id_map, item_id_map, ind
     - user_id_map (dict): Mapping from user IDs to indices.
     - item_id_map (dict): Mapping from item indices to IDs.
     - index (faiss.Index): FAISS index for efficient similarity search.
-    - loaded_recommendations (dict): Pre-generated recommendations.
+    - loaded_recommendations (dict or RecommendationStore): Pre-generated recommendations
+      (with `scorer`, only a store ranked by SVD++ is used).
     - top_k (int): Number of top recommendations to return.
+    - catalog (ItemCatalog, optional): Shared item lookups; avoids rebuilding the reverse item map.
+    - exclusions (InteractionStore, optional): Items the user already interacted with are
+      excluded inside the FAISS search, so exactly `top_k` unseen items come back.
+      Pre-generated lists are already filtered at export time.
+    - user_vectors (UserVectorCache, optional): Folded-in vectors of users missing from
+      user_id_map (see fold_in.py); their own interactions are excluded from the results.
+    - delta (CatalogDelta, optional): New or changed products merged into the FAISS results.
+    - scorer (SVDppScorer, optional): Ranks users of the factor model by full SVD++
+      predictions (biases and implicit feedback included) instead of the FAISS dot product.
     
     Returns:
     - recommendations (list): List of recommended item ASINs.
     """
     # Check if the user is in the pre-generated recommendations
-    if user_id in loaded_recommendations:
-        recommendations = loaded_recommendations[user_id][:top_k]
-    else:
-        # If user is not in the pre-generated list, attempt to generate recommendations using user factors
+    recommendations = _pregenerated(loaded_recommendations, user_id, top_k, scorer)
+
+    if recommendations is None:
+        # If user is not in the pre-generated list, attempt to generate recommendations using user factors,
+        # or a folded-in vector for users who arrived after the model export
+        user_vector, excluded = None, None
+        if scorer is not None and catalog is not None and user_id in user_id_map:
+            user_idx = user_id_map[user_id]
+            excluded = exclusions.seen_items(user_idx) if exclusions is not None else None
+            if delta is not None:
+                return delta.search_scorer(scorer, user_idx, top_k, excluded)
+            item_indices, _ = scorer.top_k(user_idx, top_k, excluded)
+            return catalog.asins_from_faiss(item_indices)
         if user_id in user_id_map:
             user_idx = user_id_map[user_id]
             user_vector = user_factors[user_idx].reshape(1, -1).astype('float32')
-            
+            if exclusions is not None:
+                excluded = exclusions.seen_items(user_idx)
+        elif user_vectors is not None and user_id in user_vectors:
+            user_vector = user_vectors.get(user_id).reshape(1, -1)
+            excluded = user_vectors.seen_items(user_id)
+        
+        if user_vector is not None and delta is not None and catalog is not None:
+            # Merge the base FAISS results with the delta segment's item vectors
+            recommendations = delta.search_vectors(index, user_vector, top_k, excluded)
+        elif user_vector is not None:
             # Perform nearest neighbor search using FAISS
-            _, item_indices = index.search(user_vector, top_k)
+            if excluded is not None:
+                _, item_indices = search_excluding(index, user_vector, top_k, excluded)
+            else:
+                _, item_indices = index.search(user_vector, top_k)
             item_indices = item_indices[0]
-            reverse_item_id_map = {v: k for k, v in item_id_map.items()}
-            recommendations = [reverse_item_id_map.get(idx) for idx in item_indices if idx in reverse_item_id_map]
+            if catalog is not None:
+                recommendations = catalog.asins_from_faiss(item_indices)
+            else:
+                reverse_item_id_map = {v: k for k, v in item_id_map.items()}
+                recommendations = [reverse_item_id_map.get(idx) for idx in item_indices if idx in reverse_item_id_map]
         else:
             # If user is unknown, return an empty list
             recommendations = []
     
     return recommendations
 
-def content_based_recommendation(user_keywords, tfidf_vectorizer, tfidf_matrix, filtered_data, top_k=5):
+def fold_in_new_user(user_id, user_id_map, user_vectors, events_path=None, data_dir=None):
+    """
+    Give a user missing from user_id_map a folded-in vector from their logged interactions.
+
+    Call this at login, before recommend(); users of the factor model and users
+    without interactions on known items are left as they are. A cached vector is
+    folded in again once the user has new events in the log.
+
+    Parameters:
+    - user_id (str): The ID of the user.
+    - user_id_map (dict or SharedIdMap): Users of the factor model.
+    - user_vectors (UserVectorCache): Cache the vector is stored in.
+    - events_path (str, optional): Review / purchase event log; defaults to the
+      review event log in `data_dir`.
+    - data_dir (str, optional): Data directory the artifacts were loaded from (defaults to DATA_DIR).
+
+    Returns:
+    - folded_in (bool): Whether the user now has a folded-in vector.
+    """
+    if user_id in user_id_map:
+        return False
+    events_path = events_path or os.path.join(data_dir or DATA_DIR, REVIEW_EVENTS_FILE)
+    return user_vectors.fold_in_from_log(user_id, events_path) is not None
+
+def recommend_many(user_ids, user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations,
+                   top_k=10, catalog=None, exclusions=None, user_vectors=None, chunk_size=1024, scorer=None):
+    """
+    Generate recommendations for many users at once.
+    
+    Users with pre-generated lists are served from `loaded_recommendations`. The
+    remaining known users have their factor vectors stacked and are searched with
+    one FAISS `index.search` call (or one blocked SVD++ scoring pass) per chunk of
+    `chunk_size` users.
+    
+    Parameters:
+    - user_ids (list): The IDs of the users.
+    - user_factors, item_factors, user_id_map, item_id_map, index, loaded_recommendations,
+      top_k, catalog, exclusions, user_vectors, scorer: As for recommend(). With exclusions, users
+      are searched in groups of similar exclusion counts (see search_excluding_many()).
+    - chunk_size (int): Number of users per FAISS search.
+    
+    Returns:
+    - recommendations (list of list): Recommended item ASINs per user, in input order
+      (an empty list for unknown users).
+    """
+    if catalog is None:
+        catalog = ItemCatalog(item_id_map, [])
+    
+    results = [None] * len(user_ids)
+    scored_positions = []
+    scored_users = []
+    search_positions = []
+    search_vectors = []
+    search_excluded = []
+    for position, user_id in enumerate(user_ids):
+        # Pre-generated recommendations first
+        pregenerated = _pregenerated(loaded_recommendations, user_id, top_k, scorer)
+        if pregenerated is not None:
+            results[position] = pregenerated
+        elif scorer is not None and user_id in user_id_map:
+            scored_positions.append(position)
+            scored_users.append(user_id_map[user_id])
+        elif user_id in user_id_map:
+            user_idx = user_id_map[user_id]
+            search_positions.append(position)
+            search_vectors.append(user_factors[user_idx])
+            search_excluded.append(exclusions.seen_items(user_idx) if exclusions is not None else None)
+        elif user_vectors is not None and user_id in user_vectors:
+            search_positions.append(position)
+            search_vectors.append(user_vectors.get(user_id))
+            search_excluded.append(user_vectors.seen_items(user_id))
+        else:
+            results[position] = []
+    
+    for start in range(0, len(scored_positions), chunk_size):
+        # Full SVD++ predictions for a chunk of users, exclusions masked before top-k
+        user_indices = scored_users[start:start + chunk_size]
+        excluded = [exclusions.seen_items(user_idx) for user_idx in user_indices] if exclusions is not None else None
+        item_indices, _ = scorer.top_k_many(user_indices, top_k, excluded)
+        for position, row in zip(scored_positions[start:start + chunk_size], item_indices):
+            results[position] = catalog.asins_from_faiss(row)
+    
+    for start in range(0, len(search_positions), chunk_size):
+        # One FAISS search per chunk of stacked user vectors
+        user_vectors_chunk = np.ascontiguousarray(search_vectors[start:start + chunk_size], dtype='float32')
+        _, item_indices = search_excluding_many(index, user_vectors_chunk, top_k,
+                                                search_excluded[start:start + chunk_size])
+        for position, row in zip(search_positions[start:start + chunk_size], item_indices):
+            results[position] = catalog.asins_from_faiss(row)
+    
+    return results
+
+def content_based_recommendation(user_keywords, tfidf_vectorizer, tfidf_matrix, filtered_data, top_k=5, catalog=None,
+                                 delta=None):
     """
     Generate content-based recommendations based on user-provided keywords.
     
     Parameters:
     - user_keywords (str): Keywords entered by the user.
     - tfidf_vectorizer (TfidfVectorizer): Pre-trained TF-IDF vectorizer.
-    - tfidf_matrix (sparse matrix): Pre-computed TF-IDF matrix for all products.
+    - tfidf_matrix (sparse matrix or ContentSearchEngine): Pre-computed TF-IDF matrix for all products.
     - filtered_data (pd.DataFrame): DataFrame containing product details.
     - top_k (int): Number of top recommendations to return.
+    - catalog (ItemCatalog, optional): Shared item lookups for mapping TF-IDF rows to ASINs.
+    - delta (CatalogDelta, optional): New or changed products merged into the results.
     
     Returns:
     - recommended_asins (list): List of recommended product ASINs.
     """
-    # Convert user input keywords to TF-IDF vector
-    user_tfidf = tfidf_vectorizer.transform([user_keywords])
-    # Compute cosine similarity with all products
-    cosine_similarities = cosine_similarity(user_tfidf, tfidf_matrix).flatten()
-    # Get indices of top similar products
-    top_indices = cosine_similarities.argsort()[-top_k:][::-1]
+    if isinstance(tfidf_matrix, ContentSearchEngine) and delta is not None and catalog is not None:
+        delta.refresh()
+        if len(delta):
+            # Base and delta products ranked together by cosine similarity
+            return delta.search_content(tfidf_matrix, user_keywords, top_k)
+    if isinstance(tfidf_matrix, ContentSearchEngine):
+        # Only score products sharing a term with the keywords, partial top-k selection
+        top_indices = tfidf_matrix.search(user_keywords, top_k)
+    else:
+        # Convert user input keywords to TF-IDF vector
+        user_tfidf = tfidf_vectorizer.transform([user_keywords])
+        # Compute cosine similarity with all products
+        cosine_similarities = cosine_similarity(user_tfidf, tfidf_matrix).flatten()
+        # Get indices of top similar products
+        top_indices = cosine_similarities.argsort()[-top_k:][::-1]
     # Retrieve corresponding ASINs
-    recommended_asins = filtered_data.iloc[top_indices]['parent_asin'].tolist()
+    if catalog is not None:
+        recommended_asins = catalog.asins_from_rows(top_indices)
+    else:
+        recommended_asins = filtered_data.iloc[top_indices]['parent_asin'].tolist()
     return recommended_asins
 
-def load_hot_products():
+# Default blend of the hybrid scorer: CF inner product, TF-IDF cosine, popularity_score
+HYBRID_WEIGHTS = {'cf': 0.6, 'content': 0.3, 'popularity': 0.1}
+
+def hybrid_scores(cf_scores, content_scores, popularity, weights=None):
+    """
+    Blend the signals of a candidate block into one score per candidate.
+    
+    Each signal is min-max normalized over the block, then the three are combined
+    as a single weighted matrix-vector product.
+    
+    Parameters:
+    - cf_scores (np.ndarray): CF inner products of the candidates.
+    - content_scores (np.ndarray): TF-IDF cosine similarities of the candidates.
+    - popularity (np.ndarray): popularity_score of the candidates.
+    - weights (dict, optional): Keys 'cf', 'content', 'popularity'; defaults to HYBRID_WEIGHTS.
+    
+    Returns:
+    - scores (np.ndarray): Blended score of each candidate.
+    """
+    weights = dict(HYBRID_WEIGHTS, **(weights or {}))
+    features = np.vstack((cf_scores, content_scores, popularity)).astype(np.float64)
+    low = features.min(axis=1, keepdims=True)
+    span = features.max(axis=1, keepdims=True) - low
+    span[span == 0] = 1.0
+    features = (features - low) / span
+    return np.array([weights['cf'], weights['content'], weights['popularity']]) @ features
+
+def _split_delta(asins, delta, catalog):
+    """Catalog rows of the base products among `asins`, and the delta products among them."""
+    base, in_delta = [], []
+    for asin in asins:
+        (in_delta if asin in delta else base).append(asin)
+    rows = [catalog.row_of(asin) for asin in base]
+    return np.array([row for row in rows if row is not None], dtype=np.int64), in_delta
+
+def _delta_signals(delta, asins, user_vector, query, item_factors, catalog):
+    """CF, content and popularity signals of delta products, computed as for base candidates."""
+    cf_scores = np.zeros(len(asins))
+    if user_vector is not None:
+        vector_positions = {asin: i for i, asin in enumerate(delta.vector_asins)}
+        for i, asin in enumerate(asins):
+            if asin in vector_positions:
+                vector = delta.raw_vectors[vector_positions[asin]]
+            elif catalog.faiss_index_of(asin) is not None:
+                # A changed product without a new vector keeps its base factors
+                vector = item_factors[catalog.faiss_index_of(asin)]
+            else:
+                continue
+            vector = np.asarray(vector, dtype=np.float64)
+            cf_scores[i] = vector @ user_vector[0].astype(np.float64) / (np.linalg.norm(vector) or 1.0)
+    
+    content_scores = np.zeros(len(asins))
+    if query is not None and delta.tfidf is not None:
+        query_norm = np.sqrt(query.multiply(query).sum())
+        if query_norm > 0:
+            positions = {asin: i for i, asin in enumerate(delta.asins)}
+            rows = [positions[asin] for asin in asins]
+            content_scores = (delta.tfidf[rows] @ query.T).toarray().ravel() / query_norm
+    
+    popularity = np.array([delta.records[asin]['popularity_score'] for asin in asins], dtype=np.float64)
+    return cf_scores, content_scores, popularity
+
+def hybrid_recommendation(user_id, user_keywords, user_factors, item_factors, user_id_map, index, tfidf_matrix,
+                          catalog, top_k=10, n_candidates=200, weights=None, exclusions=None, user_vectors=None,
+                          delta=None, scorer=None):
+    """
+    Recommend by blending collaborative filtering, keyword relevance and popularity.
+    
+    The candidate block is the union of the top `n_candidates` for the user and the
+    TF-IDF top `n_candidates` for the keywords; either retriever is skipped when the
+    user is unknown or no keywords are given. The user's candidates come from the
+    same source as recommend(): the SVD++ scorer for users of the factor model when
+    `scorer` is given, the FAISS index otherwise. With `delta`, both retrievers merge
+    in the delta segment, so new and changed products are blended like base ones.
+    
+    Parameters:
+    - user_id (str): The ID of the user.
+    - user_keywords (str or None): Keywords entered by the user.
+    - user_factors, item_factors, user_id_map, index: As for recommend().
+    - tfidf_matrix (ContentSearchEngine): Keyword search engine.
+    - catalog (ItemCatalog): Shared item lookups (with popularity).
+    - top_k (int): Number of top recommendations to return.
+    - n_candidates (int): Candidates taken from each retriever.
+    - weights (dict, optional): Blend weights, see HYBRID_WEIGHTS.
+    - exclusions (InteractionStore, optional): Already interacted items to leave out.
+    - user_vectors (UserVectorCache, optional): Folded-in vectors of users missing from user_id_map.
+    - delta (CatalogDelta, optional): New or changed products, as for recommend().
+    - scorer (SVDppScorer, optional): Retrieves the candidates of users of the factor model.
+    
+    Returns:
+    - recommendations (list): List of recommended item ASINs.
+    """
+    candidate_rows = []
+    delta_asins = []
+    user_idx, user_vector = None, None
+    excluded = np.empty(0, dtype=np.int64)
+    if user_id in user_id_map:
+        user_idx = user_id_map[user_id]
+        user_vector = np.asarray(user_factors[user_idx], dtype='float32').reshape(1, -1)
+        if exclusions is not None:
+            excluded = exclusions.seen_items(user_idx)
+    elif user_vectors is not None and user_id in user_vectors:
+        user_vector = user_vectors.get(user_id).reshape(1, -1)
+        excluded = user_vectors.seen_items(user_id)
+    if user_vector is not None:
+        use_scorer = scorer is not None and user_idx is not None
+        if delta is not None:
+            if use_scorer:
+                asins = delta.search_scorer(scorer, user_idx, n_candidates, excluded)
+            else:
+                asins = delta.search_vectors(index, user_vector, n_candidates, excluded)
+            rows, in_delta = _split_delta(asins, delta, catalog)
+            candidate_rows.append(rows)
+            delta_asins += in_delta
+        elif use_scorer:
+            item_indices, _ = scorer.top_k(user_idx, n_candidates, excluded)
+            candidate_rows.append(catalog.rows_from_faiss(item_indices))
+        else:
+            _, item_indices = search_excluding(index, user_vector, n_candidates, excluded)
+            item_indices = item_indices[0][item_indices[0] >= 0]
+            candidate_rows.append(catalog.rows_from_faiss(item_indices))
+    
+    query = None
+    query_docs = np.empty(0, dtype=np.int64)
+    query_scores = np.empty(0, dtype=np.float64)
+    if user_keywords:
+        query = tfidf_matrix.transform([user_keywords])
+        terms, term_weights = query.indices.astype(np.int64), query.data
+        query_docs, query_scores = tfidf_matrix.score(terms, term_weights)
+        if delta is not None:
+            rows, in_delta = _split_delta(delta.search_content(tfidf_matrix, user_keywords, n_candidates),
+                                          delta, catalog)
+            candidate_rows.append(rows)
+            delta_asins += in_delta
+        else:
+            candidate_rows.append(tfidf_matrix.rank(query_docs, query_scores, n_candidates))
+    
+    if not candidate_rows:
+        return []
+    rows = np.unique(np.concatenate(candidate_rows))
+    rows = rows[rows >= 0]
+    delta_asins = list(dict.fromkeys(delta_asins))
+    if len(excluded):
+        rows = rows[~np.isin(catalog.row_to_faiss[rows], excluded)]
+        # A changed product the user already interacted with stays excluded
+        excluded_set = set(excluded.tolist())
+        delta_asins = [asin for asin in delta_asins if catalog.faiss_index_of(asin) not in excluded_set]
+    if len(rows) == 0 and not delta_asins:
+        return []
+    
+    # CF signal: cosine between the user vector and each candidate's item factors
+    cf_scores = np.zeros(len(rows))
+    if user_vector is not None:
+        faiss_indices = catalog.row_to_faiss[rows]
+        has_factors = faiss_indices >= 0
+        vectors = np.asarray(item_factors[faiss_indices[has_factors]], dtype=np.float64)
+        norms = np.linalg.norm(vectors, axis=1)
+        norms[norms == 0] = 1.0
+        cf_scores[has_factors] = vectors @ user_vector[0].astype(np.float64) / norms
+    
+    # Content signal: look the candidates up in the query's sparse score vector
+    content_scores = np.zeros(len(rows))
+    if len(query_docs):
+        positions = np.minimum(np.searchsorted(query_docs, rows), len(query_docs) - 1)
+        matched = query_docs[positions] == rows
+        content_scores[matched] = query_scores[positions[matched]]
+    
+    popularity = catalog.popularity[rows]
+    if delta_asins:
+        # Delta products are appended after the base rows of the block
+        delta_cf, delta_content, delta_popularity = _delta_signals(delta, delta_asins, user_vector, query,
+                                                                   item_factors, catalog)
+        cf_scores = np.concatenate([cf_scores, delta_cf])
+        content_scores = np.concatenate([content_scores, delta_content])
+        popularity = np.concatenate([popularity, delta_popularity])
+    
+    scores = hybrid_scores(cf_scores, content_scores, popularity, weights)
+    top_k = min(top_k, len(scores))
+    best = np.argpartition(-scores, top_k - 1)[:top_k]
+    best = best[np.argsort(-scores[best], kind='stable')]
+    base_asins = iter(catalog.asins_from_rows(rows[best[best < len(rows)]]))
+    return [next(base_asins) if i < len(rows) else delta_asins[i - len(rows)] for i in best]
+
+def hybrid_scoring_latency(n_candidates=300, repeats=1000):
     """
-    Load the top 5 hot products from a CSV file.
+    Measure the latency of hybrid_scores() plus top-10 selection over a synthetic candidate block.
+    
+    Returns:
+    - latency (dict): p50 and p99 in milliseconds.
+    """
+    rng = np.random.default_rng(0)
+    cf_scores, content_scores = rng.random(n_candidates), rng.random(n_candidates)
+    popularity = rng.random(n_candidates) * 5
+    latencies = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        scores = hybrid_scores(cf_scores, content_scores, popularity)
+        best = np.argpartition(-scores, 9)[:10]
+        best[np.argsort(-scores[best])]
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.array(latencies) * 1000
+    return {'p50_ms': float(np.percentile(latencies_ms, 50)), 'p99_ms': float(np.percentile(latencies_ms, 99))}
+
+def load_trending_engine(filtered_data, data_dir=None):
+    """
+    Build the trending engine from the catalog and apply the review events logged so far.
+    
+    Parameters:
+    - filtered_data (pd.DataFrame or DetailStore): Product details.
+    - data_dir (str, optional): Data directory holding the review event log (defaults to DATA_DIR).
     
     Returns:
-    - top_5_df (pd.DataFrame): DataFrame containing top 5 hot products.
+    - trending (TrendingEngine or None): None if the catalog is empty.
     """
+    if isinstance(filtered_data, DetailStore):
+        numbers = np.asarray(filtered_data.numbers)
+        asins = filtered_data.row_asins()
+        categories = filtered_data.categories()
+        average_rating, rating_number = numbers[:, 0], numbers[:, 1]
+    elif not filtered_data.empty:
+        asins = filtered_data['parent_asin'].tolist()
+        categories = filtered_data['categories'].tolist()
+        average_rating = filtered_data['average_rating'].to_numpy()
+        rating_number = filtered_data['rating_number'].to_numpy()
+    else:
+        return None
+    
+    events_path = os.path.join(data_dir or DATA_DIR, REVIEW_EVENTS_FILE)
+    trending = TrendingEngine(asins, categories, average_rating, rating_number, events_path=events_path)
+    trending.consume()
+    return trending
+
+def load_hot_products(trending=None, filtered_data=None, category=None, n=5):
+    """
+    Load the top hot products, overall or within one category.
+    
+    Parameters:
+    - trending (TrendingEngine, optional): Live trending lists; without it the static
+      top 5 from the CSV file is returned.
+    - filtered_data (pd.DataFrame or DetailStore, optional): Product details, required with `trending`.
+    - category (str, optional): Category name (e.g. 'Dogs'); None for the overall list.
+    - n (int): Number of products.
+    
+    Returns:
+    - top_5_df (pd.DataFrame): DataFrame containing the hot products.
+    """
+    if trending is not None:
+        # Pick up reviews logged since the last call, then read the maintained top list
+        trending.consume()
+        asins = trending.hot_products(category, n)
+        if isinstance(filtered_data, DetailStore):
+            records = [filtered_data.get(asin) for asin in asins]
+            return pd.DataFrame([{
+                'parent_asin': record['ASIN'],
+                'description': record['Description'],
+                'details': record['Details'],
+                'categories': record['Categories'],
+                'average_rating': record['Average Rating'],
+                'rating_number': record['Number of Ratings'],
+                'popularity_score': record['Popularity Score'],
+            } for record in records])
+        rows = [trending.asin_to_item[asin] for asin in asins]
+        return filtered_data.iloc[rows].reset_index(drop=True)
+    
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
     RECOMMENDATIONS_DIR = os.path.join(BASE_DIR, '../recommendations')
     hot_products_path = os.path.join(RECOMMENDATIONS_DIR, 'top_5.csv')
@@ -148,25 +707,39 @@ def load_hot_products():
     top_5_df = pd.read_csv(hot_products_path)
     return top_5_df
 
-def get_product_details(filtered_data, asin):
+def get_product_details(filtered_data, asin, catalog=None, delta=None):
     """
     Retrieve detailed information of a product based on its ASIN.
     
     Parameters:
-    - filtered_data (pd.DataFrame): DataFrame containing product details.
+    - filtered_data (pd.DataFrame or DetailStore): Product details.
     - asin (str): The ASIN of the product.
+    - catalog (ItemCatalog, optional): Shared item lookups; replaces the full-table scan with a row lookup.
+    - delta (CatalogDelta, optional): New or changed products, which take precedence.
     
     Returns:
     - details (dict or None): Dictionary containing product details or None if not found.
     """
-    product = filtered_data[filtered_data['parent_asin'] == asin]
+    if delta is not None:
+        details = delta.details(asin)
+        if details is not None:
+            return details
+    if isinstance(filtered_data, DetailStore):
+        # Pre-rendered record, served from the LRU cache for hot items
+        record = filtered_data.get(asin)
+        return dict(record) if record is not None else None
+    if catalog is not None:
+        row = catalog.row_of(asin)
+        product = filtered_data.iloc[[row]] if row is not None else filtered_data.iloc[0:0]
+    else:
+        product = filtered_data[filtered_data['parent_asin'] == asin]
     if not product.empty:
         product = product.iloc[0]
         details = {
             'ASIN': product['parent_asin'],
-            'Description': ' '.join(product['description']) if isinstance(product['description'], list) else str(product['description']),
-            'Details': ', '.join([f"{k}: {v}" for k, v in product['details'].items()]) if isinstance(product['details'], dict) else str(product['details']),
-            'Categories': ' > '.join(product['categories']) if isinstance(product['categories'], list) else str(product['categories']),
+            'Description': format_description(product['description']),
+            'Details': format_details(product['details']),
+            'Categories': format_categories(product['categories']),
             'Average Rating': product['average_rating'],
             'Number of Ratings': product['rating_number'],
             'Popularity Score': product['popularity_score']
@@ -0,0 +1,124 @@
+# app/result_cache.py
+
+import time
+from collections import OrderedDict
+
+
+def normalize_keywords(user_keywords, tfidf_vectorizer=None):
+    """
+    Canonical form of a keyword query, used as its cache key.
+
+    With the vectorizer, the query is reduced to its sorted in-vocabulary terms
+    (repeats kept), which is exactly what its TF-IDF vector depends on: "Dog
+    toys!" and "toys for dogs" share one entry when they rank the same products.
+    Without it, the query is lower-cased with whitespace collapsed.
+    """
+    if tfidf_vectorizer is None:
+        return ' '.join(user_keywords.lower().split())
+    vocabulary = tfidf_vectorizer.vocabulary_
+    terms = [term for term in tfidf_vectorizer.build_analyzer()(user_keywords) if term in vocabulary]
+    return ' '.join(sorted(terms))
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of recommendation results with a per-entry TTL.
+
+    Keys are tuples such as ('user', user_id, top_k) or ('keywords',
+    normalize_keywords(...), top_k). Lookups ask `version_fn` for the version of
+    what is being served (loaded artifacts, catalog delta), at most once every
+    `check_interval` seconds since it may touch the disk; when it differs from
+    the version the entries were computed under, the cache is cleared, so a
+    result outlives the data it was computed from by at most that interval.
+    """
+
+    def __init__(self, max_entries=4096, ttl=600.0, version_fn=None, clock=time.monotonic, check_interval=1.0):
+        """
+        Parameters:
+        - max_entries (int): Maximum number of cached results; least recently used go first.
+        - ttl (float): Seconds an entry stays valid.
+        - version_fn (callable, optional): Returns the current (hashable) data version.
+        - clock (callable): Time source in seconds.
+        - check_interval (float): Minimum seconds between two version_fn calls; 0 checks on every lookup.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_fn = version_fn
+        self.clock = clock
+        self.check_interval = check_interval
+        self.version = version_fn() if version_fn is not None else None
+        self._next_check = clock() + check_interval
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        now = self.clock()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        version = self.version_fn()
+        if version != self.version:
+            self.version = version
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def get(self, key, default=None):
+        """Return the cached result for `key` (refreshing its LRU position), or `default`."""
+        self._check_version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= self.clock():
+            del self._entries[key]
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return list(entry[1])
+
+    def put(self, key, result):
+        """Cache a result list under `key`."""
+        self._entries[key] = (self.clock() + self.ttl, tuple(result))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Return the cached result for `key`, or call `compute()` and cache what it returns."""
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def invalidate(self, key=None):
+        """Drop one entry, or every entry when `key` is None."""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        """Counters since creation, plus the current size and hit rate."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'expirations': self.expirations,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,250 @@
+# app/shared_artifacts.py
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from content_search import ContentSearchEngine
+from detail_store import DetailStore, build_detail_store
+from quantized_factors import QuantizedFactors
+from rec_store import RecommendationStore, write_recommendation_store
+
+# Shared mode is switched on per deployment through the environment
+SHARED_ENV = 'ARTIFACTS_SHARED'
+SHARED_DIR_ENV = 'ARTIFACTS_SHARED_DIR'
+MANIFEST_FILE = 'manifest.json'
+
+
+def shared_dir():
+    """Directory the artifacts are published to; RAM-backed /dev/shm when available."""
+    if os.environ.get(SHARED_DIR_ENV):
+        return os.environ[SHARED_DIR_ENV]
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'pet-recsys-artifacts')
+
+
+def source_signature(paths):
+    """Size and modification time of each source artifact; a change invalidates the shared copy."""
+    signature = {}
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature[path] = [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+class SharedIdMap:
+    """
+    Read-only str -> int mapping over memory-mapped arrays (sorted byte keys + values).
+
+    Stands in for the pickled user_id_map / item_id_map dicts: `in`, `[]`,
+    get(), items() and values() behave the same, but the arrays are shared
+    by every process that attaches instead of being rebuilt as Python objects.
+    """
+
+    def __init__(self, key_array, value_array):
+        self.key_array = key_array
+        self.value_array = value_array
+
+    def __len__(self):
+        return len(self.key_array)
+
+    def _find(self, key):
+        key = key.encode('utf-8') if isinstance(key, str) else key
+        if not isinstance(key, bytes) or len(key) > self.key_array.dtype.itemsize:
+            return -1
+        pos = int(np.searchsorted(self.key_array, key))
+        if pos < len(self.key_array) and self.key_array[pos] == key:
+            return pos
+        return -1
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __getitem__(self, key):
+        pos = self._find(key)
+        if pos < 0:
+            raise KeyError(key)
+        return int(self.value_array[pos])
+
+    def get(self, key, default=None):
+        pos = self._find(key)
+        return int(self.value_array[pos]) if pos >= 0 else default
+
+    def keys(self):
+        return [key.decode('utf-8') for key in self.key_array]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def values(self):
+        return np.asarray(self.value_array)
+
+    def items(self):
+        return zip(self.keys(), self.values().tolist())
+
+
+def save_id_map(out_dir, name, id_map):
+    """Write a str -> int dict as `name`_keys.npy / `name`_values.npy, sorted by key."""
+    keys = np.array([key.encode('utf-8') for key in id_map], dtype=np.bytes_)
+    if len(keys) == 0:
+        keys = np.array([], dtype='S1')
+    values = np.fromiter(id_map.values(), dtype=np.int64, count=len(id_map))
+    order = np.argsort(keys, kind='stable')
+    np.save(os.path.join(out_dir, f'{name}_keys.npy'), keys[order])
+    np.save(os.path.join(out_dir, f'{name}_values.npy'), values[order])
+
+
+def load_id_map(out_dir, name):
+    """Open a map written by save_id_map() as a memory-mapped SharedIdMap."""
+    return SharedIdMap(np.load(os.path.join(out_dir, f'{name}_keys.npy'), mmap_mode='r'),
+                       np.load(os.path.join(out_dir, f'{name}_values.npy'), mmap_mode='r'))
+
+
+def _save_factors(out_dir, name, factors):
+    """Copy a float factor array into the shared directory; quantized factors are already memory-mapped."""
+    if isinstance(factors, QuantizedFactors):
+        return {'kind': 'quantized', 'path': factors.factors_path, 'precision': factors.precision}
+    np.save(os.path.join(out_dir, f'{name}.npy'), np.asarray(factors))
+    return {'kind': 'array'}
+
+
+def _load_factors(out_dir, name, entry):
+    if entry['kind'] == 'quantized':
+        return QuantizedFactors(entry['path'], entry['precision'])
+    return np.load(os.path.join(out_dir, f'{name}.npy'), mmap_mode='r')
+
+
+def publish_artifacts(sources, user_factors, item_factors, user_id_map, item_id_map,
+                      loaded_recommendations, filtered_data, tfidf_engine, out_dir=None):
+    """
+    Write the in-memory artifacts of one loaded process as memory-mappable files.
+
+    The files are written into a private temporary directory that is then renamed
+    into place, so attaching processes see either no copy or a complete one.
+    Artifacts that are already memory-mapped stores (quantized factors,
+    RecommendationStore, DetailStore) are referenced by path instead of copied.
+
+    Parameters:
+    - sources (dict): source_signature() of the artifacts the objects were loaded from.
+    - user_factors ... tfidf_engine: As returned by load_recommendation_system().
+    - out_dir (str, optional): Target directory (defaults to shared_dir()).
+
+    Returns:
+    - published (bool): False if another process published the same sources first.
+    """
+    out_dir = out_dir or shared_dir()
+    parent = os.path.dirname(out_dir.rstrip(os.sep)) or '.'
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.publishing-', dir=parent)
+    try:
+        manifest = {'sources': sources}
+        manifest['user_factors'] = _save_factors(tmp_dir, 'user_factors', user_factors)
+        manifest['item_factors'] = _save_factors(tmp_dir, 'item_factors', item_factors)
+        save_id_map(tmp_dir, 'user_id_map', user_id_map)
+        save_id_map(tmp_dir, 'item_id_map', item_id_map)
+
+        if isinstance(loaded_recommendations, RecommendationStore):
+            manifest['recommendations'] = loaded_recommendations.store_dir
+        else:
+            write_recommendation_store(os.path.join(tmp_dir, 'recommendations'), loaded_recommendations.items())
+            manifest['recommendations'] = None
+
+        if isinstance(filtered_data, DetailStore):
+            manifest['product_details'] = filtered_data.store_dir
+        elif filtered_data.empty:
+            manifest['product_details'] = ''
+        else:
+            build_detail_store(filtered_data, os.path.join(tmp_dir, 'product_details'))
+            manifest['product_details'] = None
+
+        matrix = tfidf_engine.matrix
+        np.save(os.path.join(tmp_dir, 'tfidf_data.npy'), matrix.data)
+        np.save(os.path.join(tmp_dir, 'tfidf_indices.npy'), matrix.indices)
+        np.save(os.path.join(tmp_dir, 'tfidf_indptr.npy'), matrix.indptr)
+        np.save(os.path.join(tmp_dir, 'posting_ptr.npy'), tfidf_engine.posting_ptr)
+        np.save(os.path.join(tmp_dir, 'posting_docs.npy'), tfidf_engine.posting_docs)
+        np.save(os.path.join(tmp_dir, 'posting_weights.npy'), tfidf_engine.posting_weights)
+        manifest['tfidf_shape'] = list(matrix.shape)
+        # The vectorizer as arrays, so attaching processes need not unpickle it
+        from bundle import vectorizer_to_arrays
+        params, _, idf = vectorizer_to_arrays(tfidf_engine.vectorizer)
+        save_id_map(tmp_dir, 'tfidf_vocabulary', tfidf_engine.vectorizer.vocabulary_)
+        np.save(os.path.join(tmp_dir, 'tfidf_idf.npy'), idf)
+        manifest['tfidf_vectorizer'] = params
+
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f)
+
+        if os.path.isdir(out_dir):
+            # Stale copy: move it aside; processes attached to it keep their mappings
+            stale_dir = tempfile.mkdtemp(prefix='.stale-', dir=parent)
+            try:
+                os.replace(out_dir, os.path.join(stale_dir, 'artifacts'))
+            except OSError:
+                pass
+            shutil.rmtree(stale_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, out_dir)
+        except OSError:
+            # Another process published concurrently
+            return False
+        return True
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def attach_artifacts(sources, tfidf_vectorizer=None, out_dir=None):
+    """
+    Attach to published artifacts without copying them.
+
+    Parameters:
+    - sources (dict): source_signature() of the current artifacts; a copy
+      published from different sources is ignored.
+    - tfidf_vectorizer (TfidfVectorizer, optional): Vectorizer for the keyword search
+      engine; by default it is rebuilt from the published arrays, with its vocabulary
+      memory-mapped.
+    - out_dir (str, optional): Published directory (defaults to shared_dir()).
+
+    Returns:
+    - artifacts (dict or None): user_factors, item_factors, user_id_map, item_id_map,
+      loaded_recommendations, filtered_data, tfidf_vectorizer and tfidf_matrix
+      (a ContentSearchEngine), or None if nothing current is published.
+    """
+    out_dir = out_dir or shared_dir()
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('sources') != sources:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(out_dir, name), mmap_mode='r')
+
+    if tfidf_vectorizer is None:
+        from bundle import vectorizer_from_arrays
+        tfidf_vectorizer = vectorizer_from_arrays(manifest['tfidf_vectorizer'], None, load('tfidf_idf.npy'),
+                                                  load_id_map(out_dir, 'tfidf_vocabulary'))
+    matrix = sparse.csr_matrix((load('tfidf_data.npy'), load('tfidf_indices.npy'), load('tfidf_indptr.npy')),
+                               shape=tuple(manifest['tfidf_shape']), copy=False)
+    tfidf_engine = ContentSearchEngine.from_arrays(tfidf_vectorizer, matrix, load('posting_ptr.npy'),
+                                                   load('posting_docs.npy'), load('posting_weights.npy'))
+    return {
+        'user_factors': _load_factors(out_dir, 'user_factors', manifest['user_factors']),
+        'item_factors': _load_factors(out_dir, 'item_factors', manifest['item_factors']),
+        'user_id_map': load_id_map(out_dir, 'user_id_map'),
+        'item_id_map': load_id_map(out_dir, 'item_id_map'),
+        'loaded_recommendations': RecommendationStore(manifest['recommendations'] or
+                                                      os.path.join(out_dir, 'recommendations')),
+        'filtered_data': pd.DataFrame() if manifest['product_details'] == '' else
+        DetailStore(manifest['product_details'] or os.path.join(out_dir, 'product_details')),
+        'tfidf_vectorizer': tfidf_vectorizer,
+        'tfidf_matrix': tfidf_engine,
+    }
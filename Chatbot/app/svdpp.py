@@ -0,0 +1,185 @@
+# app/svdpp.py
+
+import os
+import sys
+import pickle
+import numpy as np
+from scipy import sparse
+
+from interaction_store import write_interaction_store
+
+# Arrays of an exported SVD++ model
+GLOBAL_MEAN_FILE = 'global_mean.npy'
+USER_BIAS_FILE = 'bu.npy'
+ITEM_BIAS_FILE = 'bi.npy'
+USER_FACTORS_FILE = 'pu.npy'
+ITEM_FACTORS_FILE = 'qi.npy'
+IMPLICIT_FACTORS_FILE = 'yj.npy'
+# p_u + |N(u)|^-1/2 * sum_{j in N(u)} y_j, precomputed per user
+USER_VECTORS_FILE = 'user_vectors.npy'
+# Interaction store of N(u), the items each user rated in the training set
+IMPLICIT_DIR = 'implicit'
+# Scores computed per block over all users of a top_k_many() call (float32, 32 MB;
+# the selection temporaries take a few times that), so memory does not grow with the batch
+MAX_BLOCK_SCORES = 1 << 23
+
+EXPORT_FILES = (GLOBAL_MEAN_FILE, USER_BIAS_FILE, ITEM_BIAS_FILE, USER_FACTORS_FILE,
+                ITEM_FACTORS_FILE, IMPLICIT_FACTORS_FILE, USER_VECTORS_FILE)
+
+
+def export_svdpp(model, out_dir):
+    """
+    Export a trained surprise SVDpp model to plain NumPy arrays.
+
+    Parameters:
+    - model (surprise.SVDpp): The trained model (e.g. the unpickled SVD++_best_model.pkl).
+    - out_dir (str): Output directory, created if missing.
+
+    Returns:
+    - shape (tuple): (n_users, n_items, n_factors).
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    trainset = model.trainset
+    n_users, n_items = trainset.n_users, trainset.n_items
+
+    # N(u) as a sparse matrix with rows scaled by |N(u)|^-1/2
+    user_indices, item_indices = [], []
+    for user_idx, ratings in trainset.ur.items():
+        user_indices.extend([user_idx] * len(ratings))
+        item_indices.extend(item_idx for item_idx, _ in ratings)
+    user_indices = np.array(user_indices, dtype=np.int64)
+    item_indices = np.array(item_indices, dtype=np.int64)
+    counts = np.bincount(user_indices, minlength=n_users)
+    weights = 1.0 / np.sqrt(np.maximum(counts, 1))[user_indices]
+    implicit = sparse.csr_matrix((weights, (user_indices, item_indices)), shape=(n_users, n_items))
+    user_vectors = model.pu + implicit @ model.yj
+
+    np.save(os.path.join(out_dir, GLOBAL_MEAN_FILE), np.float64(trainset.global_mean))
+    np.save(os.path.join(out_dir, USER_BIAS_FILE), np.asarray(model.bu, dtype=np.float32))
+    np.save(os.path.join(out_dir, ITEM_BIAS_FILE), np.asarray(model.bi, dtype=np.float32))
+    np.save(os.path.join(out_dir, USER_FACTORS_FILE), np.asarray(model.pu, dtype=np.float32))
+    np.save(os.path.join(out_dir, ITEM_FACTORS_FILE), np.asarray(model.qi, dtype=np.float32))
+    np.save(os.path.join(out_dir, IMPLICIT_FACTORS_FILE), np.asarray(model.yj, dtype=np.float32))
+    np.save(os.path.join(out_dir, USER_VECTORS_FILE), np.asarray(user_vectors, dtype=np.float32))
+    write_interaction_store(os.path.join(out_dir, IMPLICIT_DIR), user_indices, item_indices, n_users)
+    return n_users, n_items, model.qi.shape[1]
+
+
+def is_svdpp_export(model_dir):
+    """Check whether `model_dir` contains a complete SVD++ export."""
+    return all(os.path.exists(os.path.join(model_dir, name)) for name in EXPORT_FILES)
+
+
+class SVDppScorer:
+    """
+    Full SVD++ predictions from exported arrays, without the surprise model.
+
+    r_ui = mu + b_u + b_i + q_i . (p_u + |N(u)|^-1/2 * sum_{j in N(u)} y_j)
+
+    The bracketed user vector is precomputed at export, so scoring a user
+    against every item is one matrix-vector product per block of items,
+    followed by a partial top-k selection. Item indices are the surprise inner
+    item IDs, i.e. the FAISS / item_id_map indices.
+    """
+
+    def __init__(self, model_dir, block_size=65536):
+        """
+        Parameters:
+        - model_dir (str): Directory written by export_svdpp().
+        - block_size (int): Maximum number of items scored per matrix product; batches of
+          users get smaller blocks, up to MAX_BLOCK_SCORES scores each.
+        """
+        self.model_dir = model_dir
+        self.block_size = block_size
+        self.global_mean = float(np.load(os.path.join(model_dir, GLOBAL_MEAN_FILE)))
+        self.bu = np.load(os.path.join(model_dir, USER_BIAS_FILE), mmap_mode='r')
+        self.bi = np.load(os.path.join(model_dir, ITEM_BIAS_FILE), mmap_mode='r')
+        self.qi = np.load(os.path.join(model_dir, ITEM_FACTORS_FILE), mmap_mode='r')
+        self.yj = np.load(os.path.join(model_dir, IMPLICIT_FACTORS_FILE), mmap_mode='r')
+        self.user_vectors = np.load(os.path.join(model_dir, USER_VECTORS_FILE), mmap_mode='r')
+
+    @property
+    def n_items(self):
+        return self.qi.shape[0]
+
+    def predict(self, user_idx, item_indices):
+        """Return the (unclipped) predicted ratings of one user for the given items."""
+        item_indices = np.asarray(item_indices, dtype=np.int64)
+        return (self.global_mean + self.bu[user_idx] + self.bi[item_indices]
+                + self.qi[item_indices] @ self.user_vectors[user_idx])
+
+    def score_vectors(self, user_idx, item_vectors):
+        """Predict for items outside the model (no item bias), e.g. new products with factor vectors."""
+        return self.global_mean + self.bu[user_idx] + np.asarray(item_vectors, dtype=np.float32) @ self.user_vectors[user_idx]
+
+    def top_k_many(self, user_indices, top_k=10, excluded=None):
+        """
+        Highest predicted items for several users.
+
+        Parameters:
+        - user_indices (array-like): Inner user indices (values of user_id_map).
+        - top_k (int): Number of items per user.
+        - excluded (list of np.ndarray, optional): Item indices to leave out, per user.
+
+        Returns:
+        - item_indices (np.ndarray), scores (np.ndarray): Shape (n_users, top_k), best
+          first; rows are padded with -1 / -inf when fewer items remain.
+        """
+        user_indices = np.asarray(user_indices, dtype=np.int64)
+        n_users = len(user_indices)
+        user_vectors = np.asarray(self.user_vectors[user_indices])
+        offsets = self.global_mean + np.asarray(self.bu[user_indices])[:, None]
+        block_size = max(1, min(self.block_size, MAX_BLOCK_SCORES // max(n_users, 1)))
+
+        best_items = np.full((n_users, 0), -1, dtype=np.int64)
+        best_scores = np.full((n_users, 0), -np.inf, dtype=np.float32)
+        rows = np.arange(n_users)[:, None]
+        for start in range(0, self.n_items, block_size):
+            end = min(start + block_size, self.n_items)
+            scores = (np.asarray(self.qi[start:end]) @ user_vectors.T).T
+            scores += offsets + np.asarray(self.bi[start:end])
+            if excluded is not None:
+                for row, items in enumerate(excluded):
+                    if items is not None and len(items):
+                        items = np.asarray(items, dtype=np.int64)
+                        scores[row, items[(items >= start) & (items < end)] - start] = -np.inf
+            # Keep each block's top-k only, then merge with the running best
+            k = min(top_k, end - start)
+            part = np.argpartition(-scores, k - 1, axis=1)[:, :k] if k < end - start else \
+                np.broadcast_to(np.arange(end - start), (n_users, end - start))
+            best_items = np.concatenate([best_items, part + start], axis=1)
+            best_scores = np.concatenate([best_scores, scores[rows, part]], axis=1)
+            if best_items.shape[1] > top_k:
+                keep = np.argpartition(-best_scores, top_k - 1, axis=1)[:, :top_k]
+                best_items, best_scores = best_items[rows, keep], best_scores[rows, keep]
+
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best_items, best_scores = best_items[rows, order], best_scores[rows, order]
+        best_items[~np.isfinite(best_scores)] = -1
+        if best_items.shape[1] < top_k:
+            pad = top_k - best_items.shape[1]
+            best_items = np.pad(best_items, ((0, 0), (0, pad)), constant_values=-1)
+            best_scores = np.pad(best_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+        return best_items, best_scores
+
+    def top_k(self, user_idx, top_k=10, excluded=None):
+        """
+        Highest predicted items for one user.
+
+        Returns:
+        - item_indices (np.ndarray), scores (np.ndarray): Best first, without padding.
+        """
+        item_indices, scores = self.top_k_many([user_idx], top_k, [excluded])
+        valid = item_indices[0] >= 0
+        return item_indices[0][valid], scores[0][valid]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python svdpp.py <SVD++_best_model.pkl> <output_dir>")
+        print("Requires scikit-surprise to unpickle the model; serving only needs the exported arrays.")
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as f:
+        svdpp_model = pickle.load(f)
+    n_users, n_items, n_factors = export_svdpp(svdpp_model, sys.argv[2])
+    print(f"Exported SVD++ ({n_users} users, {n_items} items, {n_factors} factors) into {sys.argv[2]}")
@@ -0,0 +1,287 @@
+# app/trending.py
+
+import os
+import json
+import time
+import heapq
+import numpy as np
+
+# Same blend as the notebook's popularity_score = 0.7 * avg + 0.3 * log(count)
+ALPHA = 0.7
+BETA = 0.3
+# Rebase the decay reference time once weights grow by more than e^REBASE_EXPONENT
+REBASE_EXPONENT = 50.0
+# Catch-all category used for the overall hot list
+ALL_CATEGORIES = None
+
+
+def _parse_event(line):
+    """(parent_asin, rating, timestamp or None) of one event log line, or None if it is not a rating event."""
+    try:
+        event = json.loads(line)
+        asin, rating, timestamp = event['parent_asin'], float(event['rating']), event.get('timestamp')
+        if timestamp is not None:
+            timestamp = float(timestamp)
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+    if not isinstance(asin, str) or not np.isfinite(rating) or (timestamp is not None and not np.isfinite(timestamp)):
+        return None
+    return asin, rating, timestamp
+
+
+class _CategoryTop:
+    """
+    Incrementally maintained candidate set for one category's top-N.
+
+    Holds at most `capacity` members in a lazy min-heap, plus an upper bound on
+    the score of every non-member. The members' top-n is exact whenever its
+    n-th score is at least that bound; otherwise the category is rebuilt.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.members = {}
+        self.heap = []
+        self.outside_bound = -np.inf
+
+    def _min(self):
+        # Drop stale heap entries whose score no longer matches the member
+        while self.heap and self.members.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def update(self, item, score):
+        if item in self.members:
+            self.members[item] = score
+            heapq.heappush(self.heap, (score, item))
+        elif len(self.members) < self.capacity:
+            self.members[item] = score
+            heapq.heappush(self.heap, (score, item))
+        else:
+            lowest = self._min()
+            if score > lowest[0]:
+                heapq.heappop(self.heap)
+                del self.members[lowest[1]]
+                self.outside_bound = max(self.outside_bound, lowest[0])
+                self.members[item] = score
+                heapq.heappush(self.heap, (score, item))
+            else:
+                self.outside_bound = max(self.outside_bound, score)
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(s, i) for i, s in self.members.items()]
+            heapq.heapify(self.heap)
+
+    def shift(self, delta):
+        """Add a constant to every score (used when the decay reference time is rebased)."""
+        self.members = {item: score + delta for item, score in self.members.items()}
+        self.heap = [(score, item) for item, score in self.members.items()]
+        heapq.heapify(self.heap)
+        self.outside_bound += delta
+
+    def top(self, n):
+        """Return the best n (item, score) pairs, or None if they cannot be proven exact."""
+        best = heapq.nlargest(n, self.members.items(), key=lambda pair: (pair[1], pair[0]))
+        if len(best) < n and self.outside_bound > -np.inf:
+            return None
+        if best and best[-1][1] < self.outside_bound:
+            return None
+        return best
+
+    def reset(self, items, scores):
+        """Rebuild from the full category with one partial selection."""
+        k = min(self.capacity, len(items))
+        if k < len(items):
+            chosen = np.argpartition(-scores, k - 1)[:k]
+            rest = np.ones(len(items), dtype=bool)
+            rest[chosen] = False
+            self.outside_bound = float(scores[rest].max())
+        else:
+            chosen = np.arange(len(items))
+            self.outside_bound = -np.inf
+        self.members = {int(items[i]): float(scores[i]) for i in chosen}
+        self.heap = [(score, item) for item, score in self.members.items()]
+        heapq.heapify(self.heap)
+
+
+class TrendingEngine:
+    """
+    Time-decayed popularity per ASIN with incrementally maintained per-category hot lists.
+
+    Each rating event adds rating * w and w to the item's decayed rating sum and
+    count, with w = exp(decay * (t - t0)). Scaling every weight by the same
+    reference time t0 means old contributions never need touching: the true
+    decayed values differ by a common factor, so the average is exact and
+    log(count) is shifted by the same constant for every item. Rankings by
+    0.7 * avg + 0.3 * log(count) are therefore stable over time, and the
+    per-category top sets stay valid between events.
+    """
+
+    def __init__(self, asins, categories, average_rating=None, rating_number=None,
+                 half_life_days=7.0, top_capacity=50, now=None, events_path=None):
+        """
+        Parameters:
+        - asins (sequence): ASIN of each item (catalog row order).
+        - categories (sequence): Category list of each item; an item is ranked in every
+          category of its list and in the overall list.
+        - average_rating, rating_number (sequence, optional): Catalog values used as the
+          initial state, as if observed at `now`.
+        - half_life_days (float): Half-life of an event's weight.
+        - top_capacity (int): Candidates kept per category; hot lists up to this length are O(n).
+        - now (float, optional): Unix time of the initial state (defaults to the current time).
+        - events_path (str, optional): Default JSON-lines event log for consume().
+        """
+        self.asins = list(asins)
+        self.asin_to_item = {asin: i for i, asin in enumerate(self.asins)}
+        self.decay = np.log(2.0) / (half_life_days * 86400.0)
+        self.t0 = time.time() if now is None else float(now)
+        self.top_capacity = top_capacity
+        self.events_path = events_path
+        self._offsets = {}
+
+        n_items = len(self.asins)
+        if rating_number is None:
+            self.counts = np.zeros(n_items)
+        else:
+            self.counts = np.nan_to_num(np.asarray(rating_number, dtype=np.float64))
+        if average_rating is None:
+            self.sums = np.zeros(n_items)
+        else:
+            self.sums = np.nan_to_num(np.asarray(average_rating, dtype=np.float64)) * self.counts
+
+        # Category name -> item indices, and item -> category names
+        self.item_categories = []
+        members = {ALL_CATEGORIES: list(range(n_items))}
+        for item, item_categories in enumerate(categories):
+            names = list(dict.fromkeys(item_categories)) if isinstance(item_categories, (list, tuple)) else []
+            self.item_categories.append(names)
+            for name in names:
+                members.setdefault(name, []).append(item)
+        self.category_items = {name: np.array(items, dtype=np.int64) for name, items in members.items()}
+        self.category_lookup = {name.lower(): name for name in self.category_items if name is not None}
+
+        self.tops = {}
+        for name in self.category_items:
+            self._rebuild(name)
+
+    def scores(self, items=None):
+        """Return the ranking score of items (all items by default)."""
+        sums = self.sums if items is None else self.sums[items]
+        counts = self.counts if items is None else self.counts[items]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            average = np.where(counts > 0, sums / counts, 0.0)
+            log_count = np.where(counts > 0, np.log(counts), -np.inf)
+        return ALPHA * average + BETA * log_count
+
+    def _rebuild(self, category):
+        top = self.tops.setdefault(category, _CategoryTop(self.top_capacity))
+        items = self.category_items[category]
+        top.reset(items, self.scores(items))
+
+    def _rebase(self, now):
+        """Move t0 to `now`, rescaling the stored weights; rankings are unchanged."""
+        factor = np.exp(-self.decay * (now - self.t0))
+        self.sums *= factor
+        self.counts *= factor
+        shift = BETA * np.log(factor)
+        for top in self.tops.values():
+            top.shift(shift)
+        self.t0 = now
+
+    def add_event(self, asin, rating, timestamp=None):
+        """
+        Record one rating / review event.
+
+        Parameters:
+        - asin (str): The rated product; unknown ASINs are ignored.
+        - rating (float): The rating given.
+        - timestamp (float, optional): Unix time of the event (defaults to now).
+
+        Returns:
+        - known (bool): Whether the ASIN is tracked.
+        """
+        item = self.asin_to_item.get(asin)
+        if item is None:
+            return False
+        timestamp = time.time() if timestamp is None else float(timestamp)
+        if self.decay * (timestamp - self.t0) > REBASE_EXPONENT:
+            self._rebase(timestamp)
+        weight = np.exp(self.decay * (timestamp - self.t0))
+        self.sums[item] += float(rating) * weight
+        self.counts[item] += weight
+
+        score = float(self.scores(np.array([item]))[0])
+        self.tops[ALL_CATEGORIES].update(item, score)
+        for name in self.item_categories[item]:
+            self.tops[name].update(item, score)
+        return True
+
+    def consume(self, events_path=None):
+        """
+        Apply events appended to a JSON-lines file (the engine's log by default) since the last call.
+
+        Each line needs 'parent_asin' and 'rating'; 'timestamp' is optional and
+        may be in seconds or milliseconds (as in the Amazon review dumps). Lines
+        that are not such an event (malformed JSON, purchases without a rating)
+        are skipped.
+
+        Returns:
+        - n_events (int): Number of events applied.
+        """
+        events_path = events_path or self.events_path
+        if events_path is None or not os.path.exists(events_path):
+            return 0
+        offset = self._offsets.get(events_path, 0)
+        if os.path.getsize(events_path) < offset:
+            offset = 0
+        n_events = 0
+        with open(events_path, 'r', encoding='utf-8') as f:
+            f.seek(offset)
+            while True:
+                line = f.readline()
+                # Leave a partially written last line for the next call
+                if not line or not line.endswith('\n'):
+                    break
+                offset = f.tell()
+                event = _parse_event(line)
+                if event is None:
+                    continue
+                asin, rating, timestamp = event
+                if timestamp is not None and timestamp > 1e11:
+                    timestamp = timestamp / 1000.0
+                n_events += self.add_event(asin, rating, timestamp)
+        self._offsets[events_path] = offset
+        return n_events
+
+    def find_category(self, name):
+        """Resolve a category name case-insensitively; returns None if unknown."""
+        return self.category_lookup.get(name.strip().lower())
+
+    def hot_products(self, category=None, n=5):
+        """
+        Return the current top-n ASINs of a category (or overall).
+
+        Parameters:
+        - category (str or None): Category name; None for the overall list.
+        - n (int): Number of products.
+
+        Returns:
+        - asins (list): Hot ASINs, best first (empty for an unknown category).
+        """
+        if category is not None:
+            category = self.find_category(category)
+            if category is None:
+                return []
+        top = self.tops[category]
+        best = top.top(n) if n <= self.top_capacity else None
+        if best is None:
+            # The candidate set cannot prove the order (or n is too large): rebuild this category
+            self._rebuild(category)
+            items = self.category_items[category]
+            scores = self.scores(items)
+            k = min(n, len(items))
+            if k == 0:
+                return []
+            chosen = np.argpartition(-scores, k - 1)[:k] if k < len(items) else np.arange(len(items))
+            best = sorted(((int(items[i]), float(scores[i])) for i in chosen),
+                          key=lambda pair: (pair[1], pair[0]), reverse=True)
+        return [self.asins[item] for item, _ in best]
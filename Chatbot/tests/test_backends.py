@@ -0,0 +1,36 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from backends import bf16_supported, compare_backends, prepare_backend
+from test_generation import _Tokenizer
+
+PROMPTS = tuple(' '.join(str(token) for token in prompt) for prompt in
+                ([5, 9, 13, 21, 8], [40, 2, 33], [7, 7, 18, 50, 61, 3, 12], [25], [11, 44, 6, 19]))
+
+
+def _load(backend):
+    torch.manual_seed(0)
+    # A wide weight init gives peaked next-token distributions, as a trained model has
+    config = GPT2Config(vocab_size=64, n_positions=128, n_embd=32, n_layer=2, n_head=2, initializer_range=0.2)
+    model = GPT2LMHeadModel(config).eval()
+    model, _ = prepare_backend(model, backend)
+    return _Tokenizer(), model
+
+
+def test_int8_and_compile_match_fp32():
+    results = compare_backends(('int8', 'compile'), PROMPTS, max_new_tokens=12, load=_load)
+    assert results['fp32']['identical_replies'] == 1.0
+    assert results['int8']['top1_agreement'] == 1.0
+    assert results['compile']['top1_agreement'] == 1.0
+    assert results['compile']['identical_replies'] == 1.0
+
+
+def test_bf16_matches_fp32_or_warns():
+    if not bf16_supported():
+        with pytest.warns(RuntimeWarning):
+            _, backend = prepare_backend(_load('fp32')[1], 'bf16')
+        assert backend == 'fp32'
+        return
+    results = compare_backends(('bf16',), PROMPTS, max_new_tokens=12, load=_load)
+    assert results['bf16']['top1_agreement'] == 1.0
@@ -0,0 +1,29 @@
+import pytest
+
+from batching import BatchScheduler
+from test_generation import PROMPT, _engine
+
+
+def test_failed_prefill_fails_admitted_requests():
+    engine = _engine(2)
+    model = engine.model
+    calls = []
+
+    def failing_model(*args, **kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise RuntimeError("out of memory")
+        return model(*args, **kwargs)
+
+    engine.model = failing_model
+    scheduler = BatchScheduler(engine, max_wait=0.05)
+    try:
+        first = [scheduler.submit(PROMPT, 'greedy', max_new_tokens=5) for _ in range(2)]
+        for future in first:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=30)
+        # The scheduler keeps serving after the failed step
+        text, stats = scheduler.generate(PROMPT, 'greedy', max_new_tokens=5)
+        assert stats['new_tokens'] == 5
+    finally:
+        scheduler.close()
@@ -0,0 +1,108 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from bundle import MANIFEST_FILE, ArtifactBundle, vectorizer_from_arrays, vectorizer_to_arrays, write_bundle
+from content_search import ContentSearchEngine
+from detail_store import DetailStore
+from interaction_store import InteractionStore, write_interaction_store
+from shared_artifacts import SharedIdMap, load_id_map, save_id_map
+from svdpp import SVDppScorer
+from test_catalog import DOCUMENTS, _products
+from test_precompute import _artifacts
+
+
+def _loaded(root):
+    """Artifacts in the order load_recommendation_system() returns them."""
+    user_factors, item_factors, user_id_map, item_id_map, index = _artifacts(root, n_users=6, n_items=5)
+    write_interaction_store(os.path.join(root, 'interactions'), [0, 0, 3], [1, 4, 2], 6)
+    vectorizer = TfidfVectorizer(stop_words=['box']).fit(DOCUMENTS)
+    engine = ContentSearchEngine(vectorizer, vectorizer.transform(DOCUMENTS))
+    recommendations = {'U000': ['A002', 'A003'], 'U003': ['A000']}
+    return (SVDppScorer(os.path.join(root, 'svdpp')), user_factors, item_factors, user_id_map, item_id_map,
+            index, recommendations, _products(), vectorizer, engine, None,
+            InteractionStore(os.path.join(root, 'interactions')), None)
+
+
+def test_bundle_round_trip_loads_lazily(tmp_path):
+    artifacts = _loaded(str(tmp_path))
+    (scorer, user_factors, item_factors, user_id_map, item_id_map, index, recommendations,
+     products, vectorizer, engine, _, exclusions, _) = artifacts
+    bundle_dir = str(tmp_path / 'bundle')
+    manifest = write_bundle(bundle_dir, artifacts, version='v1')
+    with pytest.raises(FileExistsError):
+        write_bundle(bundle_dir, artifacts)
+
+    bundle = ArtifactBundle(bundle_dir)
+    assert bundle.version == 'v1' and bundle.verify() == []
+    assert bundle.manifest == manifest
+    assert all(len(entry['sha256']) == 64 for entry in manifest['files'].values())
+    # Opening parses the manifest only; each artifact is loaded on first access
+    assert not {'user_factors', 'index', 'tfidf_engine', 'scorer'} & set(vars(bundle))
+    assert isinstance(bundle.user_factors, np.memmap)
+    assert 'user_factors' in vars(bundle) and 'item_factors' not in vars(bundle)
+
+    assert np.array_equal(bundle.user_factors, user_factors)
+    assert np.array_equal(bundle.item_factors, item_factors)
+    assert dict(bundle.user_id_map.items()) == user_id_map and dict(bundle.item_id_map.items()) == item_id_map
+    assert np.array_equal(bundle.index.search(user_factors, 3)[1], index.search(user_factors, 3)[1])
+    assert bundle.recommendations.get('U000') == ['A002', 'A003'] and 'U001' not in bundle.recommendations
+    assert isinstance(bundle.product_details, DetailStore)
+    assert bundle.product_details.row_asins() == products['parent_asin'].tolist()
+    assert isinstance(bundle.tfidf_vectorizer.vocabulary_, SharedIdMap)
+    assert np.array_equal(bundle.tfidf_engine.search('dog toy', 3), engine.search('dog toy', 3))
+    assert bundle.exclusions.seen_items(0).tolist() == exclusions.seen_items(0).tolist() == [1, 4]
+    for user_idx in range(len(user_factors)):
+        assert np.array_equal(bundle.scorer.top_k(user_idx, 3)[0], scorer.top_k(user_idx, 3)[0])
+
+
+def test_verify_detects_corrupted_and_missing_files(tmp_path):
+    bundle_dir = str(tmp_path / 'bundle')
+    write_bundle(bundle_dir, _loaded(str(tmp_path)))
+    bundle = ArtifactBundle(bundle_dir)
+
+    # Same size, shape and dtype: only the checksum notices the flipped byte
+    path = bundle.path('factors/item_factors.npy')
+    with open(path, 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+    os.remove(bundle.path('tfidf/idf.npy'))
+    assert sorted(bundle.verify()) == ['factors/item_factors.npy', 'tfidf/idf.npy']
+
+    # A replaced array with another shape is refused on load
+    np.save(bundle.path('factors/user_factors.npy'), np.zeros((2, 8), dtype=np.float32))
+    with pytest.raises(ValueError):
+        bundle.user_factors
+
+    with open(os.path.join(bundle_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    manifest['format_version'] += 1
+    with open(os.path.join(bundle_dir, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError):
+        ArtifactBundle(bundle_dir)
+
+
+def test_vectorizer_arrays_round_trip(tmp_path):
+    vectorizer = TfidfVectorizer(stop_words=['box'], ngram_range=(1, 2), sublinear_tf=True).fit(DOCUMENTS)
+    params, terms, idf = vectorizer_to_arrays(vectorizer)
+    # The parameters are plain JSON
+    params = json.loads(json.dumps(params))
+    queries = ['dog chew toy', 'salmon cat food box', 'unknown words']
+    expected = vectorizer.transform(queries).toarray()
+
+    rebuilt = vectorizer_from_arrays(params, terms, idf)
+    assert rebuilt.vocabulary_ == vectorizer.vocabulary_
+    assert np.allclose(rebuilt.transform(queries).toarray(), expected)
+
+    save_id_map(str(tmp_path), 'vocabulary', vectorizer.vocabulary_)
+    shared = vectorizer_from_arrays(params, terms, idf, load_id_map(str(tmp_path), 'vocabulary'))
+    assert np.allclose(shared.transform(queries).toarray(), expected)
+
+    with pytest.raises(ValueError):
+        vectorizer_to_arrays(TfidfVectorizer(tokenizer=str.split, token_pattern=None).fit(DOCUMENTS))
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from catalog import ItemCatalog
+from content_search import ContentSearchEngine
+from detail_store import DetailStore, build_detail_store
+from shared_artifacts import SharedIdMap, attach_artifacts, load_id_map, publish_artifacts, save_id_map
+
+DOCUMENTS = ['dog toy chew ball', 'cat food salmon', 'fish tank filter', 'dog leash', 'cat litter box']
+
+
+def _products():
+    asins = ['B04', 'B01', 'B03', 'B00', 'B02']
+    return pd.DataFrame({
+        'parent_asin': asins,
+        'description': [[text] for text in DOCUMENTS],
+        'details': [{} for _ in asins],
+        'categories': [['Pets'] for _ in asins],
+        'average_rating': [4.5, 4.0, 3.5, 5.0, 4.2],
+        'rating_number': [10, 20, 30, 40, 50],
+        'popularity_score': [1.0, 2.0, 3.0, 4.0, 5.0],
+    })
+
+
+def test_catalog_over_shared_arrays_matches_dict_catalog(tmp_path):
+    products = _products()
+    item_id_map = {'B00': 2, 'B03': 0, 'B04': 1, 'OLD': 3}
+    build_detail_store(products, str(tmp_path / 'details'))
+    save_id_map(str(tmp_path), 'item_id_map', item_id_map)
+
+    store = DetailStore(str(tmp_path / 'details'))
+    shared = ItemCatalog.from_detail_store(load_id_map(str(tmp_path), 'item_id_map'), store)
+    private = ItemCatalog.from_filtered_data(item_id_map, products)
+    # The ASIN arrays are the memory-mapped ones; no per-item Python objects are built
+    assert all(isinstance(array, np.memmap) for array in (shared.item_keys, shared.row_asins, shared.sorted_asins))
+    assert not any(isinstance(value, (dict, list)) or getattr(value, 'dtype', None) == object
+                   for value in vars(shared).values())
+
+    for catalog in (shared, private):
+        assert catalog.row_of('B03') == 2 and catalog.row_of('B99') is None and catalog.row_of('B030') is None
+        assert catalog.faiss_index_of('OLD') == 3 and catalog.faiss_index_of('B01') is None
+        assert catalog.asins_from_faiss([1, -1, 3, 2, 9]) == ['B04', 'OLD', 'B00']
+        assert catalog.asins_from_rows([4, 0]) == ['B02', 'B04']
+        assert catalog.rows_from_faiss([0, 1, 2, 3]).tolist() == [2, 0, 3, -1]
+        assert catalog.row_to_faiss.tolist() == [1, -1, 0, 2, -1]
+        assert catalog.popularity.tolist() == [1.0, 2.0, 3.0, 4.0, 5.0]
+
+
+def test_attached_vectorizer_is_not_unpickled(tmp_path):
+    products = _products()
+    vectorizer = TfidfVectorizer().fit(DOCUMENTS)
+    engine = ContentSearchEngine(vectorizer, vectorizer.transform(DOCUMENTS))
+    sources = {'test': [1, 2]}
+    assert publish_artifacts(sources, np.zeros((1, 4), dtype='float32'), np.zeros((4, 4), dtype='float32'),
+                             {'U0': 0}, {'B00': 0}, {'U0': ['B00']}, products, engine, str(tmp_path / 'shared'))
+
+    attached = attach_artifacts(sources, out_dir=str(tmp_path / 'shared'))
+    attached_vectorizer = attached['tfidf_vectorizer']
+    assert isinstance(attached_vectorizer.vocabulary_, SharedIdMap)
+    queries = ['dog toy', 'salmon for my cat', 'unknown words']
+    assert (attached_vectorizer.transform(queries) != vectorizer.transform(queries)).nnz == 0
+    assert attached['tfidf_matrix'].search('cat litter', 2).tolist() == engine.search('cat litter', 2).tolist()
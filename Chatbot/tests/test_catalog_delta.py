@@ -0,0 +1,128 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from bundle import ArtifactBundle, write_bundle
+from catalog import ItemCatalog
+from catalog_delta import CatalogDelta, DELTA_LOG_FILE, _finish_compaction, compact_catalog
+from faiss_index import build_item_index, index_params_of
+from rec_store import write_recommendation_store
+from recommendations import load_recommendation_system
+from svdpp import SVDppScorer
+from test_precompute import _artifacts
+
+
+def _delta(delta_dir):
+    vectorizer = TfidfVectorizer().fit(['dog toy chew ball', 'cat food salmon', 'fish tank filter'])
+    catalog = ItemCatalog({'B0': 0, 'B1': 1}, ['B0', 'B1'])
+    return CatalogDelta(str(delta_dir), vectorizer, catalog)
+
+
+def _product(asin, description='dog toy'):
+    return {'parent_asin': asin, 'description': [description], 'categories': ['Dogs']}
+
+
+def test_refresh_follows_log_replaced_by_compaction(tmp_path):
+    server, writer = _delta(tmp_path), _delta(tmp_path)
+    for i in range(3):
+        writer.upsert(_product(f'OLD{i}'))
+    assert server.refresh() and set(server.records) == {'OLD0', 'OLD1', 'OLD2'}
+
+    # Compaction moves the log away; upserts meanwhile go to a new, longer log
+    log_path = os.path.join(str(tmp_path), DELTA_LOG_FILE)
+    os.replace(log_path, log_path + '.compacting')
+    assert not server.refresh()
+    for i in range(6):
+        writer.upsert(_product(f'NEW{i}', 'cat food ' * 20))
+    _finish_compaction(str(tmp_path), log_path + '.compacting')
+
+    assert server.refresh()
+    # Compacted records stay until the base artifacts are reloaded
+    assert set(server.records) == {f'OLD{i}' for i in range(3)} | {f'NEW{i}' for i in range(6)}
+    assert server.tfidf.shape[0] == 9
+
+
+def test_refresh_reads_shorter_new_log_from_start(tmp_path):
+    server = _delta(tmp_path)
+    for i in range(5):
+        server.upsert(_product(f'OLD{i}', 'fish tank filter ' * 10))
+    log_path = os.path.join(str(tmp_path), DELTA_LOG_FILE)
+    os.replace(log_path, log_path + '.compacting')
+    _finish_compaction(str(tmp_path), log_path + '.compacting')
+    _delta(tmp_path).upsert(_product('NEW0'))
+
+    assert server.refresh()
+    assert set(server.records) == {f'OLD{i}' for i in range(5)} | {'NEW0'}
+
+
+def test_refresh_leaves_partial_line(tmp_path):
+    server = _delta(tmp_path)
+    server.upsert(_product('A'))
+    with open(os.path.join(str(tmp_path), DELTA_LOG_FILE), 'a', encoding='utf-8') as f:
+        f.write('{"parent_asin": "B", "descr')
+    assert not server.refresh()
+    assert set(server.records) == {'A'}
+
+
+def test_upsert_numpy_item_vector(tmp_path):
+    delta = _delta(tmp_path)
+    delta.upsert(dict(_product('V'), item_vector=np.arange(4, dtype=np.float32), rating_number=np.int64(3)))
+    assert delta.records['V']['item_vector'] == [0.0, 1.0, 2.0, 3.0]
+    assert delta.raw_vectors.shape == (1, 4)
+
+
+def test_compaction_keeps_index_params_and_updates_dependents(tmp_path):
+    recommendations_dir, data_dir = str(tmp_path / 'recommendations'), str(tmp_path / 'data')
+    os.makedirs(recommendations_dir)
+    _, item_factors, _, item_id_map, _ = _artifacts(recommendations_dir, n_items=60)
+    np.save(os.path.join(recommendations_dir, 'item_factors.npy'), item_factors)
+    index = build_item_index(item_factors, 'hnsw', hnsw_m=12, ef_construction=60)
+    index.hnsw.efSearch = 24
+    faiss.write_index(index, os.path.join(recommendations_dir, 'item_index.faiss'))
+    texts = [f'dog toy number{i}' for i in range(len(item_factors))]
+    vectorizer = TfidfVectorizer().fit(texts + ['cat food salmon'])
+    with open(os.path.join(recommendations_dir, 'tfidf_vectorizer.pkl'), 'wb') as f:
+        pickle.dump(vectorizer, f)
+    sparse.save_npz(os.path.join(recommendations_dir, 'tfidf_matrix.npz'), vectorizer.transform(texts))
+    os.makedirs(data_dir)
+    pd.DataFrame({'parent_asin': list(item_id_map), 'description': [[text] for text in texts],
+                  'details': [{} for _ in texts], 'categories': [['Dogs'] for _ in texts],
+                  'average_rating': 4.0, 'rating_number': 10, 'popularity_score': 1.0}
+                 ).to_pickle(os.path.join(data_dir, 'filtered_data_unique_asin.pkl'))
+    write_recommendation_store(os.path.join(data_dir, 'recommendations_store'), [('U000', ['A001'])])
+    bundle_dir = str(tmp_path / 'bundle')
+    write_bundle(bundle_dir, load_recommendation_system(shared=False, bundle_dir='',
+                                                        recommendations_dir=recommendations_dir, data_dir=data_dir),
+                 version='old')
+
+    # One new product and one changed product, both with factor vectors
+    delta_dir = os.path.join(data_dir, 'catalog_delta')
+    artifacts = load_recommendation_system(shared=False, bundle_dir='', recommendations_dir=recommendations_dir,
+                                           data_dir=data_dir)
+    scorer, delta = artifacts[0], artifacts[-1]
+    rng = np.random.default_rng(1)
+    new_vector, changed_vector = rng.normal(size=(2, 8)).astype('float32')
+    delta.upsert(dict(_product('NEW', 'cat food salmon'), item_vector=new_vector))
+    delta.upsert(dict(_product('A001'), item_vector=changed_vector))
+    before = scorer.score_vectors(3, delta.raw_vectors)
+
+    assert compact_catalog(delta_dir, recommendations_dir, data_dir, bundle_dir) == 2
+    index = faiss.read_index(os.path.join(recommendations_dir, 'item_index.faiss'))
+    assert index.ntotal == 61
+    assert index_params_of(index) == ({'hnsw_m': 12, 'ef_construction': 60}, {'ef_search': 24})
+
+    # The SVD++ export scores the new item as the delta did and takes the changed vector
+    scorer = SVDppScorer(os.path.join(recommendations_dir, 'svdpp'))
+    assert scorer.n_items == 61 and scorer.bi[60] == 0 and not scorer.yj[60].any()
+    assert np.allclose(scorer.qi[[60, 1]], [new_vector, changed_vector])
+    assert np.isclose(scorer.predict(3, [60])[0], before[delta.vector_asins.index('NEW')])
+
+    bundle = ArtifactBundle(bundle_dir)
+    assert bundle.version != 'old' and bundle.verify() == []
+    assert bundle.item_id_map['NEW'] == 60 and bundle.scorer.n_items == 61
+    assert not os.path.exists(bundle_dir + '.stale') and not os.path.exists(bundle_dir + '.new')
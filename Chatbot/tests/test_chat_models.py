@@ -0,0 +1,44 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from chat_models import load_merged_model, save_merged_model
+
+# The adapter is only needed to export the merged checkpoint
+peft = pytest.importorskip('peft')
+
+
+def _adapter_model():
+    torch.manual_seed(0)
+    base_model = GPT2LMHeadModel(GPT2Config(vocab_size=64, n_positions=32, n_embd=32, n_layer=2, n_head=2))
+    # Random (not zero) LoRA weights, so merging changes the base weights
+    config = peft.LoraConfig(r=4, lora_alpha=8, target_modules=['c_attn'], fan_in_fan_out=True, init_lora_weights=False)
+    return peft.get_peft_model(base_model, config).eval()
+
+
+def test_merged_checkpoint_reproduces_adapter_logits(tmp_path):
+    adapter_model = _adapter_model()
+    input_ids = torch.tensor([[5, 9, 13, 21, 8, 5, 9]])
+    with torch.no_grad():
+        expected = adapter_model(input_ids).logits
+        with adapter_model.disable_adapter():
+            base_logits = adapter_model(input_ids).logits
+    save_merged_model(adapter_model, str(tmp_path))
+
+    model = load_merged_model(str(tmp_path)).eval()
+    assert not any(parameter.requires_grad for parameter in model.parameters())
+    assert model.lm_head.weight.data_ptr() == model.transformer.wte.weight.data_ptr()
+    with torch.no_grad():
+        logits = model(input_ids).logits
+    assert torch.allclose(logits, expected, atol=1e-4)
+    assert not torch.allclose(logits, base_logits, atol=1e-4)
+
+
+def test_mismatched_checkpoint_is_refused(tmp_path):
+    GPT2LMHeadModel(GPT2Config(vocab_size=64, n_positions=32, n_embd=32, n_layer=2, n_head=2)).save_pretrained(
+        str(tmp_path))
+    config = GPT2Config.from_pretrained(str(tmp_path))
+    config.n_layer = 3
+    config.save_pretrained(str(tmp_path))
+    with pytest.raises(ValueError):
+        load_merged_model(str(tmp_path))
@@ -0,0 +1,61 @@
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+import content_search
+from content_search import ContentSearchEngine
+
+WORDS = ['dog', 'cat', 'toy', 'chew', 'ball', 'food', 'salmon', 'leash', 'tank', 'filter', 'litter', 'box']
+
+
+def _corpus(n_docs=300, seed=0):
+    rng = np.random.default_rng(seed)
+    # Reordered or repeated words give products whose scores tie up to rounding
+    documents = [' '.join(rng.choice(WORDS, size=rng.integers(1, 6))) for _ in range(n_docs)]
+    # Repeated documents tie on every query
+    documents[10] = documents[200] = documents[150]
+    return documents
+
+
+def _reference(query_matrix, tfidf_matrix, top_k):
+    """Rows ranked by cosine_similarity with a stable argsort: ties go to the higher row."""
+    scores = cosine_similarity(query_matrix, tfidf_matrix)
+    rounded = np.round(scores, content_search.SCORE_DECIMALS)
+    return [np.argsort(row, kind='stable')[-top_k:][::-1] for row in rounded], scores
+
+
+def test_search_matches_cosine_similarity_with_stable_ties(monkeypatch):
+    documents = _corpus()
+    vectorizer = TfidfVectorizer().fit(documents)
+    tfidf_matrix = vectorizer.transform(documents)
+    engine = ContentSearchEngine(vectorizer, tfidf_matrix)
+    queries = [documents[150], 'dog toy', 'salmon salmon food', 'unknown words', '', 'box', 'cat dog toy ball leash']
+    query_matrix = vectorizer.transform(queries)
+    # Several sparse products per call
+    monkeypatch.setattr(content_search, 'SEARCH_BATCH', 3)
+
+    for top_k in (1, 5, 40, 300, 400):
+        expected, scores = _reference(query_matrix, tfidf_matrix, top_k)
+        batched = engine.search_many(queries, top_k)
+        assert len(batched) == len(queries)
+        for i, query in enumerate(queries):
+            assert np.array_equal(batched[i], expected[i])
+            assert np.array_equal(engine.search(query, top_k), expected[i])
+            rows, row_scores = engine.top_k(query_matrix[i].indices.astype(np.int64), query_matrix[i].data,
+                                            top_k, return_scores=True)
+            assert np.array_equal(rows, expected[i])
+            assert np.allclose(row_scores, scores[i][expected[i]])
+    # The repeated documents come back highest row first
+    assert engine.search(documents[150], 3).tolist() == [200, 150, 10]
+
+
+def test_search_many_accepts_a_query_matrix():
+    documents = _corpus(seed=1)
+    vectorizer = TfidfVectorizer().fit(documents)
+    engine = ContentSearchEngine(vectorizer, vectorizer.transform(documents))
+    queries = ['dog toy', 'litter box', 'cat']
+    query_matrix = sparse.csr_matrix(vectorizer.transform(queries))
+    for from_matrix, from_strings in zip(engine.search_many(query_matrix, 7), engine.search_many(queries, 7)):
+        assert np.array_equal(from_matrix, from_strings)
+    assert engine.search_many([], 5) == []
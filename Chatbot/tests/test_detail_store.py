@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from detail_store import (CATEGORY_OFFSETS_FILE, CATEGORY_ROWS_FILE, CATEGORY_TEXT_FILE, DetailStore,
+                          SORTED_ASINS_FILE, build_detail_store)
+from test_catalog import _products
+
+
+def test_sorted_asins_are_memory_mapped(tmp_path):
+    build_detail_store(_products(), str(tmp_path))
+    store = DetailStore(str(tmp_path))
+    assert isinstance(store.sorted_asins, np.memmap)
+    assert [store.row_of(asin) for asin in ('B00', 'B01', 'B02', 'B03', 'B04', 'B05')] == [3, 1, 4, 2, 0, None]
+
+    # Stores built before sorted_asins.npy still open
+    os.remove(os.path.join(str(tmp_path), SORTED_ASINS_FILE))
+    assert DetailStore(str(tmp_path)).row_of('B02') == 4
+
+
+def test_missing_rating_number_reads_as_zero(tmp_path):
+    products = _products()
+    products.loc[1, 'rating_number'] = np.nan
+    build_detail_store(products, str(tmp_path))
+    assert DetailStore(str(tmp_path)).get('B01')['Number of Ratings'] == 0
+
+
+def test_categories_round_trip_with_separator_in_names(tmp_path):
+    products = _products()
+    products['categories'] = [['Dogs', 'Toys > Chew'], [], ['Cats'], ['Fish', ''], ['Birds']]
+    build_detail_store(products, str(tmp_path))
+    store = DetailStore(str(tmp_path))
+    assert store.categories() == products['categories'].tolist()
+    # The rendered text is unchanged
+    assert store.get('B04')['Categories'] == 'Dogs > Toys > Chew'
+
+    # Stores built before the category files split the rendered text
+    for name in (CATEGORY_ROWS_FILE, CATEGORY_OFFSETS_FILE, CATEGORY_TEXT_FILE):
+        os.remove(os.path.join(str(tmp_path), name))
+    assert DetailStore(str(tmp_path)).categories()[2] == ['Cats']
+
+
+def test_misses_are_not_cached(tmp_path):
+    build_detail_store(_products(), str(tmp_path))
+    store = DetailStore(str(tmp_path), cache_size=2)
+    assert store.get('B05') is None
+    assert store.get('B00') is store.get('B00')
+    assert store._load_row.cache_info().currsize == 1
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from faiss_index import build_item_index, default_pq_m, index_type_of
+
+
+def test_default_pq_m_divides_dimension():
+    assert default_pq_m(20) == 10
+    assert default_pq_m(64) == 16
+    assert default_pq_m(13) == 13
+    assert default_pq_m(17) == 1
+
+
+def test_ivf_pq_builds_for_svdpp_dimension():
+    factors = np.random.default_rng(0).standard_normal((2000, 20)).astype('float32')
+    index = build_item_index(factors, 'ivf_pq')
+    assert index_type_of(index) == 'ivf_pq'
+    assert index.ntotal == 2000
+    with pytest.raises(ValueError):
+        build_item_index(factors, 'ivf_pq', pq_m=16)
@@ -0,0 +1,114 @@
+import json
+
+import faiss
+import numpy as np
+
+from catalog import ItemCatalog
+from fold_in import InteractionLog, UserVectorCache, fold_in_user, read_user_interactions
+from recommendations import fold_in_new_user, recommend
+
+
+def _model(n_items=40, d=8, seed=0):
+    rng = np.random.default_rng(seed)
+    item_factors = rng.normal(size=(n_items, d)).astype('float32')
+    item_id_map = {f'A{i:03d}': i for i in range(n_items)}
+    index = faiss.IndexFlatIP(d)
+    index.add(item_factors)
+    catalog = ItemCatalog(item_id_map, list(item_id_map))
+    return item_factors, item_id_map, index, catalog
+
+
+def _write_events(path, events):
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def test_read_user_interactions_keeps_latest_rating(tmp_path):
+    path = tmp_path / 'review_events.jsonl'
+    _write_events(path, [
+        {'user_id': 'new', 'parent_asin': 'A001', 'rating': 2},
+        {'user_id': 'other', 'parent_asin': 'A002', 'rating': 5},
+        {'user_id': 'new', 'parent_asin': 'A003'},
+        {'user_id': 'new', 'parent_asin': 'A001', 'rating': 5},
+    ])
+    assert read_user_interactions(str(path), 'new') == (['A001', 'A003'], [5.0, 1.0])
+    assert read_user_interactions(str(tmp_path / 'missing.jsonl'), 'new') == ([], [])
+
+
+def test_new_user_with_interactions_gets_cf_results(tmp_path):
+    item_factors, item_id_map, index, catalog = _model()
+    user_factors = np.zeros((1, item_factors.shape[1]), dtype='float32')
+    user_id_map = {'known': 0}
+    path = tmp_path / 'review_events.jsonl'
+    _write_events(path, [{'user_id': 'new', 'parent_asin': f'A{i:03d}', 'rating': 5} for i in (3, 7, 11)])
+
+    user_vectors = UserVectorCache(item_factors, catalog)
+    args = (user_factors, item_factors, user_id_map, item_id_map, index, {})
+    assert recommend('new', *args, top_k=5, catalog=catalog, user_vectors=user_vectors) == []
+
+    assert fold_in_new_user('new', user_id_map, user_vectors, str(path))
+    recommendations = recommend('new', *args, top_k=5, catalog=catalog, user_vectors=user_vectors)
+    assert len(recommendations) == 5
+    # The user's own interactions are not recommended back
+    assert not {'A003', 'A007', 'A011'} & set(recommendations)
+
+    # Known users and users without logged interactions are left alone
+    assert not fold_in_new_user('known', user_id_map, user_vectors, str(path))
+    assert not fold_in_new_user('nobody', user_id_map, user_vectors, str(path))
+    assert 'nobody' not in user_vectors
+
+
+def test_interaction_log_tails_and_skips_bad_lines(tmp_path):
+    path = tmp_path / 'review_events.jsonl'
+    _write_events(path, [{'user_id': 'new', 'parent_asin': 'A001', 'rating': 4}])
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"user_id": "new", "parent_asin": \n')
+        f.write('[1, 2]\n\n')
+        f.write('{"user_id": "new", "parent_asin": "A002", "rating": "high"}\n')
+        f.write('{"user_id": "new", "parent_asin": "A003"')
+    log = InteractionLog(str(path))
+    assert log.refresh() == 1
+    assert log.interactions('new') == (['A001'], [4.0])
+
+    # The partial last line is completed, and only the new bytes are read
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(', "rating": 2}\n')
+        f.write(json.dumps({'user_id': 'other', 'parent_asin': 'A004'}) + '\n')
+    offset = log.offset
+    assert log.refresh() == 2
+    assert log.offset > offset
+    assert log.interactions('new') == (['A001', 'A003'], [4.0, 2.0])
+    assert log.count('other') == 1 and log.count('nobody') == 0
+
+    # A truncated log is indexed again
+    _write_events(path, [{'user_id': 'new', 'parent_asin': 'A005'}])
+    assert log.refresh() == 1
+    assert log.interactions('new') == (['A005'], [1.0])
+
+
+def test_cached_vector_is_refreshed_when_the_log_grows(tmp_path):
+    item_factors, item_id_map, index, catalog = _model()
+    path = tmp_path / 'review_events.jsonl'
+    events = [{'user_id': 'new', 'parent_asin': 'A003', 'rating': 5}]
+    _write_events(path, events)
+    user_vectors = UserVectorCache(item_factors, catalog)
+
+    assert fold_in_new_user('new', {}, user_vectors, data_dir=str(tmp_path))
+    first = user_vectors.get('new')
+    assert fold_in_new_user('new', {}, user_vectors, data_dir=str(tmp_path))
+    assert user_vectors.get('new') is first
+
+    _write_events(path, events + [{'user_id': 'new', 'parent_asin': 'A007', 'rating': 1}])
+    assert fold_in_new_user('new', {}, user_vectors, data_dir=str(tmp_path))
+    assert not np.allclose(user_vectors.get('new'), first)
+    assert set(user_vectors.seen_items('new')) == {3, 7}
+
+
+def test_fold_in_subtracts_the_model_baseline():
+    item_factors, item_id_map, index, catalog = _model()
+    item_bias = np.linspace(-1, 1, len(item_factors)).astype('float32')
+    user_vectors = UserVectorCache(item_factors, catalog, global_mean=4.0, item_bias=item_bias)
+    vector = user_vectors.fold_in('new', ['A003', 'A007', 'missing'], [5, 3, 1])
+    expected = fold_in_user(item_factors, [3, 7], [5, 3], 4.0 + item_bias[[3, 7]])
+    assert np.allclose(vector, expected)
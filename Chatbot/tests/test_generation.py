@@ -0,0 +1,102 @@
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from generation import ChatSession, GenerationEngine, PromptLookup, PROFILES, PROFILE_ORDER, select_token
+
+
+class _Tokenizer:
+    """Whitespace-separated token IDs, enough for the decoding loop."""
+    pad_token = '<eos>'
+    eos_token_id = 0
+
+    def encode(self, text):
+        return [int(token) for token in text.split()]
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return ' '.join(str(token) for token in tokens)
+
+
+def _engine(no_repeat_ngram_size):
+    torch.manual_seed(0)
+    config = GPT2Config(vocab_size=64, n_positions=128, n_embd=32, n_layer=2, n_head=2)
+    model = GPT2LMHeadModel(config)
+    return GenerationEngine(_Tokenizer(), model, device='cpu', profile='greedy', max_time=0,
+                            no_repeat_ngram_size=no_repeat_ngram_size)
+
+
+PROMPT = ' '.join(str(token) for token in [5, 9, 13, 21, 8, 5, 9, 13, 21, 8, 5, 9, 13])
+
+
+def _run(engine, profile):
+    tokens = list(engine.tokens(PROMPT, profile, max_new_tokens=30))
+    return tokens, engine.last_stats['forward_passes']
+
+
+def test_lookup_matches_greedy():
+    # Lookup decodes with its profile's no_repeat_ngram_size, whatever the engine's
+    expected, _ = _run(_engine(PROFILES['lookup']['no_repeat_ngram_size']), 'greedy')
+    for n in (0, 2, 3):
+        engine = _engine(n)
+        _, greedy_passes = _run(engine, 'greedy')
+        lookup, lookup_passes = _run(engine, 'lookup')
+        assert lookup == expected
+        assert lookup_passes < greedy_passes
+
+
+def test_lookup_with_ngram_blocking(monkeypatch):
+    monkeypatch.setitem(PROFILES, 'lookup', {'prompt_lookup': True, 'no_repeat_ngram_size': 3})
+    greedy, greedy_passes = _run(_engine(3), 'greedy')
+    lookup, lookup_passes = _run(_engine(2), 'lookup')
+    assert lookup == greedy
+    assert lookup_passes < greedy_passes
+
+
+def _conversation(session, turns=4, window=2):
+    """Greedy replies and cached prompt tokens of a conversation keeping the last `window` turns."""
+    engine = _engine(0)
+    history, replies = [], []
+    for turn in range(turns):
+        question = ' '.join(str(1 + (turn * 7 + i) % 60) for i in range(6))
+        tokens = list(engine.tokens(history[-window:] + [question], 'greedy', max_new_tokens=8, session=session))
+        replies.append((tokens, engine.last_stats['cached_tokens']))
+        history.append(question + ' ' + ' '.join(str(token) for token in tokens))
+    return replies
+
+
+def test_session_matches_uncached_run_when_the_window_moves():
+    uncached = _conversation(None)
+    exact = _conversation(ChatSession())
+    approximate = _conversation(ChatSession(exact=False))
+    assert [tokens for tokens, _ in exact] == [tokens for tokens, _ in uncached]
+    # Both reuse the history while the window grows
+    assert exact[1][1] > 0 and exact[2][1] == approximate[2][1] > 0
+    # On the turn the window moves, only the approximation keeps the remaining turns' entries
+    assert exact[3][1] == 0 < approximate[3][1]
+
+
+def test_draft_skips_matches_the_blocker_rejects():
+    lookup = PromptLookup(3, [1, 2, 3, 5, 2, 6, 1, 2])
+    # Longest match first: "1 2" was followed by "3 5"
+    assert lookup.draft(2) == [3, 5]
+    # Copying after "1 2" would repeat the trigram "1 2 3"; fall back to the latest "2"
+    assert lookup.draft(2, no_repeat_ngram_size=3) == [6, 1]
+    # Any copy repeats a bigram
+    assert lookup.draft(2, no_repeat_ngram_size=2) == []
+
+
+def test_lookup_is_not_a_load_fallback():
+    assert 'lookup' not in PROFILE_ORDER
+    engine = _engine(0)
+    assert engine.choose_profile('lookup', 30, 1.0) == 'lookup'
+    assert engine.choose_profile('sampling', 30, None) == 'sampling'
+
+
+def test_sampling_keeps_the_top_k_filter():
+    assert PROFILES['sampling']['top_k'] == 50
+    torch.manual_seed(0)
+    logits = torch.randn(1000)
+    # Flat logits: top-p alone would keep most of the vocabulary
+    allowed = set(torch.topk(logits / 0.7, 50).indices.tolist())
+    tokens = {select_token(logits, **PROFILES['sampling']) for _ in range(500)}
+    assert tokens <= allowed
+    assert len(tokens) > 1
@@ -0,0 +1,124 @@
+import os
+
+import faiss
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+import recommendations
+from catalog import ItemCatalog
+from catalog_delta import CatalogDelta
+from content_search import ContentSearchEngine
+from recommendations import HYBRID_WEIGHTS, hybrid_recommendation
+from svdpp import (SVDppScorer, GLOBAL_MEAN_FILE, USER_BIAS_FILE, ITEM_BIAS_FILE, USER_FACTORS_FILE,
+                   ITEM_FACTORS_FILE, IMPLICIT_FACTORS_FILE, USER_VECTORS_FILE)
+
+WORDS = ['dog', 'cat', 'toy', 'food', 'chew', 'tank', 'filter', 'leash', 'bed', 'treat', 'fish', 'litter']
+
+
+def _catalog(n_items=300, d=16):
+    rng = np.random.default_rng(0)
+    documents = [' '.join(rng.choice(WORDS, size=6)) for _ in range(n_items)]
+    vectorizer = TfidfVectorizer().fit(documents)
+    engine = ContentSearchEngine(vectorizer, vectorizer.transform(documents).tocsr())
+    asins = [f'A{i:04d}' for i in range(n_items)]
+    # Items with factors are stored in a different order than the catalog rows
+    item_id_map = {asin: idx for idx, asin in enumerate(reversed(asins))}
+    item_factors = rng.normal(size=(n_items, d)).astype('float32')
+    index = faiss.IndexFlatIP(d)
+    # Normalized like the exported index, so delta vectors compare with base items
+    index.add(item_factors / np.linalg.norm(item_factors, axis=1, keepdims=True))
+    catalog = ItemCatalog(item_id_map, asins, rng.random(n_items) * 5)
+    user_factors = rng.normal(size=(3, d)).astype('float32')
+    return engine, catalog, item_id_map, item_factors, index, user_factors
+
+
+def _loop_ranking(user_vector, keywords, engine, catalog, item_id_map, item_factors, top_k):
+    """The per-candidate Python blend the hybrid scorer replaces."""
+    content = cosine_similarity(engine.transform([keywords]), engine.matrix).flatten()
+    signals = []
+    for row, asin in enumerate(catalog.asins_from_rows(np.arange(len(catalog)))):
+        vector = item_factors[item_id_map[asin]].astype(np.float64)
+        cf = float(vector @ user_vector) / (np.linalg.norm(vector) or 1.0)
+        signals.append((asin, cf, content[row], catalog.popularity[row]))
+    normalized = []
+    for column in (1, 2, 3):
+        values = [signal[column] for signal in signals]
+        low, high = min(values), max(values)
+        normalized.append([(value - low) / ((high - low) or 1.0) for value in values])
+    scores = {}
+    for i, (asin, _, _, _) in enumerate(signals):
+        scores[asin] = (HYBRID_WEIGHTS['cf'] * normalized[0][i] + HYBRID_WEIGHTS['content'] * normalized[1][i]
+                        + HYBRID_WEIGHTS['popularity'] * normalized[2][i])
+    return sorted(scores, key=lambda asin: -scores[asin])[:top_k]
+
+
+def test_hybrid_ranking_matches_loop():
+    engine, catalog, item_id_map, item_factors, index, user_factors = _catalog()
+    user_id_map = {'U0': 0, 'U1': 1, 'U2': 2}
+    for user_id, keywords in (('U0', 'dog toy'), ('U1', 'fish tank filter'), ('U2', 'cat litter')):
+        # Every item is a candidate, so both rankings cover the same block
+        ranking = hybrid_recommendation(user_id, keywords, user_factors, item_factors, user_id_map, index, engine,
+                                        catalog, top_k=10, n_candidates=len(catalog))
+        expected = _loop_ranking(user_factors[user_id_map[user_id]].astype(np.float64), keywords, engine, catalog,
+                                 item_id_map, item_factors, 10)
+        assert ranking == expected
+
+
+def test_hybrid_scores_the_block_at_once(monkeypatch):
+    engine, catalog, item_id_map, item_factors, index, user_factors = _catalog()
+    calls = []
+    blend = recommendations.hybrid_scores
+
+    def recording_blend(cf_scores, content_scores, popularity, weights=None):
+        calls.append((len(cf_scores), len(content_scores), len(popularity)))
+        return blend(cf_scores, content_scores, popularity, weights)
+
+    score = engine.score
+
+    def recording_score(terms, weights):
+        calls.append('score')
+        return score(terms, weights)
+
+    monkeypatch.setattr(recommendations, 'hybrid_scores', recording_blend)
+    monkeypatch.setattr(engine, 'score', recording_score)
+    hybrid_recommendation('U0', 'dog toy', user_factors, item_factors, {'U0': 0}, index, engine, catalog,
+                          top_k=10, n_candidates=len(catalog))
+    # One sparse scoring of the query and one blend over the whole block, not one per candidate
+    assert calls == ['score', (len(catalog),) * 3]
+
+
+def _scorer(model_dir, user_factors, item_factors, item_bias):
+    os.makedirs(model_dir)
+    for name, array in ((GLOBAL_MEAN_FILE, np.float64(3.5)), (USER_BIAS_FILE, np.zeros(len(user_factors), 'float32')),
+                        (ITEM_BIAS_FILE, item_bias), (USER_FACTORS_FILE, user_factors),
+                        (ITEM_FACTORS_FILE, item_factors), (IMPLICIT_FACTORS_FILE, np.zeros_like(item_factors)),
+                        (USER_VECTORS_FILE, user_factors)):
+        np.save(os.path.join(model_dir, name), array)
+    return SVDppScorer(model_dir)
+
+
+def test_hybrid_takes_candidates_from_scorer_and_delta(tmp_path):
+    engine, catalog, item_id_map, item_factors, index, user_factors = _catalog()
+    user_id_map = {'U0': 0}
+    # Large biases on items FAISS ranks low for U0: only the scorer retrieves them
+    worst = np.argsort(item_factors @ user_factors[0])[:5]
+    item_bias = np.zeros(len(item_factors), dtype='float32')
+    item_bias[worst] = 100.0
+    scorer = _scorer(str(tmp_path / 'svdpp'), user_factors, item_factors, item_bias)
+    ranking = hybrid_recommendation('U0', None, user_factors, item_factors, user_id_map, index, engine, catalog,
+                                    top_k=5, n_candidates=5, scorer=scorer)
+    assert sorted(ranking) == sorted(catalog.asins_from_faiss(worst))
+
+    # A new product with a vector along the user's and a changed product matching the keywords
+    delta = CatalogDelta(str(tmp_path / 'delta'), engine.vectorizer, catalog)
+    delta.upsert({'parent_asin': 'NEW', 'description': ['bed'], 'categories': [], 'item_vector': user_factors[0] * 10,
+                  'average_rating': 5.0, 'rating_number': 1000})
+    delta.upsert({'parent_asin': 'A0007', 'description': 'fish tank filter', 'categories': []})
+    # top_k covers the whole candidate block
+    ranking = hybrid_recommendation('U0', 'fish tank filter', user_factors, item_factors, user_id_map, index,
+                                    engine, catalog, top_k=len(catalog), n_candidates=20, delta=delta)
+    assert ranking[0] == 'NEW' and 'A0007' in ranking and len(set(ranking)) == len(ranking)
+    without_delta = hybrid_recommendation('U0', 'fish tank filter', user_factors, item_factors, user_id_map, index,
+                                          engine, catalog, top_k=len(catalog), n_candidates=20)
+    assert 'NEW' not in without_delta and 'A0007' not in without_delta
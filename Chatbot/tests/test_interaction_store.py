@@ -0,0 +1,34 @@
+import faiss
+import numpy as np
+
+from interaction_store import search_excluding, search_excluding_many
+
+
+def test_heavy_user_does_not_widen_the_batch():
+    searches = []
+
+    class RecordingIndex(faiss.IndexFlatIP):
+        """Flat index that records the batch size and k of every search."""
+
+        def search(self, vectors, k, **kwargs):
+            searches.append((len(vectors), k))
+            return super().search(vectors, k, **kwargs)
+
+    rng = np.random.default_rng(0)
+    item_factors = rng.normal(size=(2000, 8)).astype('float32')
+    flat, index = faiss.IndexFlatIP(8), RecordingIndex(8)
+    flat.add(item_factors)
+    index.add(item_factors)
+    user_vectors = rng.normal(size=(6, 8)).astype('float32')
+    excluded = [None, np.array([3, 5]), np.arange(1000), np.array([7]), np.empty(0, dtype=np.int64),
+                np.array([1, 2, 4])]
+
+    scores, item_indices = search_excluding_many(index, user_vectors, 10, excluded, heavy=256)
+    for row, items in enumerate(excluded):
+        items = items if items is not None else np.empty(0, dtype=np.int64)
+        expected_scores, expected_items = search_excluding(flat, user_vectors[row], 10, items)
+        assert np.array_equal(item_indices[row], expected_items[0])
+        assert np.allclose(scores[row], expected_scores[0])
+        assert not np.isin(item_indices[row], items).any()
+    # Groups over-fetch by their own longest list; the user with 1000 exclusions searches alone
+    assert sorted(searches) == [(1, 10), (1, 11), (2, 10), (2, 13)]
@@ -0,0 +1,108 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+
+import svdpp
+
+from catalog import ItemCatalog
+from precompute import SCORER_WORKERS, default_workers, precompute_recommendations
+from rec_store import RecommendationStore, write_recommendation_matrix
+from recommendations import recommend
+from svdpp import (SVDppScorer, GLOBAL_MEAN_FILE, USER_BIAS_FILE, ITEM_BIAS_FILE, USER_FACTORS_FILE,
+                   ITEM_FACTORS_FILE, IMPLICIT_FACTORS_FILE, USER_VECTORS_FILE)
+
+
+def _artifacts(root, n_users=30, n_items=60, d=8, svdpp=True):
+    rng = np.random.default_rng(0)
+    user_factors = rng.normal(size=(n_users, d)).astype('float32')
+    item_factors = rng.normal(size=(n_items, d)).astype('float32')
+    user_id_map = {f'U{i:03d}': i for i in range(n_users)}
+    item_id_map = {f'A{i:03d}': i for i in range(n_items)}
+    np.save(os.path.join(root, 'user_factors.npy'), user_factors)
+    with open(os.path.join(root, 'user_id_map.pkl'), 'wb') as f:
+        pickle.dump(user_id_map, f)
+    with open(os.path.join(root, 'item_id_map.pkl'), 'wb') as f:
+        pickle.dump(item_id_map, f)
+    index = faiss.IndexFlatIP(d)
+    index.add(item_factors)
+    faiss.write_index(index, os.path.join(root, 'item_index.faiss'))
+    if svdpp:
+        # Large item biases make the SVD++ ranking differ from the inner product
+        out_dir = os.path.join(root, 'svdpp')
+        os.makedirs(out_dir)
+        np.save(os.path.join(out_dir, GLOBAL_MEAN_FILE), np.float64(3.5))
+        np.save(os.path.join(out_dir, USER_BIAS_FILE), rng.normal(size=n_users).astype('float32'))
+        np.save(os.path.join(out_dir, ITEM_BIAS_FILE), 5 * rng.normal(size=n_items).astype('float32'))
+        np.save(os.path.join(out_dir, USER_FACTORS_FILE), user_factors)
+        np.save(os.path.join(out_dir, ITEM_FACTORS_FILE), item_factors)
+        np.save(os.path.join(out_dir, IMPLICIT_FACTORS_FILE), np.zeros((n_items, d), dtype='float32'))
+        np.save(os.path.join(out_dir, USER_VECTORS_FILE), user_factors)
+    return user_factors, item_factors, user_id_map, item_id_map, index
+
+
+def test_precomputed_store_matches_svdpp_scorer(tmp_path):
+    user_factors, item_factors, user_id_map, item_id_map, index = _artifacts(str(tmp_path))
+    store_dir = str(tmp_path / 'store')
+    precompute_recommendations(str(tmp_path), store_dir, top_k=10, chunk_size=7)
+
+    store = RecommendationStore(store_dir)
+    scorer = SVDppScorer(str(tmp_path / 'svdpp'))
+    catalog = ItemCatalog(item_id_map, list(item_id_map))
+    assert store.ranking == 'svdpp'
+    for user_id, user_idx in user_id_map.items():
+        item_indices, _ = scorer.top_k(user_idx, 10)
+        assert store.get(user_id) == catalog.asins_from_faiss(item_indices)
+
+
+def test_scorer_takes_precedence_over_faiss_ranked_store(tmp_path):
+    user_factors, item_factors, user_id_map, item_id_map, index = _artifacts(str(tmp_path))
+    store_dir = str(tmp_path / 'store')
+    _, faiss_rows = index.search(user_factors, 10)
+    write_recommendation_matrix(store_dir, list(user_id_map), faiss_rows, list(item_id_map), 'faiss')
+
+    store = RecommendationStore(store_dir)
+    scorer = SVDppScorer(str(tmp_path / 'svdpp'))
+    catalog = ItemCatalog(item_id_map, list(item_id_map))
+    item_indices, _ = scorer.top_k(user_id_map['U004'], 10)
+    expected = catalog.asins_from_faiss(item_indices)
+    assert store.get('U004') != expected
+    assert recommend('U004', user_factors, item_factors, user_id_map, item_id_map, index, store, top_k=10,
+                     catalog=catalog, scorer=scorer) == expected
+    # Without the scorer the store is served as before
+    assert recommend('U004', user_factors, item_factors, user_id_map, item_id_map, index, store, top_k=10,
+                     catalog=catalog) == store.get('U004')
+
+
+class _BlockRecorder:
+    """Item factors that record the length of every block read from them."""
+
+    def __init__(self, array):
+        self.array, self.shape, self.blocks = array, array.shape, []
+
+    def __getitem__(self, key):
+        block = self.array[key]
+        self.blocks.append(len(block))
+        return block
+
+
+def test_scorer_blocks_shrink_with_the_batch(tmp_path, monkeypatch):
+    _artifacts(str(tmp_path))
+    scorer = SVDppScorer(str(tmp_path / 'svdpp'))
+    users = np.arange(30)
+    excluded = [np.array([u, u + 1]) for u in users]
+    expected = scorer.top_k_many(users, 10, excluded)
+    # 30 users within 100 scores: blocks of 3 items instead of the full 60
+    monkeypatch.setattr(svdpp, 'MAX_BLOCK_SCORES', 100)
+    scorer.qi = _BlockRecorder(scorer.qi)
+    item_indices, scores = scorer.top_k_many(users, 10, excluded)
+    assert max(scorer.qi.blocks) == 3
+    assert np.array_equal(item_indices, expected[0])
+    assert np.allclose(scores, expected[1])
+
+
+def test_default_workers_are_capped_for_svdpp():
+    cores = os.cpu_count() or 1
+    assert default_workers() == cores
+    assert default_workers(svdpp=True) == min(cores, SCORER_WORKERS)
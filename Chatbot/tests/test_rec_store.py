@@ -0,0 +1,73 @@
+import h5py
+import numpy as np
+import pytest
+
+from rec_store import (RecommendationStore, convert_h5_to_store, is_recommendation_store,
+                       write_recommendation_matrix, write_recommendation_store)
+
+RECOMMENDATIONS = {
+    'U10': ['B03', 'B01', 'B07'],
+    'U1': ['B01', 'B02'],
+    'Ü2': ['B07'],
+    'U3': [],
+    'AAAAAAAAAAAAAAAAAAAAAAAAAAAA': ['B02', 'B03'],
+}
+
+
+def _check(store, expected):
+    assert len(store) == len(expected)
+    for user_id, asins in expected.items():
+        assert user_id in store
+        assert store[user_id] == asins
+        assert store.get(user_id) == asins
+        assert store.get(user_id, top_k=1) == asins[:1]
+        assert len(store.item_indices(user_id)) == len(asins)
+    # Unknown users: prefixes, extensions, keys longer than the stored width and empty keys
+    for user_id in ('U', 'U100', 'U0', 'ZZZ', '', 'A' * 100):
+        assert user_id not in store
+        assert store.get(user_id) is None
+        assert len(store.item_indices(user_id)) == 0
+    with pytest.raises(KeyError):
+        store['U100']
+
+
+def test_dict_round_trip(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    assert write_recommendation_store(store_dir, RECOMMENDATIONS.items()) == len(RECOMMENDATIONS)
+    assert is_recommendation_store(store_dir)
+    store = RecommendationStore(store_dir)
+    _check(store, RECOMMENDATIONS)
+    # Keys are sorted for the binary search, and every distinct ASIN is stored once
+    assert list(store.user_keys) == sorted(store.user_keys)
+    assert sorted(store.asins) == [b'B01', b'B02', b'B03', b'B07']
+    assert isinstance(store.items, np.memmap) and store.ranking is None
+
+
+def test_convert_h5_to_store(tmp_path):
+    h5_path = str(tmp_path / 'recommendations.h5')
+    with h5py.File(h5_path, 'w') as hf:
+        for user_id, asins in RECOMMENDATIONS.items():
+            # Fixed-width rows padded with empty strings, as written by CF_model.ipynb
+            hf.create_dataset(user_id, data=np.array(asins + [''] * (3 - len(asins)), dtype='S3'))
+    store_dir = str(tmp_path / 'store')
+    assert convert_h5_to_store(h5_path, store_dir) == len(RECOMMENDATIONS)
+    _check(RecommendationStore(store_dir), RECOMMENDATIONS)
+
+
+def test_matrix_store_keeps_ranking_and_drops_padding(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    asins = ['B00', 'B01', 'B02']
+    write_recommendation_matrix(store_dir, ['U2', 'U1'], np.array([[2, 0, -1], [1, -1, -1]]), asins, 'svdpp')
+    store = RecommendationStore(store_dir)
+    _check(store, {'U1': ['B01'], 'U2': ['B02', 'B00']})
+    assert store.ranking == 'svdpp'
+
+    # Rewriting without a ranking drops the old note
+    write_recommendation_store(store_dir, [('U1', ['B00'])])
+    assert RecommendationStore(store_dir).ranking is None
+
+
+def test_empty_store(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    assert write_recommendation_store(store_dir, []) == 0
+    _check(RecommendationStore(store_dir), {})
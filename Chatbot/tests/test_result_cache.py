@@ -0,0 +1,77 @@
+from result_cache import ResultCache
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction_and_counters():
+    cache = ResultCache(max_entries=2, clock=_Clock())
+    cache.put(('user', 'a', 10), ['A1'])
+    cache.put(('user', 'b', 10), ['B1'])
+    assert cache.get(('user', 'a', 10)) == ['A1']
+    # 'b' is now the least recently used entry
+    cache.put(('user', 'c', 10), ['C1'])
+    assert cache.get(('user', 'b', 10)) is None
+    assert cache.get(('user', 'c', 10)) == ['C1']
+
+    computed = []
+    assert cache.get_or_compute(('user', 'a', 10), lambda: computed.append(1) or ['X']) == ['A1']
+    assert cache.get_or_compute(('user', 'd', 10), lambda: computed.append(1) or ['D1']) == ['D1']
+    assert computed == [1]
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (3, 2, 2, 2)
+    assert stats['hit_rate'] == 3 / 5
+
+
+def test_entries_expire_after_ttl():
+    clock = _Clock()
+    cache = ResultCache(ttl=10.0, clock=clock)
+    cache.put('key', ['A1'])
+    clock.now = 9.9
+    assert cache.get('key') == ['A1']
+    clock.now = 10.0
+    assert cache.get('key') is None
+    assert cache.stats()['expirations'] == 1 and len(cache) == 0
+
+
+def test_version_change_clears_entries_after_the_check_interval():
+    clock = _Clock()
+    versions = ['v1']
+    calls = []
+
+    def version_fn():
+        calls.append(clock.now)
+        return versions[-1]
+
+    cache = ResultCache(version_fn=version_fn, clock=clock, check_interval=5.0)
+    cache.put('key', ['A1'])
+    versions.append('v2')
+    # The version is not looked up again within the interval
+    for now in (0.0, 1.0, 4.9):
+        clock.now = now
+        assert cache.get('key') == ['A1']
+    assert calls == [0.0]
+
+    clock.now = 5.0
+    assert cache.get('key') is None
+    assert calls == [0.0, 5.0]
+    assert cache.stats()['invalidations'] == 1
+
+    # An unchanged version keeps the entries
+    cache.put('key', ['A2'])
+    clock.now = 10.0
+    assert cache.get('key') == ['A2']
+    assert calls == [0.0, 5.0, 10.0] and cache.stats()['invalidations'] == 1
+
+
+def test_zero_interval_checks_every_lookup():
+    calls = []
+    cache = ResultCache(version_fn=lambda: calls.append(1) or 'v1', clock=_Clock(), check_interval=0)
+    for _ in range(3):
+        cache.get('key')
+    assert len(calls) == 4
@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+
+from trending import ALPHA, BETA, TrendingEngine, _CategoryTop
+
+DAY = 86400.0
+T0 = 1.7e9
+
+
+def _catalog(n_items=40, seed=0):
+    rng = np.random.default_rng(seed)
+    asins = [f'A{i:03d}' for i in range(n_items)]
+    categories = [list(rng.choice(['Dogs', 'Cats', 'Fish', 'Toys'], size=rng.integers(1, 3), replace=False))
+                  for _ in asins]
+    return asins, categories, rng.uniform(1, 5, n_items), rng.integers(1, 50, n_items).astype(float)
+
+
+def _reference(asins, categories, average_rating, rating_number, events, now, half_life_days, category=None, n=3):
+    """Hot list recomputed from scratch with every weight decayed to `now`."""
+    decay = np.log(2.0) / (half_life_days * DAY)
+    counts = rating_number * np.exp(-decay * (now - T0))
+    sums = average_rating * counts
+    for asin, rating, timestamp in events:
+        weight = np.exp(-decay * (now - timestamp))
+        sums[asins.index(asin)] += rating * weight
+        counts[asins.index(asin)] += weight
+    scores = ALPHA * sums / counts + BETA * np.log(counts)
+    items = [i for i in range(len(asins)) if category is None or category in categories[i]]
+    return [asins[i] for i in sorted(items, key=lambda i: scores[i], reverse=True)[:n]]
+
+
+def test_decayed_hot_lists_match_a_full_recompute():
+    asins, categories, average_rating, rating_number = _catalog()
+    engine = TrendingEngine(asins, categories, average_rating, rating_number, half_life_days=1.0,
+                            top_capacity=4, now=T0)
+    rng = np.random.default_rng(1)
+    events = []
+    # 200 days of events: the decay reference time is rebased several times on the way
+    for timestamp in np.sort(rng.uniform(T0, T0 + 200 * DAY, 400)):
+        event = (asins[rng.integers(len(asins))], float(rng.integers(1, 6)), float(timestamp))
+        events.append(event)
+        assert engine.add_event(*event)
+        if len(events) % 50 == 0:
+            for category in (None, 'Dogs', 'cats', 'Fish'):
+                expected = _reference(asins, categories, average_rating, rating_number, events, timestamp, 1.0,
+                                      category and category.title())
+                assert engine.hot_products(category, 3) == expected
+    assert engine.t0 > T0
+    assert not engine.add_event('UNKNOWN', 5.0, T0)
+    assert engine.hot_products('Birds') == []
+
+
+def test_one_half_life_halves_an_event_weight():
+    engine = TrendingEngine(['A', 'B'], [[], []], half_life_days=7.0, now=T0)
+    engine.add_event('A', 5.0, T0)
+    engine.add_event('B', 5.0, T0 + 7 * DAY)
+    assert np.isclose(engine.counts[1] / engine.counts[0], 2.0)
+    assert engine.hot_products(n=2) == ['B', 'A']
+
+
+def test_category_top_stays_bounded_and_exact():
+    rng = np.random.default_rng(2)
+    top = _CategoryTop(capacity=5)
+    current = dict(enumerate(rng.uniform(0, 1, 20)))
+    top.reset(np.arange(20), np.array([current[i] for i in range(20)]))
+    answered = 0
+    for _ in range(2000):
+        item, score = int(rng.integers(20)), float(rng.uniform(0, 3))
+        # Scores only grow, as with new events between rebuilds
+        current[item] = max(current[item], score)
+        top.update(item, current[item])
+        assert len(top.members) <= top.capacity
+        # Stale heap entries are compacted away
+        assert len(top.heap) <= 4 * top.capacity + 1
+        best = top.top(3)
+        expected = sorted(current.items(), key=lambda pair: (pair[1], pair[0]), reverse=True)[:3]
+        assert best is None or best == expected
+        answered += best is not None
+    # The candidate set answers most lookups without a rebuild
+    assert answered > 1000
+
+
+def test_consume_resumes_from_its_offset_and_skips_bad_events(tmp_path):
+    path = tmp_path / 'review_events.jsonl'
+    engine = TrendingEngine(['A', 'B', 'C'], [[], [], []], now=T0, events_path=str(path))
+    assert engine.consume() == 0
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'parent_asin': 'A', 'rating': 5, 'timestamp': T0 * 1000}) + '\n')
+        f.write('{"parent_asin": "B", "rat\n')
+        f.write(json.dumps({'parent_asin': 'B'}) + '\n')
+        f.write(json.dumps({'parent_asin': 'B', 'rating': None}) + '\n')
+        f.write(json.dumps({'parent_asin': 'B', 'rating': 'five'}) + '\n')
+        f.write(json.dumps({'parent_asin': ['B'], 'rating': 4}) + '\n')
+        f.write('[1, 2]\n\n')
+        f.write(json.dumps({'parent_asin': 'UNKNOWN', 'rating': 4}) + '\n')
+        f.write('{"parent_asin": "C", "rating": 4')
+    assert engine.consume() == 1
+    assert engine.counts.tolist() == [1.0, 0.0, 0.0]
+    # Nothing new, and the partial last line is left for later
+    assert engine.consume() == 0
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(f', "timestamp": {T0}}}\n')
+    assert engine.consume() == 1
+    assert engine.counts.tolist() == [1.0, 0.0, 1.0]
+
+    # A truncated (rotated) log is read from the start
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'parent_asin': 'B', 'rating': 3, 'timestamp': T0}) + '\n')
+    assert engine.consume() == 1
+    assert engine.counts[1] == 1.0